@@ -1,13 +1,46 @@
-from flask import Flask, request, jsonify  # type: ignore[reportMissingImports]
+from flask import Flask, Request, Response, g, request, jsonify, stream_with_context  # type: ignore[reportMissingImports]
 from flask_cors import CORS  # type: ignore[reportMissingModuleSource]
+from werkzeug.exceptions import RequestEntityTooLarge  # type: ignore[reportMissingImports]
 from config import Config  # type: ignore[reportImplicitRelativeImport]
-from services.ai_service import AIService, AI_list  # type: ignore[reportImplicitRelativeImport]
-import base64
-import imghdr
+from services.ai_service import (  # type: ignore[reportImplicitRelativeImport]
+    AIService, RetryPolicy, CircuitBreaker, AIServiceRateLimitError, AIServiceCircuitOpenError, AIServiceOverloadedError
+)
+from services.solution_cache import create_solution_cache  # type: ignore[reportImplicitRelativeImport]
+from services.similarity_index import SimilarityIndex  # type: ignore[reportImplicitRelativeImport]
+from services.image_cache import ImageHashCache  # type: ignore[reportImplicitRelativeImport]
+from services.image_preprocess import create_image_preprocessor  # type: ignore[reportImplicitRelativeImport]
+from services.solver import ProblemSolver  # type: ignore[reportImplicitRelativeImport]
+from services.problem_store import ProblemStore  # type: ignore[reportImplicitRelativeImport]
+from services.health import HealthProbe  # type: ignore[reportImplicitRelativeImport]
+from services.model_catalog import ModelCatalog  # type: ignore[reportImplicitRelativeImport]
+from services.http_client import HTTPClientFactory  # type: ignore[reportImplicitRelativeImport]
+from services.provider_pool import create_provider_pool  # type: ignore[reportImplicitRelativeImport]
+from services.cascade import CascadeService  # type: ignore[reportImplicitRelativeImport]
+from services.rate_limiter import UpstreamLimiter  # type: ignore[reportImplicitRelativeImport]
+from services.upload import ImageUpload, make_stream_factory  # type: ignore[reportImplicitRelativeImport]
+from services.prompts import get_prompt_set  # type: ignore[reportImplicitRelativeImport]
+from services.job_queue import JobQueueFullError, create_job_queue  # type: ignore[reportImplicitRelativeImport]
+from services import metrics  # type: ignore[reportImplicitRelativeImport]
+import itertools
+import json
+import math
+import time
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+upload_stream_factory = make_stream_factory(app.config['UPLOAD_SPOOL_THRESHOLD'])
+
+
+class UploadRequest(Request):
+    """上传文件超过阈值后转存临时文件，不在内存中保留完整副本"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_stream_factory(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = UploadRequest
+
 # 配置CORS，允许前端跨域请求
 CORS(app, resources={
     r"/api/*": {
@@ -17,33 +50,537 @@ CORS(app, resources={
     }
 })
 
+# 上游HTTP连接池 - 进程内所有上游调用共享长连接
+http_clients = HTTPClientFactory(
+    max_connections=app.config['HTTP_MAX_CONNECTIONS'],
+    max_keepalive=app.config['HTTP_MAX_KEEPALIVE'],
+    keepalive_expiry=app.config['HTTP_KEEPALIVE_EXPIRY'],
+    connect_timeout=app.config['HTTP_CONNECT_TIMEOUT'],
+    http2=app.config['HTTP2_ENABLED']
+)
+
+def _upstream_resilience():
+    """按配置创建上游调用的重试策略、熔断器与限流器（每个后端独立一份），连接池各后端共享"""
+    return dict(
+        timeout=app.config['UPSTREAM_TIMEOUT'],
+        http_clients=http_clients,
+        retry_policy=RetryPolicy(
+            max_retries=app.config['UPSTREAM_MAX_RETRIES'],
+            backoff_base=app.config['UPSTREAM_BACKOFF_BASE'],
+            backoff_max=app.config['UPSTREAM_BACKOFF_MAX'],
+            budget_ratio=app.config['UPSTREAM_RETRY_BUDGET']
+        ),
+        circuit_breaker=CircuitBreaker(
+            failure_threshold=app.config['CIRCUIT_FAILURE_THRESHOLD'],
+            reset_timeout=app.config['CIRCUIT_RESET_TIMEOUT']
+        ),
+        limiter=UpstreamLimiter(
+            rpm=app.config['UPSTREAM_RPM'],
+            tpm=app.config['UPSTREAM_TPM'],
+            max_concurrency=app.config['UPSTREAM_MAX_CONCURRENCY'],
+            max_queue=app.config['UPSTREAM_QUEUE_SIZE'],
+            max_wait=app.config['UPSTREAM_QUEUE_TIMEOUT']
+        )
+    )
+
+def _prompt_options():
+    """按配置选择提示词版本、输出token预算与前缀缓存提示"""
+    return dict(
+        prompts=get_prompt_set(app.config['PROMPT_VERSION']),
+        max_output_tokens=app.config['MAX_OUTPUT_TOKENS'],
+        token_budget=app.config['TOKEN_BUDGET_ENABLED'],
+        prompt_cache=app.config['PROMPT_CACHE_HINTS']
+    )
+
 # 初始化AI服务 - 文字模型（用于文字搜题）
 text_ai_service = AIService(
     api_key=app.config['AI_API_KEY'],
     api_base=app.config['AI_API_BASE'],
-    model=app.config['AI_MODEL']
+    model=app.config['AI_MODEL'],
+    **_upstream_resilience(),
+    **_prompt_options()
 )
 
 # 初始化AI服务 - 视觉模型（用于拍照搜题）
 vision_ai_service = AIService(
     api_key=app.config['AI_VISION_API_KEY'],
     api_base=app.config['AI_VISION_API_BASE'],
-    model=app.config['AI_VISION_MODEL']
+    model=app.config['AI_VISION_MODEL'],
+    **_upstream_resilience(),
+    **_prompt_options()
+)
+
+# 多上游路由池 - 主后端加上配置的额外后端，按延迟选择并在故障时自动切换
+text_provider_pool = create_provider_pool(
+    text_ai_service,
+    app.config['AI_TEXT_PROVIDERS'],
+    strategy=app.config['ROUTING_STRATEGY'],
+    cooldown=app.config['PROVIDER_COOLDOWN']
 )
+vision_provider_pool = create_provider_pool(
+    vision_ai_service,
+    app.config['AI_VISION_PROVIDERS'],
+    strategy=app.config['ROUTING_STRATEGY'],
+    cooldown=app.config['PROVIDER_COOLDOWN']
+)
+
+# 模型分级 - 文字题目先由小模型解答，置信度不足或题目复杂时再交给主模型
+text_cascade = CascadeService(
+    AIService(
+        api_key=app.config['CASCADE_API_KEY'],
+        api_base=app.config['CASCADE_API_BASE'],
+        model=app.config['CASCADE_MODEL'],
+        **_upstream_resilience(),
+        **_prompt_options()
+    ),
+    text_provider_pool,
+    threshold=app.config['CASCADE_THRESHOLD'],
+    max_problem_chars=app.config['CASCADE_MAX_PROBLEM_CHARS']
+) if app.config['CASCADE_ENABLED'] else None
+
+# 模型目录 - 进程内共享，缓存上游模型列表
+model_catalog = ModelCatalog(
+    api_key=app.config['AI_API_KEY'],
+    api_base=app.config['AI_API_BASE'],
+    ttl=app.config['MODEL_CATALOG_TTL'],
+    stale_ttl=app.config['MODEL_CATALOG_STALE_TTL'],
+    http_client=http_clients.client
+)
+
+# 上游不可用时返回的默认模型列表
+DEFAULT_MODELS = [
+    'gpt-3.5-turbo',
+    'gpt-4',
+    'gpt-4-turbo'
+]
+
+# 后台定期探测上游连通性，启动过程不再等待网络请求
+health_probe = HealthProbe(
+    services={'text': text_ai_service, 'vision': vision_ai_service},
+    interval=app.config['HEALTH_PROBE_INTERVAL']
+)
+health_probe.start()
+
+# 初始化解答缓存与解题调度器
+solution_cache = create_solution_cache(
+    backend=app.config['CACHE_BACKEND'],
+    max_entries=app.config['CACHE_MAX_ENTRIES'],
+    ttl=app.config['CACHE_TTL'],
+    sqlite_path=app.config['CACHE_SQLITE_PATH']
+)
+similarity_index = SimilarityIndex(
+    directory=app.config['SIMILARITY_INDEX_DIR'],
+    threshold=app.config['SIMILARITY_THRESHOLD'],
+    max_entries=app.config['SIMILARITY_MAX_ENTRIES'],
+    ttl=app.config['SIMILARITY_TTL']
+) if app.config['SIMILARITY_ENABLED'] else None
+image_cache = ImageHashCache(
+    max_entries=app.config['IMAGE_CACHE_MAX_ENTRIES'],
+    ttl=app.config['IMAGE_CACHE_TTL'],
+    max_distance=app.config['IMAGE_HASH_MAX_DISTANCE'],
+    max_verify_distance=app.config['IMAGE_HASH_VERIFY_DISTANCE']
+) if app.config['IMAGE_CACHE_ENABLED'] else None
+problem_store = ProblemStore(app.config['PROBLEM_STORE_PATH']) if app.config['PROBLEM_STORE_ENABLED'] else None
+if problem_store is not None:
+    problem_store.start()
+solver = ProblemSolver(
+    text_service=text_cascade or text_provider_pool,
+    vision_service=vision_provider_pool,
+    cache=solution_cache,
+    similarity_index=similarity_index,
+    image_cache=image_cache,
+    image_preprocessor=create_image_preprocessor(app.config),
+    prompt_version=app.config['PROMPT_VERSION'],
+    two_stage_vision=app.config['VISION_TWO_STAGE'],
+    store=problem_store
+)
+
+# 异步解题任务队列 - 后台线程按上游容量依次解题
+job_queue = create_job_queue(
+    solver,
+    backend=app.config['JOB_BACKEND'],
+    workers=app.config['JOB_WORKERS'],
+    max_queue=app.config['JOB_QUEUE_SIZE'],
+    result_ttl=app.config['JOB_RESULT_TTL'],
+    max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+    sqlite_path=app.config['JOB_SQLITE_PATH'],
+    webhook_allowed_hosts=app.config['JOB_WEBHOOK_ALLOWED_HOSTS']
+)
+job_queue.start(recover_running=app.config['JOB_RECOVER_RUNNING'])
+
+def stop_background_services(timeout=0.0):
+    """
+    停止后台线程（进程退出前调用）
+
+    Args:
+        timeout: 等待执行中的解题任务完成的最长时间（秒）
+    """
+    health_probe.stop()
+    job_queue.stop(timeout)
+    if problem_store is not None:
+        problem_store.stop()
+
+def _collect_metrics():
+    """抓取时读取缓存、请求合并与各上游后端的已有统计，转换为指标样本"""
+    cache_stats = solver.cache_stats()
+    lookups, entries = [], []
+    for name in ('solution_cache', 'similarity_index', 'image_cache'):
+        stats = cache_stats[name]
+        if stats is None:
+            continue
+        misses = stats['misses'] if 'misses' in stats else stats['lookups'] - stats['hits']
+        lookups.append(({'cache': name, 'result': 'hit'}, stats['hits']))
+        lookups.append(({'cache': name, 'result': 'miss'}, misses))
+        entries.append(({'cache': name}, stats['size']))
+    single_flight = cache_stats['single_flight']
+    jobs = job_queue.stats()
+    http_pool = http_clients.stats()
+    pool_connections = []
+    for client in ('sync', 'async'):
+        pool = http_pool[f'{client}_pool']
+        if pool is not None:
+            pool_connections.append(({'client': client, 'state': 'idle'}, pool['idle']))
+            pool_connections.append(({'client': client, 'state': 'active'}, pool['active']))
+
+    upstream = {name: [] for name in (
+        'upstream_queue_depth', 'upstream_in_flight', 'upstream_shed_total',
+        'upstream_queue_wait_p95_seconds', 'upstream_circuit_open', 'upstream_retries_total'
+    )}
+    for route, pool in (('text', text_provider_pool), ('image', vision_provider_pool)):
+        for provider in pool.status()['providers']:
+            labels = {'route': route, 'model': provider['model'], 'api_base': provider['api_base']}
+            limiter = provider['limiter']
+            upstream['upstream_queue_depth'].append((labels, limiter['queue_depth']))
+            upstream['upstream_in_flight'].append((labels, limiter['in_flight']))
+            upstream['upstream_shed_total'].append((labels, limiter['shed']))
+            upstream['upstream_queue_wait_p95_seconds'].append((labels, limiter['wait_ms']['p95'] / 1000))
+            upstream['upstream_circuit_open'].append((labels, 0 if provider['circuit']['state'] == 'closed' else 1))
+            upstream['upstream_retries_total'].append((labels, provider['retry']['retries']))
+
+    return [
+        ('cache_lookups_total', 'counter', '缓存查询次数', lookups),
+        ('cache_entries', 'gauge', '缓存条目数', entries),
+        ('single_flight_calls_total', 'counter', '解题请求合并统计（executed为实际调用上游，coalesced为合并等待）', [
+            ({'result': 'executed'}, single_flight['upstream_calls']),
+            ({'result': 'coalesced'}, single_flight['coalesced'])
+        ]),
+        ('jobs_queue_depth', 'gauge', '排队中的异步解题任务数', [({}, jobs['queue_depth'])]),
+        ('jobs_running', 'gauge', '执行中的异步解题任务数', [({}, jobs['running'])]),
+        ('jobs_finished_total', 'counter', '已结束的异步解题任务数', [
+            ({'status': 'succeeded'}, jobs['succeeded']),
+            ({'status': 'failed'}, jobs['failed'])
+        ]),
+        ('upstream_queue_depth', 'gauge', '上游限流队列中等待的请求数', upstream['upstream_queue_depth']),
+        ('upstream_in_flight', 'gauge', '上游进行中的请求数', upstream['upstream_in_flight']),
+        ('upstream_shed_total', 'counter', '上游限流丢弃的请求数', upstream['upstream_shed_total']),
+        ('upstream_queue_wait_p95_seconds', 'gauge', '最近请求的限流排队耗时P95', upstream['upstream_queue_wait_p95_seconds']),
+        ('upstream_circuit_open', 'gauge', '熔断器是否打开（含半开）', upstream['upstream_circuit_open']),
+        ('upstream_retries_total', 'counter', '上游调用重试次数', upstream['upstream_retries_total']),
+        ('http_pool_connections', 'gauge', '上游连接池中的连接数', pool_connections),
+        ('http_pool_requests_total', 'counter', '经共享连接池发出的上游请求数', [({}, http_pool['requests'])]),
+        ('http_pool_connections_opened_total', 'counter', '新建的上游连接数（TCP连接与TLS握手）', [
+            ({'stage': 'tcp'}, http_pool['connections_opened']),
+            ({'stage': 'tls'}, http_pool['tls_handshakes'])
+        ])
+    ]
+
+metrics.REGISTRY.register_collector(_collect_metrics)
+
+@app.before_request
+def start_request_metrics():
+    """记录请求开始时间与路由标签"""
+    g.request_start = time.perf_counter()
+    metrics.set_route(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def record_request_metrics(response):
+    """记录请求数与处理耗时（流式接口只统计到返回响应头）"""
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - g.request_start)
+    return response
+
+@metrics.timed('parse')
+def _read_problem():
+    """
+    从JSON请求体中读取题目
+
+    Returns:
+        (题目文本, 错误响应)，校验通过时错误响应为None
+    """
+    data = request.get_json()
+    
+    if not data or 'problem' not in data:
+        return None, (jsonify({
+            'success': False,
+            'error': '缺少题目内容'
+        }), 400)
+    
+    problem = data['problem'].strip()
+    
+    if not problem:
+        return None, (jsonify({
+            'success': False,
+            'error': '题目内容不能为空'
+        }), 400)
+
+    return problem, None
+
+def _too_large_response():
+    """请求体超过 MAX_CONTENT_LENGTH 时的错误响应"""
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({
+        'success': False,
+        'error': f'图片过大，最大支持 {limit_mb:g}MB'
+    }), 413
+
+@metrics.timed('parse')
+def _read_image():
+    """
+    从表单中读取上传的图片
+
+    上传内容按块接收（大文件转存临时文件），只读取文件头校验格式
+
+    Returns:
+        (上传图片, 错误响应)，校验通过时错误响应为None
+    """
+    try:
+        files = request.files
+    except RequestEntityTooLarge:
+        return None, _too_large_response()
+
+    # 检查是否有文件上传
+    if 'image' not in files:
+        return None, (jsonify({
+            'success': False,
+            'error': '缺少图片文件'
+        }), 400)
+
+    file = files['image']
+
+    if file.filename == '':
+        return None, (jsonify({
+            'success': False,
+            'error': '未选择图片文件'
+        }), 400)
+
+    # 根据文件头魔数验证文件类型
+    upload = ImageUpload.from_stream(file.stream)
+
+    if upload is None:
+        return None, (jsonify({
+            'success': False,
+            'error': '不支持的图片格式，请上传 JPG 或 PNG 格式'
+        }), 400)
+
+    return upload, None
+
+def _solution_data(problem, result, model_type):
+    """解题结果的响应数据，图片题目已转写为文字时使用识别出的题目；开启模型分级时附带给出解答的级别"""
+    data = {
+        'problem': result.get('problem', problem),
+        'solution': result['solution'],
+        'model': result['model'],
+        'model_type': model_type,
+        'cached': result['cached'],
+        'cache_type': result['cache_type']
+    }
+    if 'tier' in result:
+        data['tier'] = result['tier']
+    return data
+
+# 上游限流、熔断或本地排队已满：请求未发出，客户端稍后重试即可
+BUSY_ERRORS = (AIServiceRateLimitError, AIServiceCircuitOpenError)
+
+def _busy_error(e):
+    """
+    可重试错误的响应内容：上游返回429时为429，本地排队已满或熔断中为503，均附带 Retry-After
+
+    Returns:
+        (响应数据, HTTP状态码, 响应头)
+    """
+    status = 429 if isinstance(e, AIServiceRateLimitError) and not isinstance(e, AIServiceOverloadedError) else 503
+    retry_after = e.retry_after if e.retry_after is not None else app.config['BUSY_RETRY_AFTER']
+    retry_after = max(1, math.ceil(retry_after))
+    body = {
+        'success': False,
+        'error': f'服务繁忙，请稍后重试: {str(e)}',
+        'retry_after': retry_after
+    }
+    return body, status, {'Retry-After': str(retry_after)}
+
+def _busy_response(e):
+    body, status, headers = _busy_error(e)
+    return jsonify(body), status, headers
+
+def _prime_events(events):
+    """
+    预先取出解答首个片段（或错误）之前的事件，使限流、熔断等错误在发送响应头之前抛出
+
+    Returns:
+        包含已取出事件的完整事件迭代器
+    """
+    head = []
+    for event, data in events:
+        head.append((event, data))
+        if event != 'meta':
+            break
+    return itertools.chain(head, events)
+
+@metrics.timed('serialize')
+def _solution_response(problem, result, model_type):
+    """构造解题成功的响应"""
+    return jsonify({
+        'success': True,
+        'data': _solution_data(problem, result, model_type)
+    })
+
+@metrics.timed('parse')
+def _read_batch():
+    """
+    读取批量解题请求
+
+    JSON请求体为 {"problems": [...]}；multipart表单中 problems 字段可重复，images 为多个图片文件
+
+    Returns:
+        (题目文本或上传图片列表, 错误响应)，校验通过时错误响应为None
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            problems = request.form.getlist('problems')
+            files = request.files.getlist('images')
+        else:
+            problems = (request.get_json(silent=True) or {}).get('problems') or []
+            files = []
+    except RequestEntityTooLarge:
+        return None, _too_large_response()
+
+    items, error = _batch_items(problems, [(file.filename, file.stream) for file in files],
+                                app.config['BATCH_MAX_ITEMS'])
+    if error:
+        return None, (jsonify({
+            'success': False,
+            'error': error
+        }), 400)
+
+    return items, None
+
+def _batch_items(problems, files, max_items):
+    """
+    校验批量解题的题目与图片（Flask 与异步应用共用）
+
+    Args:
+        problems: 题目文本列表
+        files: (文件名, 文件对象) 列表
+        max_items: 单次最多题目数
+
+    Returns:
+        (题目文本或上传图片列表, 错误信息)，校验通过时错误信息为None
+    """
+    if not isinstance(problems, list) or not all(isinstance(problem, str) for problem in problems):
+        return None, 'problems 必须是题目文本数组'
+
+    items = []
+    for problem in problems:
+        problem = problem.strip()
+        if not problem:
+            return None, '题目内容不能为空'
+        items.append(problem)
+
+    for filename, stream in files:
+        upload = ImageUpload.from_stream(stream)
+        if upload is None:
+            return None, f'不支持的图片格式（{filename}），请上传 JPG 或 PNG 格式'
+        items.append(upload)
+
+    if not items:
+        return None, '缺少题目内容'
+    if len(items) > max_items:
+        return None, f'单次最多提交 {max_items} 道题'
+    return items, None
+
+def _format_batch_line(index, item, result, error):
+    """格式化一道题的批量解题结果（NDJSON的一行）"""
+    if error is not None:
+        line = {'index': index, 'success': False, 'error': error}
+    elif isinstance(item, str):
+        line = {'index': index, 'success': True, 'data': _solution_data(item, result, 'text')}
+    else:
+        line = {'index': index, 'success': True, 'data': _solution_data('图片题目（已识别）', result, 'vision')}
+    return json.dumps(line, ensure_ascii=False) + '\n'
+
+def _format_batch_summary(total, succeeded, elapsed):
+    """格式化批量解题的汇总行"""
+    return json.dumps({
+        'done': True,
+        'total': total,
+        'succeeded': succeeded,
+        'failed': total - succeeded,
+        'elapsed_ms': round(elapsed * 1000, 1)
+    }, ensure_ascii=False) + '\n'
+
+def _ndjson_response(lines):
+    """将逐行产出的结果包装为NDJSON流式响应"""
+    return Response(
+        stream_with_context(lines),
+        mimetype='application/x-ndjson',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def _format_sse(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _sse_response(events, meta):
+    """
+    将解题事件流包装为SSE响应
+
+    Args:
+        events: ProblemSolver 产出的 (事件名, 数据) 迭代器
+        meta: 合并到 meta 事件中的附加字段
+    """
+    def generate():
+        try:
+            for event, data in events:
+                if event == 'meta':
+                    data = {**meta, **data}
+                yield _format_sse(event, data)
+        except Exception as e:
+            app.logger.error(f"流式解题错误: {str(e)}")
+            yield _format_sse('error', {'error': f'服务器错误: {str(e)}'})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 禁用Nginx缓冲，保证增量输出
+        }
+    )
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_entity_too_large(e):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+    return _too_large_response()
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """健康检查接口"""
+    """健康检查接口（上游状态取自后台探测的缓存结果）"""
     return jsonify({
         'status': 'ok',
-        'message': 'AI Solver API is running'
+        'message': 'AI Solver API is running',
+        'upstream': health_probe.status()
     })
 
 @app.route('/api/routing', methods=['GET'])
 def get_routing_info():
     """
     获取模型路由配置信息
-    展示当前使用的模型路由规则
+    展示当前使用的模型路由规则，以及各后端的实时延迟、错误率与排序
     """
     return jsonify({
         'success': True,
@@ -55,7 +592,9 @@ def get_routing_info():
                     'method': 'POST',
                     'model_type': 'text',
                     'model': app.config['AI_MODEL'],
-                    'api_base': app.config['AI_API_BASE']
+                    'api_base': app.config['AI_API_BASE'],
+                    'routing': text_provider_pool.status(),
+                    'cascade': text_cascade.status() if text_cascade is not None else None
                 },
                 'image_search': {
                     'description': '拍照搜题',
@@ -63,9 +602,11 @@ def get_routing_info():
                     'method': 'POST',
                     'model_type': 'vision',
                     'model': app.config['AI_VISION_MODEL'],
-                    'api_base': app.config['AI_VISION_API_BASE']
+                    'api_base': app.config['AI_VISION_API_BASE'],
+                    'routing': vision_provider_pool.status()
                 }
             },
+            'http_pool': http_clients.stats(),
             'note': '系统会根据不同的搜题方式自动路由到对应的AI模型'
         }
     })
@@ -77,41 +618,23 @@ def solve_problem():
     接收题目，调用AI模型返回答案
     """
     try:
-        data = request.get_json()
-        
-        if not data or 'problem' not in data:
-            return jsonify({
-                'success': False,
-                'error': '缺少题目内容'
-            }), 400
-        
-        problem = data['problem'].strip()
-        
-        if not problem:
-            return jsonify({
-                'success': False,
-                'error': '题目内容不能为空'
-            }), 400
+        problem, error_response = _read_problem()
+        if error_response:
+            return error_response
         
-        # 调用AI服务解题 - 使用文字模型
-        solution = text_ai_service.solve_problem(problem)
+        # 调用AI服务解题 - 使用文字模型，优先命中缓存
+        result = solver.solve_text(problem)
         
-        if solution:
-            return jsonify({
-                'success': True,
-                'data': {
-                    'problem': problem,
-                    'solution': solution,
-                    'model': app.config['AI_MODEL'],
-                    'model_type': 'text'
-                }
-            })
+        if result:
+            return _solution_response(problem, result, 'text')
         else:
             return jsonify({
                 'success': False,
                 'error': '无法获取解答，请检查API配置'
             }), 500
     
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
     except Exception as e:
         app.logger.error(f"解题错误: {str(e)}")
         return jsonify({
@@ -126,130 +649,265 @@ def solve_image():
     接收图片，调用AI模型识别并解答
     """
     try:
-        # 检查是否有文件上传
-        if 'image' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': '缺少图片文件'
-            }), 400
+        upload, error_response = _read_image()
+        if error_response:
+            return error_response
 
-        file = request.files['image']
+        # 调用AI服务解题 - 使用视觉模型，优先命中图片缓存
+        result = solver.solve_image(upload)
 
-        if file.filename == '':
+        if result:
+            return _solution_response('图片题目（已识别）', result, 'vision')
+        else:
             return jsonify({
                 'success': False,
-                'error': '未选择图片文件'
-            }), 400
+                'error': '无法获取解答，请检查API配置'
+            }), 500
 
-        # 验证文件类型
-        allowed_types = ['jpg', 'jpeg', 'png']
-        file_type = imghdr.what(file)
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        app.logger.error(f"图片解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
 
-        if file_type not in allowed_types:
-            return jsonify({
-                'success': False,
-                'error': '不支持的图片格式，请上传 JPG 或 PNG 格式'
-            }), 400
+@app.route('/api/solve/batch', methods=['POST'])
+def solve_batch():
+    """
+    批量解题API接口
+    接收多道题目（文字和/或图片），去重后并发解题，以NDJSON按完成顺序逐行返回结果
+    """
+    try:
+        items, error_response = _read_batch()
+        if error_response:
+            return error_response
 
-        # 读取图片并转换为Base64
-        image_data = file.read()
-        image_base64 = base64.b64encode(image_data).decode('utf-8')
+        def generate():
+            start = time.perf_counter()
+            succeeded = 0
+            for index, result, error in solver.solve_batch(items, app.config['BATCH_CONCURRENCY']):
+                if error is None:
+                    succeeded += 1
+                yield _format_batch_line(index, items[index], result, error)
+            yield _format_batch_summary(len(items), succeeded, time.perf_counter() - start)
 
-        # 调用AI服务解题 - 使用视觉模型
-        solution = vision_ai_service.solve_problem_with_image(image_base64)
+        return _ndjson_response(generate())
 
-        if solution:
-            return jsonify({
-                'success': True,
-                'data': {
-                    'problem': '图片题目（已识别）',
-                    'solution': solution,
-                    'model': app.config['AI_VISION_MODEL'],
-                    'model_type': 'vision'
-                }
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '无法获取解答，请检查API配置'
-            }), 500
+    except Exception as e:
+        app.logger.error(f"批量解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/solve/stream', methods=['POST'])
+def solve_problem_stream():
+    """
+    流式解题API接口
+    以Server-Sent Events逐段返回AI生成的解答
+    """
+    try:
+        problem, error_response = _read_problem()
+        if error_response:
+            return error_response
+
+        return _sse_response(
+            _prime_events(solver.stream_text(problem)),
+            meta={'problem': problem, 'model_type': 'text'}
+        )
 
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
     except Exception as e:
-        app.logger.error(f"图片解题错误: {str(e)}")
+        app.logger.error(f"解题错误: {str(e)}")
         return jsonify({
             'success': False,
             'error': f'服务器错误: {str(e)}'
         }), 500
 
-@app.route('/api/models', methods=['GET'])
-def get_models():
-    """获取可用的AI模型列表"""
+@app.route('/api/solve-image/stream', methods=['POST'])
+def solve_image_stream():
+    """
+    流式图片解题API接口
+    以Server-Sent Events逐段返回AI生成的解答
+    """
     try:
-        # 初始化AI_list实例
-        ai_list = AI_list(
-            api_key=app.config['AI_API_KEY'],
-            api_base=app.config['AI_API_BASE'],
-            model=app.config['AI_MODEL']
+        upload, error_response = _read_image()
+        if error_response:
+            return error_response
+
+        return _sse_response(
+            _prime_events(solver.stream_image(upload)),
+            meta={'problem': '图片题目（已识别）', 'model_type': 'vision'}
         )
 
-        # 调用get_list方法获取模型列表
-        models_response = ai_list.get_list()
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        app.logger.error(f"图片解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交异步解题任务
+    JSON请求体提交文字题目，multipart表单提交图片；立即返回任务ID，结果通过轮询或回调获取
+    """
+    try:
+        is_image = request.mimetype == 'multipart/form-data'
+        if is_image:
+            upload, error_response = _read_image()
+            if error_response:
+                return error_response
+            webhook = request.form.get('webhook') or None
+        else:
+            problem, error_response = _read_problem()
+            if error_response:
+                return error_response
+            webhook = request.get_json().get('webhook') or None
 
-        # 处理获取的模型列表
-        available_models = models_response if models_response else [
-            'gpt-3.5-turbo',
-            'gpt-4',
-            'gpt-4-turbo'
-        ]
+        if webhook and not job_queue.is_allowed_webhook(webhook):
+            if is_image:
+                upload.close()
+            return jsonify({
+                'success': False,
+                'error': '回调地址必须是可访问的公网 http 或 https URL（或在回调主机白名单中）'
+            }), 400
 
-        # 如果获取失败，使用默认模型列表
-        if not available_models:
-            available_models = [
-                'gpt-3.5-turbo',
-                'gpt-4',
-                'gpt-4-turbo'
-            ]
+        if is_image:
+            try:
+                job = job_queue.submit_image(upload.read(), webhook=webhook)
+            finally:
+                upload.close()
+        else:
+            job = job_queue.submit_text(problem, webhook=webhook)
 
         return jsonify({
             'success': True,
             'data': {
-                'text_model': {
-                    'current': app.config['AI_MODEL'],
-                    'api_base': app.config['AI_API_BASE']
-                },
-                'vision_model': {
-                    'current': app.config['AI_VISION_MODEL'],
-                    'api_base': app.config['AI_VISION_API_BASE']
-                },
-                'available_models': available_models
+                'job_id': job.id,
+                'status': job.status,
+                'poll_url': f'/api/jobs/{job.id}'
             }
-        })
+        }), 202
 
+    except JobQueueFullError as e:
+        retry_after = max(1, math.ceil(app.config['BUSY_RETRY_AFTER']))
+        return jsonify({
+            'success': False,
+            'error': f'任务队列繁忙，请稍后重试: {str(e)}',
+            'retry_after': retry_after
+        }), 503, {'Retry-After': str(retry_after)}
     except Exception as e:
-        app.logger.error(f"获取模型列表错误: {str(e)}")
-        # 出错时返回默认模型列表
+        app.logger.error(f"提交任务错误: {str(e)}")
         return jsonify({
-            'success': True,
-            'data': {
-                'text_model': {
-                    'current': app.config['AI_MODEL'],
-                    'api_base': app.config['AI_API_BASE']
-                },
-                'vision_model': {
-                    'current': app.config['AI_VISION_MODEL'],
-                    'api_base': app.config['AI_VISION_API_BASE']
-                },
-                'available_models': [
-                    'gpt-3.5-turbo',
-                    'gpt-4',
-                    'gpt-4-turbo'
-                ]
-            }
-        })
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询异步解题任务的状态与结果"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在或已过期'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'data': job.to_dict()
+    })
+
+@app.route('/api/search', methods=['GET'])
+def search_solutions():
+    """
+    全文检索历史解答
+    查询参数：q 关键词（多个以空格分隔，须全部出现），page 页码（从1开始），page_size 每页条数
+    """
+    if problem_store is None:
+        return jsonify({
+            'success': False,
+            'error': '解题记录未启用'
+        }), 503
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({
+            'success': False,
+            'error': '请提供搜索关键词'
+        }), 400
+
+    try:
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 10))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'page 和 page_size 必须是整数'
+        }), 400
+    if page < 1 or not 1 <= page_size <= app.config['SEARCH_MAX_PAGE_SIZE']:
+        return jsonify({
+            'success': False,
+            'error': f"page 从1开始，page_size 取值 1~{app.config['SEARCH_MAX_PAGE_SIZE']}"
+        }), 400
+
+    return jsonify({
+        'success': True,
+        'data': problem_store.search(query, page=page, page_size=page_size)
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """获取解答缓存命中统计"""
+    return jsonify({
+        'success': True,
+        'data': solver.cache_stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """导出Prometheus文本格式的指标"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/models', methods=['GET'])
+def get_models():
+    """获取可用的AI模型列表（来自进程内模型目录缓存）"""
+    try:
+        available_models = model_catalog.get_models()
+    except Exception as e:
+        app.logger.error(f"获取模型列表错误: {str(e)}")
+        available_models = []
+
+    # 如果获取失败，使用默认模型列表
+    if not available_models:
+        available_models = DEFAULT_MODELS
+
+    return jsonify({
+        'success': True,
+        'data': {
+            'text_model': {
+                'current': app.config['AI_MODEL'],
+                'api_base': app.config['AI_API_BASE']
+            },
+            'vision_model': {
+                'current': app.config['AI_VISION_MODEL'],
+                'api_base': app.config['AI_VISION_API_BASE']
+            },
+            'available_models': available_models
+        }
+    })
 
 if __name__ == '__main__':
+    # 开发服务器（单进程、自动重载），生产环境使用 python serve.py
     app.run(
-        host='0.0.0.0',
-        port=5000,
+        host=app.config['HOST'],
+        port=app.config['PORT'],
         debug=True
     )
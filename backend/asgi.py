@@ -0,0 +1,485 @@
+"""
+ASGI服务入口（异步服务模式）
+
+解题接口基于 asyncio + AsyncOpenAI 实现，等待上游期间不占用线程，
+单个进程即可同时挂起大量解题请求；其余接口仍由 Flask 应用处理。
+
+启动方式：
+    cd backend
+    python asgi.py
+或
+    hypercorn asgi:asgi_app --bind 0.0.0.0:5000
+多进程部署使用 python serve.py（SERVER_MODE=asgi）
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from hypercorn.asyncio import serve  # type: ignore[reportMissingImports]
+from hypercorn.config import Config as HypercornConfig  # type: ignore[reportMissingImports]
+from hypercorn.middleware import AsyncioWSGIMiddleware  # type: ignore[reportMissingImports]
+from quart import Quart, Request, Response, g, request, jsonify  # type: ignore[reportMissingImports]
+from werkzeug.exceptions import RequestEntityTooLarge  # type: ignore[reportMissingImports]
+
+from config import Config  # type: ignore[reportImplicitRelativeImport]
+from app import (  # type: ignore[reportImplicitRelativeImport]
+    app as flask_app, solver, upload_stream_factory, _format_sse, _solution_data,
+    _batch_items, _format_batch_line, _format_batch_summary, stop_background_services,
+    BUSY_ERRORS, _busy_error
+)
+from services.upload import ImageUpload  # type: ignore[reportImplicitRelativeImport]
+from services import metrics  # type: ignore[reportImplicitRelativeImport]
+
+
+class UploadRequest(Request):
+    """
+    上传文件超过阈值后转存临时文件，与 Flask 应用保持一致
+
+    Quart 在处理函数返回后即关闭上传文件，而流式接口此时仍需读取图片，
+    因此上传文件改由图片接口在解题结束后自行关闭
+    """
+
+    def make_form_data_parser(self):
+        return self.form_data_parser_class(
+            max_content_length=self.max_content_length,
+            max_form_memory_size=self.max_form_memory_size,
+            max_form_parts=self.max_form_parts,
+            cls=self.parameter_storage_class,
+            stream_factory=upload_stream_factory
+        )
+
+    async def close(self) -> None:
+        pass
+
+
+quart_app = Quart(__name__)
+quart_app.request_class = UploadRequest
+quart_app.config.from_object(Config)
+# 流式解答可能持续较长时间，不限制响应时长
+quart_app.config['RESPONSE_TIMEOUT'] = None
+
+# 由异步应用处理的接口，其余路径交给 Flask
+ASYNC_ROUTES = {
+    '/api/solve',
+    '/api/solve-image',
+    '/api/solve/stream',
+    '/api/solve-image/stream',
+    '/api/solve/batch'
+}
+
+
+@quart_app.before_serving
+async def configure_executor():
+    """按 SERVER_THREADS 设置默认线程池：Flask 接口、图片预处理等同步操作在其中执行"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(1, Config.SERVER_THREADS), thread_name_prefix='asgi-sync')
+    )
+
+
+@quart_app.after_serving
+async def drain_background_services():
+    """停止接收请求后，等待后台执行中的解题任务完成（最多 SERVER_GRACEFUL_TIMEOUT 秒）"""
+    await asyncio.to_thread(stop_background_services, Config.SERVER_GRACEFUL_TIMEOUT)
+
+
+@quart_app.before_request
+async def start_request_metrics():
+    """记录请求开始时间与路由标签，与 Flask 应用保持一致"""
+    g.request_start = time.perf_counter()
+    metrics.set_route(request.url_rule.rule if request.url_rule else 'unmatched')
+
+
+@quart_app.after_request
+async def record_request_metrics(response):
+    """记录请求数与处理耗时（流式接口只统计到返回响应头）"""
+    if 'request_start' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - g.request_start)
+    return response
+
+
+@quart_app.after_request
+async def add_cors_headers(response):
+    """CORS配置，与 Flask 应用保持一致"""
+    origin = request.headers.get('Origin')
+    allowed = quart_app.config['FRONTEND_ORIGIN']
+    if origin and (allowed == '*' or origin == allowed):
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+        if request.method == 'OPTIONS':
+            response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+            response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    return response
+
+
+@metrics.timed('parse')
+async def _read_problem():
+    """
+    从JSON请求体中读取题目
+
+    Returns:
+        (题目文本, 错误响应)，校验通过时错误响应为None
+    """
+    data = await request.get_json(silent=True)
+
+    if not data or 'problem' not in data:
+        return None, (jsonify({
+            'success': False,
+            'error': '缺少题目内容'
+        }), 400)
+
+    problem = data['problem'].strip()
+
+    if not problem:
+        return None, (jsonify({
+            'success': False,
+            'error': '题目内容不能为空'
+        }), 400)
+
+    return problem, None
+
+
+def _too_large_response():
+    """请求体超过 MAX_CONTENT_LENGTH 时的错误响应"""
+    limit_mb = quart_app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({
+        'success': False,
+        'error': f'图片过大，最大支持 {limit_mb:g}MB'
+    }), 413
+
+
+@metrics.timed('parse')
+async def _read_image():
+    """
+    从表单中读取上传的图片
+
+    只有校验通过的图片交由调用方关闭；其余上传文件（校验失败的图片、多余的文件字段）在返回前关闭，
+    避免临时文件留到请求结束之后
+
+    Returns:
+        (上传图片, 错误响应)，校验通过时错误响应为None
+    """
+    try:
+        files = await request.files
+    except RequestEntityTooLarge:
+        return None, _too_large_response()
+
+    upload = None
+    try:
+        # 检查是否有文件上传
+        if 'image' not in files:
+            return None, (jsonify({
+                'success': False,
+                'error': '缺少图片文件'
+            }), 400)
+
+        file = files['image']
+
+        if file.filename == '':
+            return None, (jsonify({
+                'success': False,
+                'error': '未选择图片文件'
+            }), 400)
+
+        # 根据文件头魔数验证文件类型
+        upload = ImageUpload.from_stream(file.stream)
+
+        if upload is None:
+            return None, (jsonify({
+                'success': False,
+                'error': '不支持的图片格式，请上传 JPG 或 PNG 格式'
+            }), 400)
+
+        return upload, None
+    finally:
+        for _, storage in files.items(multi=True):
+            if upload is None or storage.stream is not upload.stream:
+                storage.close()
+
+
+def _busy_response(e):
+    body, status, headers = _busy_error(e)
+    return jsonify(body), status, headers
+
+
+async def _prime_events(events):
+    """
+    预先取出解答首个片段（或错误）之前的事件，使限流、熔断等错误在发送响应头之前抛出
+
+    Returns:
+        包含已取出事件的完整异步事件迭代器
+    """
+    head = []
+    async for event, data in events:
+        head.append((event, data))
+        if event != 'meta':
+            break
+
+    async def chained():
+        for item in head:
+            yield item
+        async for item in events:
+            yield item
+
+    return chained()
+
+
+@metrics.timed('serialize')
+def _solution_response(problem, result, model_type):
+    """构造解题成功的响应"""
+    return jsonify({
+        'success': True,
+        'data': _solution_data(problem, result, model_type)
+    })
+
+
+@metrics.timed('parse')
+async def _read_batch():
+    """
+    读取批量解题请求
+
+    Returns:
+        (题目文本或上传图片列表, 错误响应)，校验通过时错误响应为None
+    """
+    try:
+        if request.mimetype == 'multipart/form-data':
+            problems = (await request.form).getlist('problems')
+            files = (await request.files).getlist('images')
+        else:
+            problems = ((await request.get_json(silent=True)) or {}).get('problems') or []
+            files = []
+    except RequestEntityTooLarge:
+        return None, _too_large_response()
+
+    items, error = _batch_items(problems, [(file.filename, file.stream) for file in files],
+                                quart_app.config['BATCH_MAX_ITEMS'])
+    if error:
+        for file in files:
+            file.close()
+        return None, (jsonify({
+            'success': False,
+            'error': error
+        }), 400)
+
+    return items, None
+
+
+def _sse_response(events, meta, upload=None):
+    """
+    将异步解题事件流包装为SSE响应
+
+    Args:
+        events: ProblemSolver 产出的 (事件名, 数据) 异步迭代器
+        meta: 合并到 meta 事件中的附加字段
+        upload: 事件流结束后需要关闭的上传图片
+    """
+    async def generate():
+        try:
+            async for event, data in events:
+                if event == 'meta':
+                    data = {**meta, **data}
+                yield _format_sse(event, data)
+        except Exception as e:
+            quart_app.logger.error(f"流式解题错误: {str(e)}")
+            yield _format_sse('error', {'error': f'服务器错误: {str(e)}'})
+        finally:
+            if upload is not None:
+                upload.close()
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.timeout = None
+    return response
+
+
+@quart_app.errorhandler(RequestEntityTooLarge)
+async def request_entity_too_large(e):
+    """请求体超过 MAX_CONTENT_LENGTH"""
+    return _too_large_response()
+
+
+@quart_app.route('/api/solve', methods=['POST'])
+async def solve_problem():
+    """
+    解题API接口（异步）
+    接收题目，调用AI模型返回答案
+    """
+    try:
+        problem, error_response = await _read_problem()
+        if error_response:
+            return error_response
+
+        # 调用AI服务解题 - 使用文字模型，优先命中缓存
+        result = await solver.asolve_text(problem)
+
+        if result:
+            return _solution_response(problem, result, 'text')
+        else:
+            return jsonify({
+                'success': False,
+                'error': '无法获取解答，请检查API配置'
+            }), 500
+
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        quart_app.logger.error(f"解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@quart_app.route('/api/solve-image', methods=['POST'])
+async def solve_image():
+    """
+    图片解题API接口（异步）
+    接收图片，调用AI模型识别并解答
+    """
+    try:
+        upload, error_response = await _read_image()
+        if error_response:
+            return error_response
+
+        # 调用AI服务解题 - 使用视觉模型，优先命中图片缓存
+        try:
+            result = await solver.asolve_image(upload)
+        finally:
+            upload.close()
+
+        if result:
+            return _solution_response('图片题目（已识别）', result, 'vision')
+        else:
+            return jsonify({
+                'success': False,
+                'error': '无法获取解答，请检查API配置'
+            }), 500
+
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        quart_app.logger.error(f"图片解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@quart_app.route('/api/solve/batch', methods=['POST'])
+async def solve_batch():
+    """
+    批量解题API接口（异步）
+    接收多道题目（文字和/或图片），去重后并发解题，以NDJSON按完成顺序逐行返回结果
+    """
+    try:
+        items, error_response = await _read_batch()
+        if error_response:
+            return error_response
+
+        async def generate():
+            start = time.perf_counter()
+            succeeded = 0
+            try:
+                async for index, result, error in solver.asolve_batch(items, quart_app.config['BATCH_CONCURRENCY']):
+                    if error is None:
+                        succeeded += 1
+                    yield _format_batch_line(index, items[index], result, error)
+                yield _format_batch_summary(len(items), succeeded, time.perf_counter() - start)
+            finally:
+                for item in items:
+                    if isinstance(item, ImageUpload):
+                        item.close()
+
+        response = Response(generate(), mimetype='application/x-ndjson')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.timeout = None
+        return response
+
+    except Exception as e:
+        quart_app.logger.error(f"批量解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@quart_app.route('/api/solve/stream', methods=['POST'])
+async def solve_problem_stream():
+    """
+    流式解题API接口（异步）
+    以Server-Sent Events逐段返回AI生成的解答
+    """
+    try:
+        problem, error_response = await _read_problem()
+        if error_response:
+            return error_response
+
+        return _sse_response(
+            await _prime_events(solver.astream_text(problem)),
+            meta={'problem': problem, 'model_type': 'text'}
+        )
+
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        quart_app.logger.error(f"解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+@quart_app.route('/api/solve-image/stream', methods=['POST'])
+async def solve_image_stream():
+    """
+    流式图片解题API接口（异步）
+    以Server-Sent Events逐段返回AI生成的解答
+    """
+    try:
+        upload, error_response = await _read_image()
+        if error_response:
+            return error_response
+
+        try:
+            events = await _prime_events(solver.astream_image(upload))
+        except Exception:
+            upload.close()
+            raise
+        return _sse_response(
+            events,
+            meta={'problem': '图片题目（已识别）', 'model_type': 'vision'},
+            upload=upload
+        )
+
+    except BUSY_ERRORS as e:
+        return _busy_response(e)
+    except Exception as e:
+        quart_app.logger.error(f"图片解题错误: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'服务器错误: {str(e)}'
+        }), 500
+
+
+# 其余接口在线程池中运行 Flask 应用
+wsgi_app = AsyncioWSGIMiddleware(flask_app, max_body_size=Config.MAX_CONTENT_LENGTH)
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI入口：解题接口走异步应用，其余请求交给 Flask"""
+    if scope['type'] == 'lifespan' or scope.get('path') in ASYNC_ROUTES:
+        await quart_app(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    hypercorn_config = HypercornConfig()
+    hypercorn_config.bind = [f"{Config.HOST}:{Config.PORT}"]
+    hypercorn_config.keep_alive_timeout = Config.SERVER_KEEPALIVE
+    hypercorn_config.graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+    asyncio.run(serve(asgi_app, hypercorn_config))  # type: ignore[arg-type]
@@ -0,0 +1,4 @@
+"""
+基准测试工具
+mock_llm 为本地的 OpenAI 兼容模拟上游，load 为并发压测与基线对比，均只依赖标准库，无需真实模型额度
+"""
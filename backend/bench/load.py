@@ -0,0 +1,433 @@
+"""
+压测模块
+并发请求 /api/solve、/api/solve-image、/api/models，统计吞吐、延迟分位数、服务进程内存与上游调用次数，
+结果可保存为基线并在之后的运行中对比
+
+    cd backend
+    # 自动启动模拟上游与后端（Flask 或 ASGI），完全离线
+    python -m bench.load --spawn --server asgi --requests 300 --concurrency 32 --save asgi-default
+    # 修改代码后再次运行并与基线对比，吞吐或延迟退化超过容差时退出码为1
+    python -m bench.load --spawn --server asgi --requests 300 --concurrency 32 --compare asgi-default
+    # 压测已启动的服务（上游调用次数需同时指定模拟上游地址）
+    python -m bench.load --url http://localhost:5000 --mock-url http://127.0.0.1:8900 --pid 12345
+"""
+
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+ENDPOINTS = ('solve', 'solve-image', 'models')
+
+# 对比基线时参与判断的指标：(指标名, 数值越大越好)
+COMPARED_METRICS = (
+    ('rps', True),
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('error_rate', False),
+    ('upstream_per_request', False)
+)
+
+# 请求描述：(方法, 路径, 请求体, Content-Type)
+Request = Tuple[str, str, Optional[bytes], Optional[str]]
+
+
+def _percentile(values: List[float], p: float) -> float:
+    """最近秩法分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p * len(ordered))) - 1))]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _rss_mb(pid: Optional[int]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    读取进程内存（仅Linux）
+
+    Returns:
+        (当前常驻内存MB, 峰值常驻内存MB)，无法读取时为None
+    """
+    if pid is None:
+        return None, None
+    values: Dict[str, float] = {}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    values[name] = int(value.split()[0]) / 1024
+    except OSError:
+        return None, None
+    return values.get('VmRSS'), values.get('VmHWM')
+
+
+def _http(method: str, url: str, body: Optional[bytes] = None, content_type: Optional[str] = None,
+          timeout: float = 120.0) -> Tuple[int, bytes]:
+    """发送请求，返回 (状态码, 响应体)；连接失败时状态码为0"""
+    request = urllib.request.Request(url, data=body, method=method)
+    if content_type:
+        request.add_header('Content-Type', content_type)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except (urllib.error.URLError, OSError):
+        return 0, b''
+
+
+def _multipart(field: str, filename: str, data: bytes, mime_type: str) -> Tuple[bytes, str]:
+    """构造只含一个文件字段的 multipart/form-data 请求体"""
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {mime_type}\r\n\r\n'
+    ).encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def _make_images(count: int, seed: int) -> List[bytes]:
+    """生成互不相同的题目图片（随机色块，感知哈希彼此相距较远）"""
+    from PIL import Image, ImageDraw  # type: ignore[reportMissingImports]
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        image = Image.new('RGB', (1200, 900), 'white')
+        draw = ImageDraw.Draw(image)
+        for _ in range(24):
+            x, y = rng.randrange(0, 1100), rng.randrange(0, 800)
+            shade = rng.randrange(0, 200)
+            draw.rectangle((x, y, x + rng.randrange(40, 300), y + rng.randrange(20, 200)), fill=(shade, shade, shade))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def build_requests(endpoint: str, total: int, unique_ratio: float, seed: int) -> List[Request]:
+    """
+    生成一个接口的请求序列
+
+    Args:
+        endpoint: solve / solve-image / models
+        total: 请求数
+        unique_ratio: 不同题目占请求数的比例，其余为重复题目（用于衡量缓存与请求合并效果）
+        seed: 随机数种子
+
+    Returns:
+        请求列表
+    """
+    rng = random.Random(seed)
+    distinct = max(1, int(total * unique_ratio))
+    if endpoint == 'models':
+        return [('GET', '/api/models', None, None)] * total
+
+    if endpoint == 'solve':
+        run = uuid.uuid4().hex[:8]
+        pool = [json.dumps({'problem': f'压测题目{run}-{i}：求 {i} 个苹果每个 {i % 7 + 2} 元共多少元？'},
+                           ensure_ascii=False).encode('utf-8') for i in range(distinct)]
+        return [('POST', '/api/solve', rng.choice(pool), 'application/json') for _ in range(total)]
+
+    bodies = [_multipart('image', f'bench-{i}.jpg', data, 'image/jpeg')
+              for i, data in enumerate(_make_images(distinct, seed + int(time.time())))]
+    picks = [rng.choice(bodies) for _ in range(total)]
+    return [('POST', '/api/solve-image', body, content_type) for body, content_type in picks]
+
+
+def run_endpoint(base_url: str, requests: List[Request], concurrency: int,
+                 mock_url: Optional[str] = None, pid: Optional[int] = None) -> Dict[str, Any]:
+    """
+    以固定并发发送请求并统计结果
+
+    Returns:
+        吞吐、延迟分位数、错误率、上游调用次数与服务进程内存
+    """
+    before = _upstream_calls(mock_url)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    def send(request: Request) -> Tuple[int, float]:
+        method, path, body, content_type = request
+        start = time.perf_counter()
+        status, _ = _http(method, base_url + path, body, content_type)
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='bench') as executor:
+        for status, elapsed in executor.map(send, requests):
+            latencies.append(elapsed * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    elapsed = time.perf_counter() - start
+
+    after = _upstream_calls(mock_url)
+    rss, peak = _rss_mb(pid)
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    upstream = after - before if before is not None and after is not None else None
+    return {
+        'requests': len(requests),
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'rps': round(len(requests) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(_percentile(latencies, 0.50), 1),
+        'p95_ms': round(_percentile(latencies, 0.95), 1),
+        'p99_ms': round(_percentile(latencies, 0.99), 1),
+        'max_ms': round(max(latencies), 1) if latencies else 0.0,
+        'statuses': statuses,
+        'error_rate': round(errors / len(requests), 4) if requests else 0.0,
+        'upstream_calls': upstream,
+        'upstream_per_request': round(upstream / len(requests), 4) if upstream is not None and requests else None,
+        'rss_mb': round(rss, 1) if rss is not None else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None
+    }
+
+
+def _upstream_calls(mock_url: Optional[str]) -> Optional[int]:
+    """读取模拟上游的累计调用次数（含注入的错误）"""
+    if not mock_url:
+        return None
+    status, body = _http('GET', mock_url.rstrip('/') + '/stats', timeout=5)
+    return json.loads(body)['total'] if status == 200 else None
+
+
+# ==================== 自动启动服务 ====================
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"进程启动失败（退出码 {process.returncode}）: {' '.join(map(str, process.args))}")
+        status, _ = _http('GET', url, timeout=2)
+        if status:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f"等待服务就绪超时: {url}")
+
+
+def spawn_stack(server: str, mock_args: List[str], env_overrides: Dict[str, str]) -> Tuple[str, str, List[subprocess.Popen]]:
+    """
+    启动模拟上游与后端服务
+
+    Args:
+        server: flask（Flask 开发服务器，多线程）或 asgi（hypercorn）
+        mock_args: 传给 bench.mock_llm 的参数
+        env_overrides: 额外的后端环境变量
+
+    Returns:
+        (后端地址, 模拟上游地址, 进程列表)，后端进程排在第一个
+    """
+    mock_port, app_port = _free_port(), _free_port()
+    mock_url = f'http://127.0.0.1:{mock_port}'
+    processes: List[subprocess.Popen] = []
+    try:
+        mock = subprocess.Popen([sys.executable, '-m', 'bench.mock_llm', '--port', str(mock_port), *mock_args],
+                                cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+        processes.append(mock)
+        _wait_ready(mock_url + '/stats', mock)
+
+        data_dir = tempfile.mkdtemp(prefix='bench-')
+        env = {
+            **os.environ,
+            'AI_API_KEY': 'bench',
+            'AI_API_BASE': mock_url + '/v1',
+            'AI_MODEL': 'mock-text',
+            'AI_VISION_API_KEY': 'bench',
+            'AI_VISION_API_BASE': mock_url + '/v1',
+            'AI_VISION_MODEL': 'mock-vision',
+            'CACHE_BACKEND': 'memory',
+            'JOB_BACKEND': 'memory',
+            'SIMILARITY_INDEX_DIR': data_dir,
+            'HEALTH_PROBE_INTERVAL': '0',
+            'PORT': str(app_port),
+            **env_overrides
+        }
+        if server == 'asgi':
+            command = [sys.executable, 'asgi.py']
+        else:
+            command = [sys.executable, '-c',
+                       f"from app import app; app.run(host='127.0.0.1', port={app_port}, threaded=True)"]
+        backend = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        processes.insert(0, backend)
+        app_url = f'http://127.0.0.1:{app_port}'
+        _wait_ready(app_url + '/api/health', backend)
+    except Exception:
+        stop_stack(processes)
+        raise
+    return app_url, mock_url, processes
+
+
+def stop_stack(processes: List[subprocess.Popen]) -> None:
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ==================== 基线 ====================
+
+def _baseline_path(name: str) -> str:
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def save_baseline(name: str, report: Dict[str, Any]) -> str:
+    """保存压测结果为基线，返回文件路径"""
+    path = _baseline_path(name)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    对比本次结果与基线，打印各指标变化
+
+    Args:
+        baseline: 基线结果
+        report: 本次结果
+        tolerance: 允许的相对退化比例（如0.1表示10%）
+
+    Returns:
+        退化超过容差的指标说明列表
+    """
+    regressions = []
+    for endpoint, current in report['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is None:
+            continue
+        print(f"\n{endpoint}（基线 → 本次）")
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            worse = -change if higher_is_better else change
+            # 错误率从0变为非0等小基数变化按绝对值判断
+            regressed = worse > tolerance and (metric != 'error_rate' or new - old > 0.01)
+            flag = '  ← 退化' if regressed else ''
+            print(f"  {metric:<22}{old:>10} → {new:<10} ({change:+.1%}){flag}")
+            if regressed:
+                regressions.append(f"{endpoint}.{metric}: {old} → {new} ({change:+.1%})")
+    return regressions
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    header = f"{'接口':<14}{'请求':>6}{'RPS':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'错误率':>8}{'上游/请求':>10}{'RSS(MB)':>9}"
+    print('\n' + header)
+    for endpoint, result in report['endpoints'].items():
+        upstream = result['upstream_per_request']
+        print(f"{endpoint:<14}{result['requests']:>6}{result['rps']:>9}{result['p50_ms']:>9}{result['p95_ms']:>9}"
+              f"{result['p99_ms']:>9}{result['error_rate']:>8}{'-' if upstream is None else upstream:>10}"
+              f"{'-' if result['rss_mb'] is None else result['rss_mb']:>9}")
+
+
+def run(args: Any) -> int:
+    """执行压测，返回退出码"""
+    processes: List[subprocess.Popen] = []
+    base_url, mock_url, pid = args.url.rstrip('/'), args.mock_url, args.pid
+    if args.spawn:
+        mock_args = ['--latency', str(args.mock_latency), '--tokens-per-second', str(args.mock_tps),
+                     '--error-rate', str(args.mock_error_rate), '--seed', str(args.seed)]
+        env_overrides = dict(item.split('=', 1) for item in args.env)
+        base_url, mock_url, processes = spawn_stack(args.server, mock_args, env_overrides)
+        pid = processes[0].pid
+        print(f"后端: {base_url}（{args.server}） 模拟上游: {mock_url}")
+
+    try:
+        rss_start, _ = _rss_mb(pid)
+        report: Dict[str, Any] = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'server': args.server if args.spawn else base_url,
+                'concurrency': args.concurrency,
+                'requests': args.requests,
+                'unique_ratio': args.unique_ratio,
+                'mock_latency': args.mock_latency if args.spawn else None,
+                'mock_tps': args.mock_tps if args.spawn else None,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'rss_start_mb': round(rss_start, 1) if rss_start is not None else None
+            },
+            'endpoints': {}
+        }
+        for index, endpoint in enumerate(args.endpoints):
+            requests = build_requests(endpoint, args.requests, args.unique_ratio, args.seed + index)
+            print(f"压测 {endpoint}: {len(requests)} 个请求，并发 {args.concurrency}")
+            report['endpoints'][endpoint] = run_endpoint(base_url, requests, args.concurrency, mock_url, pid)
+    finally:
+        stop_stack(processes)
+
+    _print_report(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save:
+        print(f"\n基线已保存: {save_baseline(args.save, report)}")
+    if args.compare:
+        with open(_baseline_path(args.compare), encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"\n超过容差（{args.tolerance:.0%}）的退化:\n  " + '\n  '.join(regressions))
+            return 1
+        print(f"\n与基线相比无超过容差（{args.tolerance:.0%}）的退化")
+    return 0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def endpoint_list(value: str) -> List[str]:
+        endpoints = [item.strip() for item in value.split(',') if item.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise argparse.ArgumentTypeError(f"未知接口: {', '.join(sorted(unknown))}（可选: {', '.join(ENDPOINTS)}）")
+        return endpoints
+
+    parser = argparse.ArgumentParser(description='并发压测与基线对比')
+    parser.add_argument('--url', default='http://localhost:5000', help='后端地址（--spawn 时忽略）')
+    parser.add_argument('--mock-url', default=None, help='模拟上游地址，用于统计上游调用次数')
+    parser.add_argument('--pid', type=int, default=None, help='后端进程ID，用于统计内存')
+    parser.add_argument('--spawn', action='store_true', help='自动启动模拟上游与后端')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask', help='--spawn 时启动的服务类型')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='--spawn 时额外的后端环境变量')
+    parser.add_argument('--endpoints', type=endpoint_list, default=list(ENDPOINTS), help='逗号分隔的接口列表')
+    parser.add_argument('--requests', type=int, default=200, help='每个接口的请求数')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发数')
+    parser.add_argument('--unique-ratio', type=float, default=0.5, help='不同题目占请求数的比例')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--mock-latency', type=float, default=0.5, help='模拟上游首个token延迟（秒）')
+    parser.add_argument('--mock-tps', type=float, default=200.0, help='模拟上游生成速度（token/秒）')
+    parser.add_argument('--mock-error-rate', type=float, default=0.0, help='模拟上游返回500的概率')
+    parser.add_argument('--output', default=None, help='结果JSON输出路径')
+    parser.add_argument('--save', default=None, metavar='NAME', help='保存为基线（bench/baselines/NAME.json）')
+    parser.add_argument('--compare', default=None, metavar='NAME', help='与基线对比')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='允许的相对退化比例')
+    sys.exit(run(parser.parse_args()))
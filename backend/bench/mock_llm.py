@@ -0,0 +1,295 @@
+"""
+模拟上游模块
+本地的 OpenAI 兼容对话补全服务，可配置首字延迟、生成速度与错误注入，后端通过 AI_API_BASE 指向它即可离线压测
+
+    cd backend
+    python -m bench.mock_llm --port 8900 --latency 0.5 --tokens-per-second 80 --error-rate 0.02
+
+接口：
+    POST /v1/chat/completions   对话补全（支持 stream）
+    GET  /v1/models             模型列表
+    GET  /stats                 调用统计（按模型、类型、结果计数）
+    POST /reset                 清空调用统计
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple
+
+
+class MockOptions:
+    """模拟上游的行为参数"""
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2, tokens_per_second: float = 80.0,
+                 completion_tokens: int = 200, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency: 首个token到达前的延迟（秒）
+            jitter: 延迟的随机浮动比例（0~1）
+            tokens_per_second: 生成速度，<=0 表示立即返回全部内容
+            completion_tokens: 每次生成的token数（不超过请求的 max_tokens）
+            error_rate: 返回 500 错误的概率
+            rate_limit_rate: 返回 429 错误的概率
+            retry_after: 429 响应的 Retry-After（秒）
+            seed: 随机数种子，便于复现错误注入
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+
+class MockStats:
+    """调用统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls: Dict[str, int] = {}
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def enter(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self, key: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'total': sum(self.calls.values()),
+                'calls': dict(self.calls),
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight
+            }
+
+
+def _prompt_of(messages: List[Dict[str, Any]]) -> Tuple[str, bool, int]:
+    """
+    读取请求内容
+
+    Returns:
+        (最后一条用户消息的文字与图片摘要, 是否包含图片, 输入字符数)
+    """
+    text, has_image, chars = '', False, 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+            if message.get('role') == 'user':
+                text = content
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                chars += len(part.get('text', ''))
+                if message.get('role') == 'user':
+                    text = part.get('text', '')
+            else:
+                has_image = True
+                chars += 1000
+                url = (part.get('image_url') or {}).get('url', '')
+                text += hashlib.sha1(url.encode('utf-8')).hexdigest()
+    return text, has_image, chars
+
+
+def _completion_text(prompt: str, tokens: int) -> str:
+    """按题目生成确定的解答：相同题目得到相同答案，长度约为 tokens 个字"""
+    digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+    answer = int(digest[:8], 16) % 1000
+    body = '模拟解题步骤。' * max(1, (tokens - 30) // 7)
+    return f"**问题分析**：\n{body}\n\n**最终答案**：\n{answer}"
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """处理模拟上游的请求"""
+
+    protocol_version = 'HTTP/1.1'
+    server: 'MockLLMServer'
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip('/') in ('/v1/models', '/models'):
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': model, 'object': 'model', 'owned_by': 'mock'} for model in ('mock-text', 'mock-vision')
+            ]})
+        elif self.path.rstrip('/') == '/stats':
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        path = self.path.rstrip('/')
+        if path == '/reset':
+            self.server.stats.reset()
+            self._send_json(200, {'ok': True})
+        elif path in ('/v1/chat/completions', '/chat/completions'):
+            self._chat_completions(json.loads(raw or b'{}'))
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _chat_completions(self, request: Dict[str, Any]) -> None:
+        options = self.server.options
+        stats = self.server.stats
+        model = request.get('model', 'mock')
+        prompt, has_image, prompt_chars = _prompt_of(request.get('messages') or [])
+        kind = f"{model}:{'image' if has_image else 'text'}"
+
+        stats.enter()
+        roll = options.random.random()
+        if roll < options.rate_limit_rate:
+            stats.leave(kind + ':429')
+            self._send_json(429, {'error': {'message': 'rate limited', 'type': 'rate_limit_error'}},
+                            {'Retry-After': str(options.retry_after)})
+            return
+        if roll < options.rate_limit_rate + options.error_rate:
+            stats.leave(kind + ':500')
+            self._send_json(500, {'error': {'message': 'injected error', 'type': 'server_error'}})
+            return
+
+        tokens = min(options.completion_tokens, int(request.get('max_tokens') or options.completion_tokens))
+        text = _completion_text(prompt, tokens)
+        usage = {'prompt_tokens': prompt_chars, 'completion_tokens': tokens, 'total_tokens': prompt_chars + tokens}
+
+        delay = options.latency * (1 + options.jitter * (2 * options.random.random() - 1))
+        try:
+            time.sleep(max(0.0, delay))
+            if request.get('stream'):
+                self._stream(model, text, tokens, usage, request)
+            else:
+                if options.tokens_per_second > 0:
+                    time.sleep(tokens / options.tokens_per_second)
+                self._send_json(200, {
+                    'id': 'chatcmpl-mock',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': text},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': usage
+                })
+        finally:
+            stats.leave(kind + ':200', prompt_chars, tokens)
+
+    def _stream(self, model: str, text: str, tokens: int, usage: Dict[str, Any], request: Dict[str, Any]) -> None:
+        """以SSE逐段返回，每段约10个token，按生成速度间隔发送"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        pieces = [text[i:i + 10] for i in range(0, len(text), 10)]
+        interval = (tokens / self.server.options.tokens_per_second / len(pieces)
+                    if self.server.options.tokens_per_second > 0 else 0.0)
+
+        def send(payload: Dict[str, Any]) -> None:
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        base = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+        for index, piece in enumerate(pieces):
+            if index and interval:
+                time.sleep(interval)
+            send({**base, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]})
+        send({**base, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if (request.get('stream_options') or {}).get('include_usage'):
+            send({**base, 'choices': [], 'usage': usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """模拟上游服务"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], options: Optional[MockOptions] = None):
+        super().__init__(address, MockLLMHandler)
+        self.options = options or MockOptions()
+        self.stats = MockStats()
+
+
+def serve(host: str = '127.0.0.1', port: int = 8900, options: Optional[MockOptions] = None) -> MockLLMServer:
+    """
+    在后台线程中启动模拟上游
+
+    Returns:
+        服务实例，调用 shutdown() 停止
+    """
+    server = MockLLMServer((host, port), options)
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='OpenAI 兼容的模拟上游')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.5, help='首个token延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.2, help='延迟随机浮动比例（0~1）')
+    parser.add_argument('--tokens-per-second', type=float, default=80.0, help='生成速度，<=0 表示立即返回')
+    parser.add_argument('--completion-tokens', type=int, default=200, help='每次生成的token数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的概率')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='返回429的概率')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429响应的 Retry-After（秒）')
+    parser.add_argument('--seed', type=int, default=None, help='随机数种子')
+    args = parser.parse_args()
+
+    mock_server = MockLLMServer((args.host, args.port), MockOptions(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        seed=args.seed
+    ))
+    print(f"模拟上游已启动: http://{args.host}:{args.port}/v1")
+    try:
+        mock_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -3,6 +3,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
     
@@ -15,6 +17,127 @@ class Config:
     AI_VISION_API_KEY = os.getenv('AI_VISION_API_KEY', os.getenv('AI_API_KEY', ''))
     AI_VISION_API_BASE = os.getenv('AI_VISION_API_BASE', os.getenv('AI_API_BASE', ''))
     AI_VISION_MODEL = os.getenv('AI_VISION_MODEL', 'gpt-4o')
+    # 两段式图片解题：视觉模型只转写题目，再按文字题目解答（可命中文字缓存、使用模型分级）
+    VISION_TWO_STAGE = os.getenv('VISION_TWO_STAGE', 'true').lower() == 'true'
+    
+    # 模型分级 - 文字题目先由小模型解答，置信度不足或题目复杂时再交给 AI_MODEL
+    CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+    CASCADE_API_KEY = os.getenv('CASCADE_API_KEY', os.getenv('AI_API_KEY', ''))
+    CASCADE_API_BASE = os.getenv('CASCADE_API_BASE', os.getenv('AI_API_BASE', ''))
+    CASCADE_MODEL = os.getenv('CASCADE_MODEL', 'gpt-4o-mini')
+    CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '0.6'))  # 小模型答案的最低置信度（0~1）
+    CASCADE_MAX_PROBLEM_CHARS = int(os.getenv('CASCADE_MAX_PROBLEM_CHARS', '300'))  # 超过该长度的题目直接交给主模型
+    
+    # 多上游路由 - 额外后端（JSON数组，元素为 {"api_key", "api_base", "model"}，缺省字段沿用上面的主后端配置）
+    AI_TEXT_PROVIDERS = os.getenv('AI_TEXT_PROVIDERS', '')
+    AI_VISION_PROVIDERS = os.getenv('AI_VISION_PROVIDERS', '')
+    ROUTING_STRATEGY = os.getenv('ROUTING_STRATEGY', 'ewma')  # ewma / least_latency
+    PROVIDER_COOLDOWN = float(os.getenv('PROVIDER_COOLDOWN', '30'))  # 后端连接失败或频率超限后的冷却时间（秒）
+    
+    # 上游调用重试与熔断
+    UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '60'))  # 单次请求超时（秒）
+    UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+    UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))  # 退避基准（秒），按2的幂增长并加随机抖动
+    UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '8'))  # 单次等待上限（秒），Retry-After 更长时直接失败
+    UPSTREAM_RETRY_BUDGET = float(os.getenv('UPSTREAM_RETRY_BUDGET', '0.2'))  # 重试数占请求数的比例上限
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))  # 连续失败多少次后熔断，<=0 关闭熔断
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))  # 熔断持续时间（秒）
+    
+    # 上游限流（每个后端、每个工作进程独立计算，<=0 表示不限制）
+    # 异步服务模式下每个进程可同时挂起大量解题请求，超出并发上限的请求都在限流队列中等待：
+    # 排队上限应不小于预期的同时挂起请求数，排队时间应不短于一次解答的耗时，否则高峰期多数请求会被直接拒绝
+    UPSTREAM_RPM = int(os.getenv('UPSTREAM_RPM', '0'))  # 每分钟请求数上限
+    UPSTREAM_TPM = int(os.getenv('UPSTREAM_TPM', '0'))  # 每分钟token数上限
+    UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '32'))  # 并发请求上限
+    UPSTREAM_QUEUE_SIZE = int(os.getenv('UPSTREAM_QUEUE_SIZE', '1000'))  # 排队请求上限
+    UPSTREAM_QUEUE_TIMEOUT = float(os.getenv('UPSTREAM_QUEUE_TIMEOUT', '60'))  # 最长排队时间（秒）
+    BUSY_RETRY_AFTER = float(os.getenv('BUSY_RETRY_AFTER', '5'))  # 请求被限流丢弃且无法预估等待时间时，返回给客户端的 Retry-After（秒）
+    
+    # 上游HTTP连接池（进程内所有上游调用共享，长连接复用避免每个请求重新握手）
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '200'))  # 最大连接数，应不小于各后端并发上限之和
+    HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '100'))  # 保持的空闲长连接数
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))  # 空闲长连接保持时间（秒）
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '10'))  # 建立连接超时（秒）
+    HTTP2_ENABLED = os.getenv('HTTP2_ENABLED', 'false').lower() == 'true'  # 启用HTTP/2多路复用（需安装 h2）
+    
+    # 模型目录缓存（秒）：新鲜期内直接返回，过期后先返回旧数据再后台刷新
+    MODEL_CATALOG_TTL = float(os.getenv('MODEL_CATALOG_TTL', '600'))
+    MODEL_CATALOG_STALE_TTL = float(os.getenv('MODEL_CATALOG_STALE_TTL', '86400'))
+    
+    # 上游健康探测间隔（秒），<=0 表示关闭后台探测
+    HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '300'))
     
     # 允许的前端域名（CORS）
     FRONTEND_ORIGIN = os.getenv('FRONTEND_ORIGIN', 'http://localhost:8000')
+    
+    # 提示词版本（选择 services/prompts.py 中登记的提示词，同时参与缓存键计算）
+    PROMPT_VERSION = os.getenv('PROMPT_VERSION', 'v2')
+    
+    # 输出token预算：按题型与题目长度估算 max_tokens，解答被截断时按上限重新请求（流式接口始终使用上限）
+    MAX_OUTPUT_TOKENS = int(os.getenv('MAX_OUTPUT_TOKENS', '4000'))  # 输出token上限
+    TOKEN_BUDGET_ENABLED = os.getenv('TOKEN_BUDGET_ENABLED', 'true').lower() == 'true'
+    
+    # 提示词前缀缓存提示（需上游支持）：空为不设置 / openai（prompt_cache_key）/ cache_control（显式缓存标记）
+    PROMPT_CACHE_HINTS = os.getenv('PROMPT_CACHE_HINTS', '')
+    
+    # 解答缓存配置
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')  # memory / sqlite / none
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1000'))
+    CACHE_TTL = int(os.getenv('CACHE_TTL', '604800'))  # 秒，<=0 表示永不过期
+    CACHE_SQLITE_PATH = os.getenv('CACHE_SQLITE_PATH', os.path.join(BASE_DIR, 'data', 'solution_cache.db'))
+    
+    # 相似题目索引配置
+    SIMILARITY_ENABLED = os.getenv('SIMILARITY_ENABLED', 'true').lower() == 'true'
+    SIMILARITY_THRESHOLD = float(os.getenv('SIMILARITY_THRESHOLD', '0.85'))
+    SIMILARITY_INDEX_DIR = os.getenv('SIMILARITY_INDEX_DIR', os.path.join(BASE_DIR, 'data', 'similarity_index'))
+    SIMILARITY_MAX_ENTRIES = int(os.getenv('SIMILARITY_MAX_ENTRIES', '10000'))  # 最多保存的题目数，超出时淘汰最早加入的，<=0 表示不限制
+    SIMILARITY_TTL = int(os.getenv('SIMILARITY_TTL', '604800'))  # 秒，<=0 表示永不过期
+    
+    # 解题记录（SQLite FTS5 全文检索，/api/search 查询历史解答）
+    PROBLEM_STORE_ENABLED = os.getenv('PROBLEM_STORE_ENABLED', 'true').lower() == 'true'
+    PROBLEM_STORE_PATH = os.getenv('PROBLEM_STORE_PATH', os.path.join(BASE_DIR, 'data', 'problems.db'))
+    SEARCH_MAX_PAGE_SIZE = int(os.getenv('SEARCH_MAX_PAGE_SIZE', '50'))  # 每页最多条数
+    
+    # 图片感知哈希缓存配置
+    IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', 'true').lower() == 'true'
+    IMAGE_CACHE_MAX_ENTRIES = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '5000'))
+    IMAGE_CACHE_TTL = int(os.getenv('IMAGE_CACHE_TTL', '604800'))  # 秒，<=0 表示永不过期
+    IMAGE_HASH_MAX_DISTANCE = int(os.getenv('IMAGE_HASH_MAX_DISTANCE', '4'))  # 64位dHash的最大汉明距离
+    IMAGE_HASH_VERIFY_DISTANCE = int(os.getenv('IMAGE_HASH_VERIFY_DISTANCE', '16'))  # 命中前复核：256位dHash的最大汉明距离
+    
+    # 图片预处理配置（调用视觉模型前）
+    IMAGE_PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS_ENABLED', 'true').lower() == 'true'
+    IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '2048'))
+    IMAGE_SHORT_SIDE = int(os.getenv('IMAGE_SHORT_SIDE', '768'))
+    IMAGE_GRAYSCALE = os.getenv('IMAGE_GRAYSCALE', 'true').lower() == 'true'
+    IMAGE_AUTOCROP = os.getenv('IMAGE_AUTOCROP', 'true').lower() == 'true'
+    IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG')  # JPEG / WEBP
+    IMAGE_OUTPUT_QUALITY = int(os.getenv('IMAGE_OUTPUT_QUALITY', '85'))
+    
+    # 批量解题
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))  # 单次请求最多题目数
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '16'))  # 单次请求内同时解题的数量
+    
+    # 异步解题任务
+    JOB_BACKEND = os.getenv('JOB_BACKEND', 'memory')  # memory / sqlite（服务重启后继续执行未完成的任务）
+    JOB_SQLITE_PATH = os.getenv('JOB_SQLITE_PATH', os.path.join(BASE_DIR, 'data', 'jobs.db'))
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))  # 后台解题线程数，即任务同时调用上游的数量
+    JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '1000'))  # 排队任务上限，超出返回503
+    JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '3600'))  # 任务结束后结果保留时间（秒）
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))  # 上游过载或熔断时的最多尝试次数
+    JOB_WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.getenv('JOB_WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()]  # 允许的回调主机名（逗号分隔），为空时只允许解析为公网地址的主机
+    JOB_RECOVER_RUNNING = os.getenv('JOB_RECOVER_RUNNING', 'true').lower() == 'true'  # 启动时将上次退出时执行中的任务重新排队（serve.py 在主进程中统一处理）
+    
+    # 生产服务启动器（python serve.py）
+    SERVER_MODE = os.getenv('SERVER_MODE', 'asgi')  # asgi（hypercorn）/ wsgi（gunicorn，不支持Windows）
+    HOST = os.getenv('HOST', '0.0.0.0')
+    PORT = int(os.getenv('PORT', '5000'))
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', str(os.cpu_count() or 1)))  # 工作进程数
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '32'))  # 每个工作进程的线程数（wsgi为请求线程，asgi为同步接口线程池）
+    SERVER_KEEPALIVE = float(os.getenv('SERVER_KEEPALIVE', '75'))  # 长连接空闲保持时间（秒），应大于负载均衡的空闲超时
+    SERVER_GRACEFUL_TIMEOUT = float(os.getenv('SERVER_GRACEFUL_TIMEOUT', '90'))  # 退出时等待进行中的解题完成的最长时间（秒）
+    SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '2048'))  # 监听队列长度
+    
+    # 上传配置
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))  # 请求体上限（字节），超出返回413
+    UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', str(512 * 1024)))  # 上传文件超过此大小后转存临时文件
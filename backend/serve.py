@@ -0,0 +1,157 @@
+"""
+生产服务启动器
+以多个工作进程运行后端，吞吐随CPU核数扩展；每个工作进程独立初始化AI服务、缓存与后台线程
+
+启动方式：
+    cd backend
+    python serve.py                                  # 按 SERVER_MODE 等配置启动
+    python serve.py --mode wsgi --workers 8 --threads 32
+
+两种模式：
+    asgi  hypercorn 多进程，解题接口走异步应用，其余接口在每个进程的线程池中执行（默认，支持Windows）
+    wsgi  gunicorn gthread 多进程多线程运行 Flask 应用；主进程预先导入依赖库，工作进程 fork 后再导入应用
+
+进程内缓存、指标与限流额度均按工作进程独立计算，/api/cache/stats 与 /api/metrics 只返回响应请求的进程的数据；
+多进程部署时异步任务必须使用 JOB_BACKEND=sqlite，使任一进程都能查询到其他进程提交的任务（JOB_BACKEND=memory 时自动改用 sqlite）
+"""
+
+import os
+import sys
+
+
+def _preload() -> None:
+    """
+    在主进程中预先导入依赖库与服务模块（不创建任何服务实例）
+
+    工作进程 fork 后直接共享已导入的模块，启动更快、占用内存更少；
+    AI服务、缓存、数据库连接与后台线程都在工作进程中导入 app 时创建，不会跨 fork 共享
+    """
+    import flask  # noqa: F401
+    import openai  # noqa: F401
+    from PIL import Image  # noqa: F401  # type: ignore[reportMissingImports]
+    import services.job_queue  # noqa: F401  # type: ignore[reportImplicitRelativeImport]
+    import services.provider_pool  # noqa: F401  # type: ignore[reportImplicitRelativeImport]
+    import services.cascade  # noqa: F401  # type: ignore[reportImplicitRelativeImport]
+    import services.image_preprocess  # noqa: F401  # type: ignore[reportImplicitRelativeImport]
+
+
+def _recover_jobs(config) -> None:
+    """在启动工作进程前，将上次退出时执行中的任务统一重新排队（只执行一次，工作进程不再处理）"""
+    if config.JOB_BACKEND.lower() != 'sqlite':
+        return
+    from services.job_queue import SQLiteJobStore  # type: ignore[reportImplicitRelativeImport]
+
+    store = SQLiteJobStore(config.JOB_SQLITE_PATH)
+    try:
+        count = store.requeue_running()
+    finally:
+        store.close()
+    if count:
+        print(f"已将 {count} 个未执行完的任务重新排队")
+
+
+def run_wsgi(config) -> None:
+    """以 gunicorn（gthread）运行 Flask 应用"""
+    try:
+        from gunicorn.app.base import BaseApplication  # type: ignore[reportMissingImports]
+    except ImportError:
+        print("wsgi 模式需要安装 gunicorn（pip install gunicorn，不支持Windows），或使用 --mode asgi")
+        sys.exit(1)
+
+    def worker_exit(server, worker):
+        # 请求已排空，再等待后台执行中的解题任务（超时未完成的任务下次启动时重新排队）
+        app_module = sys.modules.get('app')
+        if app_module is not None:
+            app_module.stop_background_services(config.SERVER_GRACEFUL_TIMEOUT)
+
+    class GunicornApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # preload_app 关闭：在工作进程 fork 之后才导入应用并初始化服务
+            from app import app  # type: ignore[reportImplicitRelativeImport]
+            return app
+
+    _preload()
+    GunicornApplication({
+        'bind': f"{config.HOST}:{config.PORT}",
+        'workers': max(1, config.SERVER_WORKERS),
+        'worker_class': 'gthread',
+        'threads': max(1, config.SERVER_THREADS),
+        'keepalive': int(config.SERVER_KEEPALIVE),
+        'graceful_timeout': int(config.SERVER_GRACEFUL_TIMEOUT),
+        # gthread 的心跳与请求线程无关，长时间的解题不会触发超时重启
+        'timeout': int(config.SERVER_GRACEFUL_TIMEOUT),
+        'backlog': config.SERVER_BACKLOG,
+        'preload_app': False,
+        'worker_exit': worker_exit
+    }).run()
+
+
+def run_asgi(config) -> None:
+    """以 hypercorn 多进程运行ASGI应用"""
+    import importlib.util
+    from hypercorn.config import Config as HypercornConfig  # type: ignore[reportMissingImports]
+    from hypercorn.run import run  # type: ignore[reportMissingImports]
+
+    hypercorn_config = HypercornConfig()
+    # hypercorn 以 spawn 方式创建工作进程，每个进程各自导入 asgi（及 app）并初始化服务
+    hypercorn_config.application_path = 'asgi:asgi_app'
+    hypercorn_config.bind = [f"{config.HOST}:{config.PORT}"]
+    hypercorn_config.workers = max(1, config.SERVER_WORKERS)
+    hypercorn_config.worker_class = 'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio'
+    hypercorn_config.keep_alive_timeout = config.SERVER_KEEPALIVE
+    hypercorn_config.graceful_timeout = config.SERVER_GRACEFUL_TIMEOUT
+    hypercorn_config.backlog = config.SERVER_BACKLOG
+    sys.exit(run(hypercorn_config))
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='生产服务启动器')
+    parser.add_argument('--mode', choices=('asgi', 'wsgi'), default=None, help='服务模式（默认 SERVER_MODE）')
+    parser.add_argument('--host', default=None, help='监听地址（默认 HOST）')
+    parser.add_argument('--port', type=int, default=None, help='监听端口（默认 PORT）')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数（默认 SERVER_WORKERS）')
+    parser.add_argument('--threads', type=int, default=None, help='每个工作进程的线程数（默认 SERVER_THREADS）')
+    args = parser.parse_args()
+
+    # 命令行参数写入环境变量，主进程与各工作进程读取到相同的配置
+    for name, value in (('SERVER_MODE', args.mode), ('HOST', args.host), ('PORT', args.port),
+                        ('SERVER_WORKERS', args.workers), ('SERVER_THREADS', args.threads)):
+        if value is not None:
+            os.environ[name] = str(value)
+    # 遗留任务由主进程统一重新排队，工作进程启动时不再重置执行中的任务（其他进程可能正在执行）
+    os.environ['JOB_RECOVER_RUNNING'] = 'false'
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from config import Config  # type: ignore[reportImplicitRelativeImport]
+
+    mode = Config.SERVER_MODE.lower()
+    if mode not in ('asgi', 'wsgi'):
+        print(f"未知的服务模式: {Config.SERVER_MODE}（可选: asgi / wsgi）")
+        sys.exit(1)
+    if Config.SERVER_WORKERS > 1 and Config.JOB_BACKEND.lower() == 'memory':
+        # 内存任务存储只在提交任务的进程中可见，轮询会随机返回404；改用各进程共享的 SQLite 任务存储
+        os.environ['JOB_BACKEND'] = 'sqlite'
+        Config.JOB_BACKEND = 'sqlite'
+        print(f"多进程部署不支持内存任务存储，已改用 JOB_BACKEND=sqlite（{Config.JOB_SQLITE_PATH}）")
+
+    _recover_jobs(Config)
+    print(f"启动 {mode} 服务: {Config.HOST}:{Config.PORT}，{max(1, Config.SERVER_WORKERS)} 个工作进程，"
+          f"每进程 {max(1, Config.SERVER_THREADS)} 个线程")
+    if mode == 'wsgi':
+        run_wsgi(Config)
+    else:
+        run_asgi(Config)
+
+
+if __name__ == '__main__':
+    main()
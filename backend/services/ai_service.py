@@ -4,10 +4,20 @@ AI服务模块
 """
 
 import openai
-import requests
-import json
-import os
-from typing import Optional, Dict, Any
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, List
+
+from . import metrics
+from .http_client import HTTPClientFactory
+from .prompts import (DEFAULT_PROMPT_VERSION, TOKEN_BUDGETS, PromptSet, clean_transcript, estimate_max_tokens,
+                      get_prompt_set)
+from .rate_limiter import RateLimitShed, UpstreamLimiter
 
 
 class AIServiceError(Exception):
@@ -30,10 +40,394 @@ class AIServiceConnectionError(AIServiceError):
     pass
 
 
+class AIServiceRateLimitError(AIServiceAPIError):
+    """AI服务调用频率超限异常"""
+
+    def __init__(self, message: str = '', retry_after: Optional[float] = None):
+        """
+        Args:
+            message: 错误信息
+            retry_after: 建议客户端重试前等待的秒数，未知时为None
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AIServiceCircuitOpenError(AIServiceConnectionError):
+    """上游熔断中，请求未发出即被拒绝"""
+
+    def __init__(self, message: str = '', retry_after: Optional[float] = None):
+        """
+        Args:
+            message: 错误信息
+            retry_after: 熔断剩余时间（秒）
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AIServiceOverloadedError(AIServiceRateLimitError):
+    """本地限流队列已满或排队超时，请求未发出"""
+    pass
+
+
+# 限流预估时每张图片计入的token数
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+_answer_origin: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('answer_origin', default=None)
+
+
+@contextmanager
+def track_answer() -> Iterator[Dict[str, Any]]:
+    """
+    记录实际给出解答的模型
+
+    在该上下文中调用解题接口，多后端路由切换或模型分级时，由最终给出解答的后端写入 model 字段
+
+    Yields:
+        解答来源字典，调用成功后包含 model
+    """
+    origin: Dict[str, Any] = {}
+    token = _answer_origin.set(origin)
+    try:
+        yield origin
+    finally:
+        _answer_origin.reset(token)
+
+
+def note_answer(**fields: Any) -> None:
+    """写入当前解答的来源（不在 track_answer 上下文中时忽略）"""
+    origin = _answer_origin.get()
+    if origin is not None:
+        origin.update(fields)
+
+
+def track_stream(chunks: Iterator[str], origin: Dict[str, Any]) -> Iterator[str]:
+    """
+    流式版本的 track_answer：只在读取每个片段期间记录来源，不把上下文泄漏给迭代的调用方
+
+    Args:
+        chunks: 解题接口返回的片段迭代器（生成器在首次读取时才调用上游）
+        origin: 解答来源字典，由给出解答的后端写入 model 字段
+    """
+    try:
+        while True:
+            token = _answer_origin.set(origin)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                _answer_origin.reset(token)
+            yield chunk
+    finally:
+        # 调用方中途停止读取时立即关闭上游流，释放限流额度与连接
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+async def atrack_stream(chunks: AsyncIterator[str], origin: Dict[str, Any]) -> AsyncIterator[str]:
+    """track_stream 的异步版本"""
+    try:
+        while True:
+            token = _answer_origin.set(origin)
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                _answer_origin.reset(token)
+            yield chunk
+    finally:
+        aclose = getattr(chunks, 'aclose', None)
+        if aclose is not None:
+            await aclose()
+
+
+def _usage_tokens(response: Any) -> Optional[int]:
+    """从补全结果中读取实际消耗的token数"""
+    usage = getattr(response, 'usage', None)
+    return getattr(usage, 'total_tokens', None) if usage is not None else None
+
+
+def _route_of(messages: List[Dict[str, Any]]) -> str:
+    """按消息内容区分文字解题与图片解题，用作指标标签"""
+    for message in messages:
+        content = message['content']
+        if isinstance(content, list) and any(part.get('type') == 'image_url' for part in content):
+            return 'image'
+    return 'text'
+
+
+def _cached_tokens(usage: Any) -> Optional[int]:
+    """
+    读取上游报告的提示词前缀缓存命中token数
+
+    OpenAI 及兼容接口为 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens，
+    Anthropic 兼容网关为 cache_read_input_tokens
+    """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+    if cached is None:
+        cached = getattr(usage, 'cache_read_input_tokens', None)
+    return cached
+
+
+def _outcome(e: Optional[BaseException]) -> str:
+    """上游调用结果分类，用作指标标签"""
+    if e is None:
+        return 'ok'
+    if isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+        return 'cancelled'
+    if isinstance(e, AIServiceCircuitOpenError):
+        return 'circuit_open'
+    if isinstance(e, openai.APITimeoutError):
+        return 'timeout'
+    if isinstance(e, openai.APIConnectionError):
+        return 'connection_error'
+    if isinstance(e, openai.RateLimitError):
+        return 'rate_limited'
+    if isinstance(e, openai.APIStatusError):
+        return 'server_error' if e.status_code >= 500 else 'client_error'
+    return 'error'
+
+
+class _UpstreamCall:
+    """记录一次上游调用（含重试）的耗时、结果与token用量"""
+
+    def __init__(self, model: str, route: str, stream: bool):
+        self.model = model
+        self.route = route
+        self.stream = stream
+        self.start = time.perf_counter()
+        self.first_chunk = True
+
+    def on_chunk(self) -> None:
+        if self.first_chunk:
+            self.first_chunk = False
+            metrics.UPSTREAM_FIRST_TOKEN.observe(time.perf_counter() - self.start, self.model, self.route)
+
+    def on_usage(self, response: Any) -> None:
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            value = getattr(usage, kind, None)
+            if value:
+                metrics.UPSTREAM_TOKENS.inc(self.model, kind[:-len('_tokens')], amount=value)
+        cached = _cached_tokens(usage)
+        if cached:
+            metrics.UPSTREAM_TOKENS.inc(self.model, 'cached', amount=cached)
+
+    def __enter__(self) -> '_UpstreamCall':
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Optional[BaseException], tb: Any) -> None:
+        elapsed = time.perf_counter() - self.start
+        metrics.UPSTREAM_LATENCY.observe(elapsed, self.model, self.route, 'true' if self.stream else 'false')
+        metrics.UPSTREAM_REQUESTS.inc(self.model, self.route, _outcome(exc))
+        metrics.observe_stage('upstream', elapsed)
+
+
+def _is_transient(e: Exception) -> bool:
+    """是否为上游暂时性故障（超时、连接失败、频率超限、5xx），这类错误值得重试并计入熔断"""
+    if isinstance(e, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    """从上游响应头中解析建议的重试等待时间（秒），没有时返回None"""
+    if not isinstance(e, openai.APIStatusError):
+        return None
+    headers = e.response.headers
+    try:
+        if headers.get('retry-after-ms'):
+            return max(0.0, float(headers['retry-after-ms']) / 1000)
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    上游调用的重试策略
+
+    暂时性故障按带抖动的指数退避重试，上游给出 Retry-After 时按其等待；
+    重试次数受预算限制：每次请求按比例积累重试额度，上游大面积故障时重试不会成倍放大流量
+    """
+
+    def __init__(self, max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 budget_ratio: float = 0.2, budget_cap: float = 10.0):
+        """
+        Args:
+            max_retries: 单次请求的最大重试次数
+            backoff_base: 退避基准时间（秒），第n次重试前最多等待 backoff_base * 2^n
+            backoff_max: 单次等待上限（秒），Retry-After 超过此值时不再重试，直接失败
+            budget_ratio: 每次请求积累的重试额度，持续故障时重试数最多约为请求数的该比例
+            budget_cap: 重试额度上限，即突发故障时最多连续重试的次数
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget_ratio = budget_ratio
+        self.budget_cap = budget_cap
+
+        self._tokens = budget_cap
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def clone(self) -> 'RetryPolicy':
+        """以相同配置创建独立的重试策略（预算不共享）"""
+        return RetryPolicy(self.max_retries, self.backoff_base, self.backoff_max,
+                           self.budget_ratio, self.budget_cap)
+
+    def on_request(self) -> None:
+        """记录一次新请求，积累重试额度"""
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget_ratio, self.budget_cap)
+
+    def next_delay(self, attempt: int, e: Exception) -> Optional[float]:
+        """
+        计算第 attempt 次重试前的等待时间
+
+        Returns:
+            等待秒数，不应重试时返回None
+        """
+        if attempt >= self.max_retries:
+            return None
+
+        delay = _retry_after(e)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        elif delay > self.backoff_max:
+            return None
+
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                return None
+            self._tokens -= 1
+            self.retries += 1
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'retries': self.retries,
+                'budget_exhausted': self.budget_exhausted,
+                'budget_tokens': round(self._tokens, 2)
+            }
+
+
+class CircuitBreaker:
+    """
+    单个上游的熔断器
+
+    连续暂时性故障达到阈值后熔断，熔断期内请求直接失败；
+    冷却结束后放行一个试探请求，成功则恢复，失败则继续熔断
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: 触发熔断的连续失败次数，<=0 表示不熔断
+            reset_timeout: 熔断持续时间（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def clone(self) -> 'CircuitBreaker':
+        """以相同配置创建独立的熔断器"""
+        return CircuitBreaker(self.failure_threshold, self.reset_timeout)
+
+    def allow(self) -> bool:
+        """判断是否放行请求"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            now = time.time()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_at = None
+            if self.state == self.HALF_OPEN:
+                # 只放行一个试探请求；试探请求迟迟没有结果时允许再试
+                if self._trial_at is None or now - self._trial_at >= self.reset_timeout:
+                    self._trial_at = now
+                    return True
+            elif self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self) -> float:
+        """熔断剩余时间（秒），未熔断时为0"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.time() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_at = None
+
+    def record_failure(self) -> None:
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"上游连续失败 {self._failures} 次，熔断 {self.reset_timeout:g} 秒")
+                self.state = self.OPEN
+                self._opened_at = time.time()
+                self._trial_at = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected
+            }
+
+
 class AIService:
     """AI解题服务类"""
     
-    def __init__(self, api_key: str, api_base: str, model: str):
+    def __init__(self, api_key: str, api_base: str, model: str, timeout: float = 60.0,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[UpstreamLimiter] = None,
+                 prompts: Optional[PromptSet] = None,
+                 max_output_tokens: int = 4000,
+                 token_budget: bool = True,
+                 prompt_cache: str = '',
+                 http_clients: Optional[HTTPClientFactory] = None):
         """
         初始化AI服务
 
@@ -41,6 +435,15 @@ class AIService:
             api_key: API密钥
             api_base: API基础地址
             model: 模型名称
+            timeout: 单次上游请求超时（秒）
+            retry_policy: 重试策略，为None时使用默认策略
+            circuit_breaker: 熔断器，为None时使用默认配置
+            limiter: 上游限流器，为None时不限流
+            prompts: 提示词，为None时使用默认版本
+            max_output_tokens: 输出token上限
+            token_budget: 是否按题型估算输出token预算，关闭时始终使用上限
+            prompt_cache: 提示词前缀缓存提示（'' 不设置 / openai / cache_control），需上游支持
+            http_clients: 共享的上游HTTP连接池，为None时使用OpenAI客户端自带的连接池
 
         Raises:
             AIServiceInitError: 当初始化失败时抛出
@@ -48,6 +451,22 @@ class AIService:
         self.api_key = api_key
         self.api_base = api_base or 'https://api.openai.com/v1'
         self.model = model
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.limiter = limiter or UpstreamLimiter()
+        self.prompts = prompts or get_prompt_set(DEFAULT_PROMPT_VERSION)
+        self.max_output_tokens = max_output_tokens
+        self.token_budget = token_budget
+        self.prompt_cache = prompt_cache
+        self.http_clients = http_clients
+        if prompt_cache not in ('', 'openai', 'cache_control'):
+            raise AIServiceInitError(f"不支持的提示词缓存提示: {prompt_cache}")
+
+        # 系统消息只构建一次，每次请求发送完全相同的前缀，便于上游命中前缀缓存
+        self._text_system_message = self._system_message(self.prompts.text_system)
+        self._image_system_message = self._system_message(self.prompts.image_system)
+        self._transcribe_system_message = self._system_message(self.prompts.transcribe_system)
 
         # 验证API密钥
         if not api_key or not api_key.strip():
@@ -55,36 +474,69 @@ class AIService:
             print(f"OpenAI客户端初始化失败: {error_msg}")
             raise AIServiceInitError(error_msg)
 
-        # 配置OpenAI客户端
+        # OpenAI客户端在首次调用时创建，构造服务不产生任何网络请求
+        self._client: Optional[openai.OpenAI] = None
+        self._async_client: Optional[openai.AsyncOpenAI] = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def models(self) -> List[str]:
+        """可能给出解答的模型，查询缓存时接受这些模型的解答"""
+        return [self.model]
+
+    @property
+    def client(self) -> openai.OpenAI:
+        """
+        获取OpenAI客户端（首次访问时创建）
+
+        Raises:
+            AIServiceInitError: 当客户端创建失败时抛出
+        """
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    @property
+    def async_client(self) -> openai.AsyncOpenAI:
+        """
+        获取异步OpenAI客户端（首次访问时创建），供ASGI服务模式使用
+
+        Raises:
+            AIServiceInitError: 当客户端创建失败时抛出
+        """
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    self._async_client = self._create_client(async_mode=True)
+        return self._async_client
+
+    def _create_client(self, async_mode: bool = False) -> Any:
+        """配置OpenAI客户端"""
+        client_class = openai.AsyncOpenAI if async_mode else openai.OpenAI
+        # 使用共享连接池时，各后端的请求复用同一组长连接
+        shared = {}
+        if self.http_clients is not None:
+            shared['http_client'] = self.http_clients.async_client if async_mode else self.http_clients.client
         try:
-            if api_base and api_base != 'https://api.openai.com/v1':
+            if self.api_base and self.api_base != 'https://api.openai.com/v1':
                 # 使用自定义的API地址
-                self.client = openai.OpenAI(
-                    api_key=api_key,
-                    base_url=api_base,
-                    timeout=30.0  # 添加超时设置
+                return client_class(
+                    api_key=self.api_key,
+                    base_url=self.api_base,
+                    timeout=30.0,  # 添加超时设置
+                    max_retries=0,  # 重试由 RetryPolicy 统一控制，避免与客户端内置重试叠加
+                    **shared
                 )
             else:
                 # 使用默认的OpenAI地址
-                self.client = openai.OpenAI(
-                    api_key=api_key,
-                    timeout=30.0
-                )
-
-            # 测试连接是否成功
-            try:
-                self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[{"role": "user", "content": "test"}],
-                    max_tokens=1
+                return client_class(
+                    api_key=self.api_key,
+                    timeout=30.0,
+                    max_retries=0,
+                    **shared
                 )
-            except Exception as test_error:
-                print(f"OpenAI客户端连接测试失败: {str(test_error)}")
-                raise AIServiceInitError(f"API连接测试失败: {str(test_error)}")
-
-        except AIServiceInitError:
-            # 重新抛出初始化异常
-            raise
         except Exception as e:
             error_msg = f"OpenAI客户端初始化失败: {str(e)}"
             print(error_msg)
@@ -110,93 +562,18 @@ class AIService:
             return None
 
         try:
-            # 构建提示词
-            system_prompt = """你是一个专业的AI解题助手。请按照以下要求解答问题：
-
-                1. 仔细阅读并理解题目
-                2. 提供详细的解题步骤和思路
-                3. 如果涉及计算，展示完整的计算过程
-                4. 最后给出明确的答案
-                5. 使用清晰、易懂的语言
-                6. 对于数学问题，可以使用LaTeX格式表示公式
-                7. 如果问题不完整或不清楚，请指出并请求澄清
-
-                请按照以下格式回答：
-
-                **问题分析**：
-                [分析题目要求和已知条件]
-
-                **解题思路**：
-                [描述解题的整体思路和方法]
-
-                **详细步骤**：
-                [展示详细的解题步骤]
-
-                **最终答案**：
-                [给出明确的最终答案]
-
-                现在开始解题："""
-
-            user_prompt = f"题目：{problem}\n\n请详细解答这个问题。"
-
-            # 调用API
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.7,
-                max_tokens=4000,
-                top_p=0.9,
-                frequency_penalty=0,
-                presence_penalty=0,
-                timeout=60.0  # 添加请求超时
-            )
-
-            # 提取回答
-            if response.choices and len(response.choices) > 0:
-                solution = response.choices[0].message.content
-                if solution and solution.strip():
-                    return solution
-                else:
-                    print("AI返回的答案为空")
-                    return None
-            else:
-                print("AI未返回有效的选择")
-                return None
-
-        except openai.APITimeoutError as e:
-            error_msg = f"API请求超时: {str(e)}"
-            print(error_msg)
-            raise AIServiceConnectionError(error_msg)
-        except openai.APIConnectionError as e:
-            error_msg = f"API连接错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceConnectionError(error_msg)
-        except openai.RateLimitError as e:
-            error_msg = f"API调用频率超限: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
-        except openai.APIStatusError as e:
-            error_msg = f"API状态错误 (状态码: {e.status_code}): {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
-        except openai.APIError as e:
-            error_msg = f"API调用错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
+            response = self._complete(self._build_text_messages(problem), self._max_tokens(problem))
+            return self._extract_solution(response)
         except Exception as e:
-            error_msg = f"未知错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
+            raise self._convert_error(e)
 
-    def solve_problem_with_image(self, image_base64: str) -> Optional[str]:
+    def solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
         """
         使用AI模型识别图片中的题目并解答
 
         Args:
             image_base64: Base64编码的图片数据
+            mime_type: 图片MIME类型
 
         Returns:
             解决方案文本，如果失败返回None
@@ -206,174 +583,482 @@ class AIService:
             AIServiceConnectionError: 当网络连接失败时抛出
         """
         try:
-            # 构建提示词
-            system_prompt = f"""你是一个专业的AI解题助手。用户会上传一张题目图片，请你：
-
-                    1. 仔细识别图片中的题目内容
-                    2. 如果图片不清晰或无法识别，请说明
-                    3. 提供详细的解题步骤和思路
-                    4. 如果涉及计算，展示完整的计算过程
-                    5. 最后给出明确的答案
-                    6. 使用清晰、易懂的语言
-                    7. 对于数学问题，可以使用LaTeX格式表示公式
-                    8. 如果问题不完整或不清楚，请指出并请求澄清
-                    9. 如果用户上传的图片中没有题目，请说明
-
-                    请按照以下格式回答：
-                    **问题分析**：
-                    [分析题目要求和已知条件]
-
-                    **解题思路**：
-                    [描述解题的整体思路和方法]
-
-                    **详细步骤**：
-                    [展示详细的解题步骤]
-
-                    **最终答案**：
-                    [给出明确的最终答案]
-
-                    现在开始解题：
-                    """
-
-            # 构建消息，包含图片
-            # 检测API类型以确定图片格式
-            api_base = self.api_base or ''
-            is_zhipu = 'bigmodel.cn' in api_base or 'zhipu' in api_base
-
-            if is_zhipu:
-                # 智谱AI格式 (GLM-4V)
-                user_content = [
-                    {"type": "text", "text": "请识别并解答这道题目："},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": image_base64
-                        }
-                    }
-                ]
-            else:
-                # OpenAI标准格式
-                user_content = [
-                    {"type": "text", "text": "请识别并解答这道题目："},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        }
-                    }
-                ]
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {
-                        "role": "user",
-                        "content": user_content
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=4000,
-                top_p=0.9,
-                frequency_penalty=0,
-                presence_penalty=0,
-                timeout=60.0
-            )
-
-            # 提取回答
-            if response.choices and len(response.choices) > 0:
-                solution = response.choices[0].message.content
-                if solution and solution.strip():
-                    return solution
-                else:
-                    print("AI返回的答案为空")
-                    return None
-            else:
-                print("AI未返回有效的选择")
-                return None
+            response = self._complete(self._build_image_messages(image_base64, mime_type), self._max_tokens(None))
+            return self._extract_solution(response)
+        except Exception as e:
+            raise self._convert_error(e)
 
-        except openai.APITimeoutError as e:
-            error_msg = f"API请求超时: {str(e)}"
-            print(error_msg)
-            raise AIServiceConnectionError(error_msg)
-        except openai.APIConnectionError as e:
-            error_msg = f"API连接错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceConnectionError(error_msg)
-        except openai.RateLimitError as e:
-            error_msg = f"API调用频率超限: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
-        except openai.APIStatusError as e:
-            error_msg = f"API状态错误 (状态码: {e.status_code}): {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
-        except openai.APIError as e:
-            error_msg = f"API调用错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
+    def transcribe_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        """
+        将图片中的题目转写为文字（只识别不解答，输出token预算较小）
+
+        Args:
+            image_base64: Base64编码的图片数据
+            mime_type: 图片MIME类型
+
+        Returns:
+            规范化后的题目文本，图片中没有题目或无法识别时返回None
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        try:
+            response = self._complete(self._build_image_messages(image_base64, mime_type, transcribe=True),
+                                      self._transcribe_tokens(), temperature=0)
+            return clean_transcript(self._extract_solution(response))
         except Exception as e:
-            error_msg = f"未知错误: {str(e)}"
-            print(error_msg)
-            raise AIServiceAPIError(error_msg)
+            raise self._convert_error(e)
+
+    def stream_solve_problem(self, problem: str) -> Iterator[str]:
+        """
+        流式解题，逐段返回模型生成的增量文本
+
+        Args:
+            problem: 问题描述
+
+        Yields:
+            增量文本片段
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        if not problem or not problem.strip():
+            print("问题描述不能为空")
+            return
+
+        # 流式输出无法在截断后重新请求（已发送的片段不能撤回），因此始终使用输出token上限
+        yield from self._stream_completion(self._build_text_messages(problem), self.max_output_tokens)
+
+    def stream_solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Iterator[str]:
+        """
+        流式识别图片中的题目并解答，逐段返回模型生成的增量文本
+
+        Args:
+            image_base64: Base64编码的图片数据
+            mime_type: 图片MIME类型
+
+        Yields:
+            增量文本片段
 
-    def test_connection(self) -> bool:
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        yield from self._stream_completion(self._build_image_messages(image_base64, mime_type), self.max_output_tokens)
+
+    async def asolve_problem(self, problem: str) -> Optional[str]:
         """
-        测试API连接是否正常
+        solve_problem 的异步版本，等待上游期间不占用线程
+
+        Args:
+            problem: 问题描述
 
         Returns:
-            连接是否成功
+            解决方案文本，如果失败返回None
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
         """
+        if not problem or not problem.strip():
+            print("问题描述不能为空")
+            return None
+
         try:
-            # 发送一个简单的请求测试连接
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": "Hello"}],
-                max_tokens=5,
-                timeout=30.0
-            )
-            print("API连接测试成功")
-            return True
-        except openai.APITimeoutError as e:
-            print(f"API连接测试超时: {str(e)}")
-            return False
-        except openai.APIConnectionError as e:
-            print(f"API连接测试失败: {str(e)}")
-            return False
-        except openai.APIError as e:
-            print(f"API连接测试失败: {str(e)}")
-            return False
+            response = await self._acomplete(self._build_text_messages(problem), self._max_tokens(problem))
+            return self._extract_solution(response)
         except Exception as e:
-            print(f"API连接测试失败: {str(e)}")
-            return False
+            raise self._convert_error(e)
 
-class AI_list(AIService):
-    def __init__(self, api_key, api_base, model):
-        super().__init__(api_key, api_base, model)
-        self.api_base = api_base + "/models"
-        self.api_key = api_key
-        self.model = model
-        
-    def get_list(self):
-        url = self.api_base + "/models"
-        header = self.api_key
+    async def asolve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        """
+        solve_problem_with_image 的异步版本
+
+        Args:
+            image_base64: Base64编码的图片数据
+            mime_type: 图片MIME类型
+
+        Returns:
+            解决方案文本，如果失败返回None
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
         try:
+            response = await self._acomplete(self._build_image_messages(image_base64, mime_type), self._max_tokens(None))
+            return self._extract_solution(response)
+        except Exception as e:
+            raise self._convert_error(e)
 
-            response = requests.get(self.api_base, headers={"Authorization": f"Bearer {self.api_key}"})
+    async def atranscribe_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        """transcribe_image 的异步版本"""
+        try:
+            response = await self._acomplete(self._build_image_messages(image_base64, mime_type, transcribe=True),
+                                             self._transcribe_tokens(), temperature=0)
+            return clean_transcript(self._extract_solution(response))
+        except Exception as e:
+            raise self._convert_error(e)
 
+    def astream_solve_problem(self, problem: str) -> AsyncIterator[str]:
+        """stream_solve_problem 的异步版本"""
+        return self._astream_completion(self._build_text_messages(problem), self.max_output_tokens)
 
-            if response.status_code == 200:
+    def astream_solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> AsyncIterator[str]:
+        """stream_solve_problem_with_image 的异步版本"""
+        return self._astream_completion(self._build_image_messages(image_base64, mime_type), self.max_output_tokens)
 
-                return response.json()
+    def _build_text_messages(self, problem: str) -> List[Dict[str, Any]]:
+        """构建文字解题的消息列表"""
+        return [
+            self._text_system_message,
+            {"role": "user", "content": self.prompts.text_user_prompt(problem)}
+        ]
 
-            else:
+    def _build_image_messages(self, image_base64: str, mime_type: str = 'image/jpeg',
+                              transcribe: bool = False) -> List[Dict[str, Any]]:
+        """构建图片解题（transcribe 为True时为题目转写）的消息列表，包含图片"""
+        # 检测API类型以确定图片格式
+        api_base = self.api_base or ''
+        is_zhipu = 'bigmodel.cn' in api_base or 'zhipu' in api_base
+
+        if is_zhipu:
+            # 智谱AI格式 (GLM-4V)
+            image_url = image_base64
+        else:
+            # OpenAI标准格式
+            image_url = f"data:{mime_type};base64,{image_base64}"
+
+        user_content = [
+            {"type": "text", "text": self.prompts.transcribe_user if transcribe else self.prompts.image_user},
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": image_url
+                }
+            }
+        ]
+        return [
+            self._transcribe_system_message if transcribe else self._image_system_message,
+            {"role": "user", "content": user_content}
+        ]
+
+    def _system_message(self, prompt: str) -> Dict[str, Any]:
+        """
+        构建系统消息
+
+        cache_control 模式下将系统提示词标记为可缓存的前缀（Anthropic 兼容网关、通义千问等显式缓存接口）
+        """
+        if self.prompt_cache == 'cache_control':
+            return {
+                "role": "system",
+                "content": [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+            }
+        return {"role": "system", "content": prompt}
+
+    def _max_tokens(self, problem: Optional[str]) -> int:
+        """本次请求的输出token预算，图片题目传入None"""
+        if not self.token_budget:
+            return self.max_output_tokens
+        return estimate_max_tokens(problem, self.max_output_tokens)
+
+    def _transcribe_tokens(self) -> int:
+        """题目转写的输出token预算，不受 token_budget 开关影响"""
+        return min(self.max_output_tokens, TOKEN_BUDGETS['transcribe'])
+
+    def _complete(self, messages: List[Dict[str, Any]], max_tokens: int, temperature: float = 0.7) -> Any:
+        """按预算调用补全接口，解答因预算不足被截断时按上限重新请求一次"""
+        response = self._create_completion(messages, max_tokens, temperature)
+        if max_tokens < self.max_output_tokens and self._truncated(response, messages):
+            response = self._create_completion(messages, self.max_output_tokens, temperature)
+        return response
+
+    async def _acomplete(self, messages: List[Dict[str, Any]], max_tokens: int, temperature: float = 0.7) -> Any:
+        """_complete 的异步版本"""
+        response = await self._acreate_completion(messages, max_tokens, temperature)
+        if max_tokens < self.max_output_tokens and self._truncated(response, messages):
+            response = await self._acreate_completion(messages, self.max_output_tokens, temperature)
+        return response
+
+    def _truncated(self, response: Any, messages: List[Dict[str, Any]]) -> bool:
+        """解答是否因达到 max_tokens 被截断（计入指标）"""
+        if not response.choices or getattr(response.choices[0], 'finish_reason', None) != 'length':
+            return False
+        metrics.UPSTREAM_TRUNCATED.inc(self.model, _route_of(messages))
+        return True
+
+    def _completion_params(self, messages: List[Dict[str, Any]], stream: bool = False,
+                           max_tokens: Optional[int] = None, temperature: float = 0.7) -> Dict[str, Any]:
+        """构建对话补全请求参数（同步与异步客户端共用）"""
+        params = dict(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens or self.max_output_tokens,
+            top_p=0.9,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stream=stream,
+            timeout=self.timeout,  # 添加请求超时
+            **self._cache_params(messages)
+        )
+        if stream:
+            # 流式响应默认不含用量，要求上游在最后一个片段中报告 usage（含提示词缓存命中token数）
+            params['stream_options'] = {'include_usage': True}
+        return params
 
-                print(f"获取列表失败，状态码: {response.status_code}")
+    def _cache_params(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """openai 模式下按提示词版本与题目类型设置 prompt_cache_key，使相同前缀的请求路由到同一缓存"""
+        if self.prompt_cache != 'openai':
+            return {}
+        return {'extra_body': {'prompt_cache_key': f"solver-{self.prompts.version}-{_route_of(messages)}"}}
 
-                return []
+    def _create_completion(self, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None,
+                           temperature: float = 0.7) -> Any:
+        """调用对话补全接口（经过限流，带重试与熔断）"""
+        params = self._completion_params(messages, max_tokens=max_tokens, temperature=temperature)
+        with self.limiter.acquire(self._estimate_tokens(params)) as lease, \
+                _UpstreamCall(self.model, _route_of(messages), stream=False) as call:
+            response = self._call_with_retry(lambda: self.client.chat.completions.create(**params))
+            lease.set_usage(_usage_tokens(response))
+            call.on_usage(response)
+            note_answer(model=self.model)
+            return response
+
+    async def _acreate_completion(self, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None,
+                                  temperature: float = 0.7) -> Any:
+        """_create_completion 的异步版本"""
+        params = self._completion_params(messages, max_tokens=max_tokens, temperature=temperature)
+        with await self.limiter.aacquire(self._estimate_tokens(params)) as lease, \
+                _UpstreamCall(self.model, _route_of(messages), stream=False) as call:
+            response = await self._acall_with_retry(lambda: self.async_client.chat.completions.create(**params))
+            lease.set_usage(_usage_tokens(response))
+            call.on_usage(response)
+            note_answer(model=self.model)
+            return response
+
+    def _estimate_tokens(self, params: Dict[str, Any]) -> int:
+        """
+        预估一次调用消耗的token数，用于TPM限流
+
+        上游按 输入 + max_tokens 预占额度，这里同样预留，调用结束后按实际用量退还；
+        中文约每字1个token，按字符数估算输入，每张图片按 IMAGE_TOKEN_ESTIMATE 计
+        """
+        tokens = params.get('max_tokens') or 0
+        for message in params['messages']:
+            content = message['content']
+            if isinstance(content, str):
+                tokens += len(content)
+                continue
+            for part in content:
+                if part.get('type') == 'text':
+                    tokens += len(part['text'])
+                else:
+                    tokens += IMAGE_TOKEN_ESTIMATE
+        return tokens
+
+    def _call_with_retry(self, call: Callable[[], Any]) -> Any:
+        """
+        按重试策略调用上游，熔断期内直接失败
+
+        Raises:
+            AIServiceCircuitOpenError: 上游熔断中时抛出
+        """
+        self.retry_policy.on_request()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = call()
+            except Exception as e:
+                delay = self._on_call_error(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.circuit_breaker.record_success()
+            return result
+
+    async def _acall_with_retry(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """_call_with_retry 的异步版本，退避等待不占用线程"""
+        self.retry_policy.on_request()
+        attempt = 0
+        while True:
+            self._check_circuit()
+            try:
+                result = await call()
+            except Exception as e:
+                delay = self._on_call_error(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.circuit_breaker.record_success()
+            return result
+
+    def _check_circuit(self) -> None:
+        if not self.circuit_breaker.allow():
+            raise AIServiceCircuitOpenError(f"上游 {self.model} 暂时不可用（熔断中），请稍后重试",
+                                            retry_after=self.circuit_breaker.retry_after())
+
+    def _on_call_error(self, e: Exception, attempt: int) -> Optional[float]:
+        """
+        记录一次失败调用
 
+        Returns:
+            重试前的等待秒数，不应重试时返回None
+        """
+        if not _is_transient(e):
+            # 上游能正常响应（如请求参数错误），不计入熔断
+            self.circuit_breaker.record_success()
+            return None
+
+        self.circuit_breaker.record_failure()
+        delay = self.retry_policy.next_delay(attempt, e)
+        if delay is not None:
+            print(f"上游调用失败，{delay:.2f}秒后第{attempt + 1}次重试: {str(e)}")
+        return delay
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        """获取重试与熔断状态"""
+        return {
+            'circuit': self.circuit_breaker.stats(),
+            'retry': self.retry_policy.stats(),
+            'limiter': self.limiter.stats()
+        }
+
+    def _extract_solution(self, response: Any) -> Optional[str]:
+        """从补全结果中提取回答"""
+        if response.choices and len(response.choices) > 0:
+            solution = response.choices[0].message.content
+            if solution and solution.strip():
+                return solution
+            else:
+                print("AI返回的答案为空")
+                return None
+        else:
+            print("AI未返回有效的选择")
+            return None
+
+    def _stream_completion(self, messages: List[Dict[str, Any]], max_tokens: Optional[int] = None) -> Iterator[str]:
+        """以流式方式调用对话补全接口，逐段产出增量文本（读完之前一直占用限流额度）"""
+        params = self._completion_params(messages, stream=True, max_tokens=max_tokens)
+        try:
+            with self.limiter.acquire(self._estimate_tokens(params)) as lease, \
+                    _UpstreamCall(self.model, _route_of(messages), stream=True) as call:
+                stream = self._call_with_retry(lambda: self.client.chat.completions.create(**params))
+                note_answer(model=self.model)
+                generated = 0
+                usage: Optional[int] = None
+                try:
+                    for chunk in stream:
+                        if getattr(chunk, 'usage', None) is not None:
+                            call.on_usage(chunk)
+                            usage = _usage_tokens(chunk)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta is not None and delta.content:
+                            call.on_chunk()
+                            generated += len(delta.content)
+                            yield delta.content
+                        if getattr(chunk.choices[0], 'finish_reason', None) == 'length':
+                            metrics.UPSTREAM_TRUNCATED.inc(self.model, call.route)
+                finally:
+                    # 客户端提前断开时关闭上游连接，停止继续生成
+                    stream.close()
+                    # 上游报告了用量时按实际用量结算，否则按生成的字符数估算
+                    lease.set_usage(usage if usage is not None else lease.tokens - params['max_tokens'] + generated)
+        except Exception as e:
+            raise self._convert_error(e)
+
+    async def _astream_completion(self, messages: List[Dict[str, Any]],
+                                  max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """_stream_completion 的异步版本"""
+        params = self._completion_params(messages, stream=True, max_tokens=max_tokens)
+        try:
+            with await self.limiter.aacquire(self._estimate_tokens(params)) as lease, \
+                    _UpstreamCall(self.model, _route_of(messages), stream=True) as call:
+                stream = await self._acall_with_retry(lambda: self.async_client.chat.completions.create(**params))
+                note_answer(model=self.model)
+                generated = 0
+                usage: Optional[int] = None
+                try:
+                    async for chunk in stream:
+                        if getattr(chunk, 'usage', None) is not None:
+                            call.on_usage(chunk)
+                            usage = _usage_tokens(chunk)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta is not None and delta.content:
+                            call.on_chunk()
+                            generated += len(delta.content)
+                            yield delta.content
+                        if getattr(chunk.choices[0], 'finish_reason', None) == 'length':
+                            metrics.UPSTREAM_TRUNCATED.inc(self.model, call.route)
+                finally:
+                    await stream.close()
+                    lease.set_usage(usage if usage is not None else lease.tokens - params['max_tokens'] + generated)
         except Exception as e:
+            raise self._convert_error(e)
+
+    def _convert_error(self, e: Exception) -> AIServiceError:
+        """将OpenAI客户端异常转换为AI服务异常"""
+        if isinstance(e, AIServiceError):
+            return e
+        if isinstance(e, RateLimitShed):
+            error_msg = f"请求排队过多，已暂缓发送: {str(e)}"
+            print(error_msg)
+            return AIServiceOverloadedError(error_msg, retry_after=e.retry_after)
+        if isinstance(e, openai.APITimeoutError):
+            error_msg = f"API请求超时: {str(e)}"
+            print(error_msg)
+            return AIServiceConnectionError(error_msg)
+        if isinstance(e, openai.APIConnectionError):
+            error_msg = f"API连接错误: {str(e)}"
+            print(error_msg)
+            return AIServiceConnectionError(error_msg)
+        if isinstance(e, openai.RateLimitError):
+            error_msg = f"API调用频率超限: {str(e)}"
+            print(error_msg)
+            return AIServiceRateLimitError(error_msg, retry_after=_retry_after(e))
+        if isinstance(e, openai.APIStatusError):
+            error_msg = f"API状态错误 (状态码: {e.status_code}): {str(e)}"
+            print(error_msg)
+            return AIServiceAPIError(error_msg)
+        if isinstance(e, openai.APIError):
+            error_msg = f"API调用错误: {str(e)}"
+            print(error_msg)
+            return AIServiceAPIError(error_msg)
+        error_msg = f"未知错误: {str(e)}"
+        print(error_msg)
+        return AIServiceAPIError(error_msg)
 
-            print(f"获取列表时发生错误: {str(e)}")
+    def probe(self, timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        轻量探测上游连通性，供后台健康检查使用
+
+        熔断中时直接返回熔断状态，不发起请求；否则通过共享连接池请求不消耗token的 /models 接口。
+        上游未实现该接口（404）时同样说明地址可达、密钥有效，视为正常
+
+        Args:
+            timeout: 请求超时（秒）
 
-            return []
\ No newline at end of file
+        Returns:
+            {'status': 'ok' / 'error' / 'circuit_open'}，异常时另有 error
+        """
+        circuit = self.circuit_breaker.stats()['state']
+        if circuit == CircuitBreaker.OPEN:
+            return {'status': 'circuit_open', 'retry_after': round(self.circuit_breaker.retry_after(), 1)}
+        try:
+            self.client.with_options(timeout=timeout, max_retries=0).models.list()
+        except openai.NotFoundError:
+            pass
+        except Exception as e:
+            return {'status': 'error', 'error': str(e)}
+        return {'status': 'ok'}
@@ -0,0 +1,276 @@
+"""
+模型分级模块
+文字题目先交给小模型解答，按 **最终答案** 部分评估置信度，置信度不足或题目复杂时再交给主模型，
+使占多数的简单题目以更低的延迟和成本完成
+"""
+
+import ast
+import operator
+import re
+import threading
+import time
+from typing import Optional, Dict, Any, AsyncIterator, Iterator, List, Tuple, Union
+
+from . import metrics
+from .ai_service import AIService
+from .prompts import arithmetic_expression, classify_problem
+from .provider_pool import ProviderPool
+
+
+_FINAL_ANSWER_RE = re.compile(r'\*\*最终答案\*\*\s*[:：]?\s*(.*?)(?=\n\s*\*\*[^*\n]+\*\*|\Z)', re.S)
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+# 最终答案给出了具体结果：数值、等式或不等式、选择题选项、判断题结论
+_CONCRETE_RE = re.compile(r'\d|[=<>≤≥≠]|(?<![A-Za-z])[A-Ha-h](?![A-Za-z])|正确|错误')
+
+# 最终答案中出现即说明模型没有把握的措辞（不含“可能”：概率题的“可能性为1/3”是正常的答案）
+_HEDGES = ('无法', '不确定', '不能确定', '大概', '也许', '请提供', '不清楚', '不完整', '抱歉')
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos
+}
+
+
+def final_answer(solution: str) -> Optional[str]:
+    """提取解答中 **最终答案** 部分，没有该部分时返回None"""
+    match = _FINAL_ANSWER_RE.search(solution or '')
+    return match.group(1).strip() if match else None
+
+
+def _evaluate(node: ast.AST) -> float:
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > 64:
+            raise ValueError('指数过大')
+        return _OPERATORS[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.operand))
+    raise ValueError('不支持的表达式')
+
+
+def evaluate_arithmetic(problem: str) -> Optional[float]:
+    """计算纯算式题目的结果，不是纯算式或无法安全计算时返回None"""
+    expression = arithmetic_expression(problem)
+    if expression is None:
+        return None
+    expression = (expression.replace('×', '*').replace('÷', '/').replace('（', '(')
+                  .replace('）', ')').replace('^', '**'))
+    expression = next((part for part in expression.split('=') if part.strip()), '')
+    try:
+        return float(_evaluate(ast.parse(expression.strip(), mode='eval')))
+    except (SyntaxError, ValueError, ZeroDivisionError, OverflowError, TypeError):
+        return None
+
+
+def score_solution(problem: str, solution: Optional[str]) -> float:
+    """
+    评估小模型解答的置信度
+
+    只有存在正面证据时才给出可采用的置信度：纯算式题目直接计算结果与最终答案核对；
+    其余题目要求 **最终答案** 部分给出具体结果（数值、等式、选项或判断），
+    再按是否含有不确定措辞、长度是否异常等启发式规则扣分
+
+    Returns:
+        0~1 之间的置信度
+    """
+    answer = final_answer(solution or '')
+    if not answer:
+        return 0.0
+
+    expected = evaluate_arithmetic(problem)
+    if expected is not None:
+        numbers = [float(n) for n in _NUMBER_RE.findall(answer.replace(',', ''))]
+        if any(abs(n - expected) <= 1e-6 * max(1.0, abs(expected)) for n in numbers):
+            return 1.0
+        return 0.1
+
+    # 只有结论性文字（如“见上文”）而没有具体结果时，不足以采用小模型的答案
+    score = 1.0 if _CONCRETE_RE.search(answer) else 0.4
+    if any(hedge in answer for hedge in _HEDGES):
+        score -= 0.5
+    elif any(hedge in solution for hedge in _HEDGES):
+        score -= 0.2
+    if len(answer) > 300:
+        score -= 0.2
+    if len(solution or '') < 30:
+        score -= 0.3
+    return max(0.0, min(1.0, score))
+
+
+class CascadeService:
+    """
+    两级模型：小模型优先，置信度不足时转交主模型
+
+    对外提供与 AIService 相同的文字解题接口，model 为主模型名称；实际给出解答的模型由各级服务通过
+    note_answer 记录，小模型的答案按小模型缓存，不会被未开启分级的配置当作主模型的答案命中
+    """
+
+    def __init__(self, fast_service: Union[AIService, ProviderPool],
+                 strong_service: Union[AIService, ProviderPool],
+                 threshold: float = 0.6, max_problem_chars: int = 300):
+        """
+        Args:
+            fast_service: 小模型服务
+            strong_service: 主模型服务
+            threshold: 小模型答案的最低置信度，低于该值时转交主模型
+            max_problem_chars: 超过该长度的题目直接交给主模型
+        """
+        self.fast_service = fast_service
+        self.strong_service = strong_service
+        self.threshold = threshold
+        self.max_problem_chars = max_problem_chars
+
+        self._lock = threading.Lock()
+        self.decisions = {'accepted': 0, 'escalated': 0, 'direct': 0}
+
+    @property
+    def model(self) -> str:
+        return self.strong_service.model
+
+    @property
+    def models(self) -> List[str]:
+        """两级模型（主模型在前），查询缓存时两级的解答都可命中"""
+        return list(dict.fromkeys(self.strong_service.models + self.fast_service.models))
+
+    def tier_of(self, model: str) -> str:
+        """给出解答的模型所属级别：fast（小模型）或 strong（主模型）"""
+        if model in self.fast_service.models and model not in self.strong_service.models:
+            return 'fast'
+        return 'strong'
+
+    @property
+    def api_base(self) -> str:
+        return self.strong_service.api_base
+
+    def _use_fast(self, problem: str) -> bool:
+        """证明题和过长的题目直接交给主模型"""
+        return len(problem) <= self.max_problem_chars and classify_problem(problem) != 'proof'
+
+    def _record(self, decision: str, problem: str, confidence: Optional[float],
+                fast_ms: Optional[float], strong_ms: Optional[float]) -> None:
+        """记录分级决策与各级耗时，用于调整阈值"""
+        with self._lock:
+            self.decisions[decision] += 1
+        metrics.CASCADE_DECISIONS.inc(decision)
+        if confidence is not None:
+            metrics.CASCADE_CONFIDENCE.observe(confidence)
+        print(f"模型分级: 决策={decision} 题型={classify_problem(problem)} 长度={len(problem)} "
+              f"置信度={'-' if confidence is None else f'{confidence:.2f}'} "
+              f"小模型={'-' if fast_ms is None else f'{fast_ms:.0f}ms'} "
+              f"主模型={'-' if strong_ms is None else f'{strong_ms:.0f}ms'}")
+
+    def _try_fast(self, problem: str) -> Tuple[Optional[str], float, float]:
+        """调用小模型，返回 (解答, 置信度, 耗时ms)；调用失败视为置信度为0"""
+        start = time.perf_counter()
+        try:
+            solution = self.fast_service.solve_problem(problem)
+        except Exception as e:
+            print(f"小模型解题失败，转交主模型: {str(e)}")
+            solution = None
+        return solution, score_solution(problem, solution), (time.perf_counter() - start) * 1000
+
+    async def _atry_fast(self, problem: str) -> Tuple[Optional[str], float, float]:
+        """_try_fast 的异步版本"""
+        start = time.perf_counter()
+        try:
+            solution = await self.fast_service.asolve_problem(problem)
+        except Exception as e:
+            print(f"小模型解题失败，转交主模型: {str(e)}")
+            solution = None
+        return solution, score_solution(problem, solution), (time.perf_counter() - start) * 1000
+
+    def solve_problem(self, problem: str) -> Optional[str]:
+        """分级解题，接口与 AIService.solve_problem 相同"""
+        confidence = fast_ms = None
+        if self._use_fast(problem):
+            solution, confidence, fast_ms = self._try_fast(problem)
+            if confidence >= self.threshold:
+                self._record('accepted', problem, confidence, fast_ms, None)
+                return solution
+
+        start = time.perf_counter()
+        try:
+            return self.strong_service.solve_problem(problem)
+        finally:
+            self._record('escalated' if fast_ms is not None else 'direct', problem, confidence,
+                         fast_ms, (time.perf_counter() - start) * 1000)
+
+    async def asolve_problem(self, problem: str) -> Optional[str]:
+        """solve_problem 的异步版本"""
+        confidence = fast_ms = None
+        if self._use_fast(problem):
+            solution, confidence, fast_ms = await self._atry_fast(problem)
+            if confidence >= self.threshold:
+                self._record('accepted', problem, confidence, fast_ms, None)
+                return solution
+
+        start = time.perf_counter()
+        try:
+            return await self.strong_service.asolve_problem(problem)
+        finally:
+            self._record('escalated' if fast_ms is not None else 'direct', problem, confidence,
+                         fast_ms, (time.perf_counter() - start) * 1000)
+
+    def stream_solve_problem(self, problem: str) -> Iterator[str]:
+        """
+        流式分级解题
+
+        小模型的答案需要完整生成后才能评估，因此小模型一级不流式输出：
+        答案被采用时一次性返回，否则流式返回主模型的解答
+        """
+        confidence = fast_ms = None
+        if self._use_fast(problem):
+            solution, confidence, fast_ms = self._try_fast(problem)
+            if confidence >= self.threshold:
+                self._record('accepted', problem, confidence, fast_ms, None)
+                yield solution
+                return
+
+        start = time.perf_counter()
+        try:
+            yield from self.strong_service.stream_solve_problem(problem)
+        finally:
+            self._record('escalated' if fast_ms is not None else 'direct', problem, confidence,
+                         fast_ms, (time.perf_counter() - start) * 1000)
+
+    async def astream_solve_problem(self, problem: str) -> AsyncIterator[str]:
+        """stream_solve_problem 的异步版本"""
+        confidence = fast_ms = None
+        if self._use_fast(problem):
+            solution, confidence, fast_ms = await self._atry_fast(problem)
+            if confidence >= self.threshold:
+                self._record('accepted', problem, confidence, fast_ms, None)
+                yield solution
+                return
+
+        start = time.perf_counter()
+        try:
+            async for chunk in self.strong_service.astream_solve_problem(problem):
+                yield chunk
+        finally:
+            self._record('escalated' if fast_ms is not None else 'direct', problem, confidence,
+                         fast_ms, (time.perf_counter() - start) * 1000)
+
+    def status(self) -> Dict[str, Any]:
+        """获取分级配置与决策统计"""
+        with self._lock:
+            decisions = dict(self.decisions)
+        total = sum(decisions.values())
+        return {
+            'fast_model': self.fast_service.model,
+            'strong_model': self.strong_service.model,
+            'threshold': self.threshold,
+            'max_problem_chars': self.max_problem_chars,
+            'decisions': decisions,
+            'accept_rate': round(decisions['accepted'] / total, 4) if total else 0.0
+        }
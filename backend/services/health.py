@@ -0,0 +1,70 @@
+"""
+上游健康探测模块
+在后台线程中定期探测各AI服务的连通性并缓存结果，
+请求路径只读取缓存，不再同步等待上游；探测只请求不计费的 /models 接口，熔断中的服务不发起请求
+"""
+
+import threading
+import time
+from typing import Dict, Any, Optional
+
+from .ai_service import AIService
+
+
+class HealthProbe:
+    """后台定期刷新的上游健康探测"""
+
+    def __init__(self, services: Dict[str, AIService], interval: float = 300.0):
+        """
+        Args:
+            services: 名称到AI服务的映射
+            interval: 探测间隔（秒），<=0 表示不做后台探测
+        """
+        self.services = services
+        self.interval = interval
+        self._results: Dict[str, Dict[str, Any]] = {
+            name: {'status': 'unknown', 'model': service.model, 'checked_at': None}
+            for name, service in services.items()
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """启动后台探测线程"""
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='health-probe', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台探测线程"""
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.probe_all()
+            self._stop.wait(self.interval)
+
+    def probe_all(self) -> None:
+        """依次探测所有服务并更新缓存结果"""
+        for name, service in self.services.items():
+            start = time.perf_counter()
+            try:
+                probe = service.probe()
+            except Exception as e:
+                probe = {'status': 'error', 'error': str(e)}
+            result = {
+                **probe,
+                'model': service.model,
+                'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+                'checked_at': time.time(),
+            }
+            with self._lock:
+                self._results[name] = result
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """获取最近一次探测结果（不触发网络请求）"""
+        with self._lock:
+            return {name: dict(result) for name, result in self._results.items()}
@@ -0,0 +1,184 @@
+"""
+上游HTTP连接池模块
+进程内所有上游调用（各模型后端、模型目录、健康探测）共享同一组 httpx 客户端：
+连接按主机保持长连接复用，并发请求不再各自建立TCP连接与TLS握手；
+同步与异步客户端共用一个SSL上下文，证书只加载一次
+"""
+
+import threading
+from typing import Optional, Dict, Any
+
+import httpx
+
+
+class HTTPClientFactory:
+    """共享HTTP客户端工厂，客户端在首次使用时创建（多进程部署时在各工作进程中分别创建）"""
+
+    def __init__(self, max_connections: int = 200, max_keepalive: int = 100,
+                 keepalive_expiry: float = 60.0, connect_timeout: float = 10.0,
+                 http2: bool = False):
+        """
+        Args:
+            max_connections: 连接池最大连接数（所有上游主机合计），超出时请求排队等待空闲连接
+            max_keepalive: 保持的空闲长连接数上限
+            keepalive_expiry: 空闲长连接的保持时间（秒）
+            connect_timeout: 建立连接（含DNS解析与TLS握手）的超时（秒）
+            http2: 是否启用HTTP/2（需要安装 h2，未安装时使用HTTP/1.1）
+        """
+        self.max_connections = max_connections
+        self.max_keepalive = min(max_keepalive, max_connections)
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and self._h2_available()
+
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._ssl_context = None
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.connect_errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    @staticmethod
+    def _h2_available() -> bool:
+        try:
+            import h2  # noqa: F401  # type: ignore[reportMissingImports]
+            return True
+        except ImportError:
+            print("未安装 h2，HTTP/2 不可用，上游连接使用 HTTP/1.1（pip install 'httpx[http2]'）")
+            return False
+
+    def _options(self) -> Dict[str, Any]:
+        """同步与异步客户端共用的连接池配置"""
+        if self._ssl_context is None:
+            self._ssl_context = httpx.create_ssl_context()
+        return dict(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            timeout=httpx.Timeout(60.0, connect=self.connect_timeout),
+            verify=self._ssl_context,
+            http2=self.http2
+        )
+
+    def _on_trace(self, event: str) -> None:
+        """
+        按连接事件计数：新建连接越少，请求越多地复用了长连接
+
+        in_flight 为已开始发送、响应尚未关闭的请求数；httpcore 在发送请求头之后的任何失败路径上
+        都会触发 response_closed，两个事件总是成对出现
+        """
+        if event.endswith('.send_request_headers.started'):
+            with self._lock:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        elif event.endswith('.response_closed.complete') or event.endswith('.response_closed.failed'):
+            with self._lock:
+                self.in_flight = max(0, self.in_flight - 1)
+        elif event == 'connection.connect_tcp.complete':
+            with self._lock:
+                self.connections_opened += 1
+        elif event == 'connection.start_tls.complete':
+            with self._lock:
+                self.tls_handshakes += 1
+        elif event in ('connection.connect_tcp.failed', 'connection.start_tls.failed'):
+            with self._lock:
+                self.connect_errors += 1
+
+    def _trace(self, event: str, info: Dict[str, Any]) -> None:
+        self._on_trace(event)
+
+    async def _atrace(self, event: str, info: Dict[str, Any]) -> None:
+        self._on_trace(event)
+
+    def _on_request(self, request: httpx.Request) -> None:
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._trace
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        with self._lock:
+            self.requests += 1
+        request.extensions['trace'] = self._atrace
+
+    @property
+    def client(self) -> httpx.Client:
+        """获取共享的同步客户端"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = httpx.Client(event_hooks={'request': [self._on_request]}, **self._options())
+        return self._client
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """获取共享的异步客户端（ASGI服务模式使用）"""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = httpx.AsyncClient(event_hooks={'request': [self._aon_request]},
+                                                           **self._options())
+        return self._async_client
+
+    @staticmethod
+    def _pool_stats(client: Optional[Any]) -> Optional[Dict[str, Any]]:
+        """
+        读取客户端连接池中各连接的状态，仅用于诊断
+
+        连接池对象属于 httpx/httpcore 的内部实现（requirements.txt 固定了 httpcore 主版本），
+        客户端尚未创建或内部结构与预期不符时返回None，不影响其余统计
+        """
+        if client is None:
+            return None
+        try:
+            pool = getattr(getattr(client, '_transport', None), '_pool', None)
+            if pool is None:
+                return None
+            connections = list(pool.connections)
+            idle = sum(1 for connection in connections if connection.is_idle())
+            return {
+                'connections': len(connections),
+                'idle': idle,
+                'active': len(connections) - idle,
+                'http2': sum(1 for connection in connections if 'HTTP/2' in connection.info()),
+                # 连接数已达上限、正在排队等待空闲连接的请求数
+                'waiting': sum(1 for pending in list(getattr(pool, '_requests', [])) if pending.is_queued())
+            }
+        except (AttributeError, TypeError) as e:
+            print(f"读取连接池状态失败: {str(e)}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """获取连接池配置、当前连接状态与连接复用统计"""
+        with self._lock:
+            requests, opened = self.requests, self.connections_opened
+            tls_handshakes, connect_errors = self.tls_handshakes, self.connect_errors
+            in_flight, peak_in_flight = self.in_flight, self.peak_in_flight
+        return {
+            'max_connections': self.max_connections,
+            'max_keepalive': self.max_keepalive,
+            'keepalive_expiry': self.keepalive_expiry,
+            'http2': self.http2,
+            'requests': requests,
+            'connections_opened': opened,
+            'tls_handshakes': tls_handshakes,
+            'connect_errors': connect_errors,
+            'in_flight': in_flight,
+            'peak_in_flight': peak_in_flight,
+            'reuse_rate': round(1 - opened / requests, 4) if requests else 0.0,
+            'sync_pool': self._pool_stats(self._client),
+            'async_pool': self._pool_stats(self._async_client)
+        }
+
+    def close(self) -> None:
+        """关闭同步客户端（异步客户端随事件循环结束释放）"""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
@@ -0,0 +1,254 @@
+"""
+图片感知哈希缓存模块
+对上传图片计算dHash，按汉明距离查找同一页题目的重复拍照，命中时无需调用视觉模型
+"""
+
+import io
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple, Union, BinaryIO
+
+from PIL import Image, ImageOps  # type: ignore[reportMissingImports]
+
+
+HASH_BITS = 64
+# 复核用的大尺寸哈希边长（256位）
+VERIFY_HASH_SIZE = 16
+
+
+class ImageHash(NamedTuple):
+    """图片感知哈希：coarse 为64位dHash，用于索引查询；fine 为256位dHash，用于命中前复核"""
+    coarse: int
+    fine: int
+
+
+def _open_gray(image: Union[bytes, BinaryIO, 'Image.Image'], size: int) -> 'Image.Image':
+    """
+    解码图片并按EXIF方向摆正后转为灰度图
+
+    手机照片通常以传感器方向保存并在EXIF中记录旋转角度，不摆正时同一页题目的横竖两张照片哈希完全不同
+    """
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+        image.draft('L', (size * 8, size * 8))
+    return ImageOps.exif_transpose(image).convert('L')
+
+
+def _difference_hash(gray: 'Image.Image', hash_size: int) -> int:
+    # 灰度图每个像素一个字节；getdata() 在新版 Pillow 中已弃用
+    pixels = gray.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS).tobytes()
+
+    value = 0
+    width = hash_size + 1
+    for row in range(hash_size):
+        offset = row * width
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash(image: Union[bytes, BinaryIO, 'Image.Image'], hash_size: int = 8) -> int:
+    """
+    计算图片的差值哈希（dHash）
+
+    按EXIF方向摆正并缩放为 (hash_size+1) x hash_size 灰度图后比较相邻像素亮度，
+    对缩放、重新压缩和轻微光照变化不敏感。
+
+    Args:
+        image: 图片字节、文件对象或PIL图片
+        hash_size: 哈希边长，默认8（64位哈希）
+
+    Returns:
+        哈希值（整数）
+
+    Raises:
+        OSError: 图片无法解码时抛出
+    """
+    return _difference_hash(_open_gray(image, hash_size), hash_size)
+
+
+def image_hash(image: Union[bytes, BinaryIO, 'Image.Image']) -> ImageHash:
+    """只解码一次，同时计算64位与256位dHash"""
+    gray = _open_gray(image, VERIFY_HASH_SIZE)
+    return ImageHash(_difference_hash(gray, 8), _difference_hash(gray, VERIFY_HASH_SIZE))
+
+
+class ImageHashCache:
+    """
+    基于感知哈希的图片解答缓存
+
+    使用多索引哈希表（multi-index hashing）做汉明距离查询：
+    将64位哈希切分为 max_distance+1 段，由抽屉原理，
+    距离不超过 max_distance 的两个哈希至少有一段完全相同。
+    64位哈希对版式相近的不同题目页区分度有限，候选命中前再用256位哈希复核，
+    两级距离都在阈值内才视为同一图片。
+    """
+
+    def __init__(self, max_entries: int = 5000, ttl: int = 604800, max_distance: int = 4,
+                 max_verify_distance: int = 16):
+        """
+        Args:
+            max_entries: 最大缓存条目数，超出后淘汰最久未使用的条目
+            ttl: 条目有效期（秒），<=0 表示永不过期
+            max_distance: 视为同一图片的最大汉明距离（64位哈希）
+            max_verify_distance: 复核时允许的最大汉明距离（256位哈希）
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_verify_distance = max_verify_distance
+
+        segments = max_distance + 1
+        base, extra = divmod(HASH_BITS, segments)
+        self._segments: List[Tuple[int, int]] = []
+        shift = 0
+        for i in range(segments):
+            bits = base + (1 if i < extra else 0)
+            self._segments.append((shift, (1 << bits) - 1))
+            shift += bits
+
+        self._entries: 'OrderedDict[int, Tuple[ImageHash, str, str, float, Optional[str], Optional[str]]]' = OrderedDict()
+        self._tables: List[Dict[int, set]] = [{} for _ in self._segments]
+        # 同一图片哈希与作用域只保留一个条目，合并的并发请求重复写入时替换旧条目
+        self._keys: Dict[Tuple[ImageHash, str], int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0
+        self.evictions = 0
+        self.lookup_time = 0.0
+        self.hash_count = 0
+        self.hash_time = 0.0
+
+    def compute_hash(self, image: Union[bytes, BinaryIO]) -> Optional[ImageHash]:
+        """
+        计算图片感知哈希并记录耗时
+
+        Returns:
+            哈希值，图片无法解码时返回None
+        """
+        start = time.perf_counter()
+        try:
+            return image_hash(image)
+        except (OSError, ValueError) as e:
+            print(f"图片哈希计算失败: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self.hash_count += 1
+                self.hash_time += time.perf_counter() - start
+
+    def _chunks(self, value: int) -> List[int]:
+        return [(value >> shift) & mask for shift, mask in self._segments]
+
+    def lookup(self, image_hash: ImageHash, scope: str) -> Optional[Dict[str, Any]]:
+        """
+        查找汉明距离在阈值内的已解图片
+
+        Args:
+            image_hash: 图片感知哈希（compute_hash 的返回值）
+            scope: 作用域（模型 + 提示词版本），只在同一作用域内匹配
+
+        Returns:
+            命中时返回 {'solution', 'problem', 'model', 'distance'}，否则返回None
+            （problem 为识别出的题目文本，model 为给出解答的模型，均可能为None；distance 为64位哈希的距离）
+        """
+        start = time.perf_counter()
+        now = time.time()
+        best: Optional[Dict[str, Any]] = None
+
+        with self._lock:
+            candidates = set()
+            for table, chunk in zip(self._tables, self._chunks(image_hash.coarse)):
+                candidates.update(table.get(chunk, ()))
+
+            best_id = None
+            best_distance = (self.max_distance + 1, 0)
+            expired = []
+            rejected = False
+            for entry_id in candidates:
+                value, entry_scope, solution, expires_at, problem, model = self._entries[entry_id]
+                if expires_at and expires_at < now:
+                    expired.append(entry_id)
+                    continue
+                if entry_scope != scope:
+                    continue
+                distance = (value.coarse ^ image_hash.coarse).bit_count()
+                if distance > self.max_distance:
+                    continue
+                fine_distance = (value.fine ^ image_hash.fine).bit_count()
+                if fine_distance > self.max_verify_distance:
+                    rejected = True
+                    continue
+                if (distance, fine_distance) < best_distance:
+                    best_id, best_distance = entry_id, (distance, fine_distance)
+                    best = {'solution': solution, 'problem': problem, 'model': model, 'distance': distance}
+
+            for entry_id in expired:
+                self._remove(entry_id)
+            if best_id is not None:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+            elif rejected:
+                self.rejected += 1
+
+            self.lookups += 1
+            self.lookup_time += time.perf_counter() - start
+
+        return best
+
+    def add(self, image_hash: ImageHash, solution: str, scope: str, problem: Optional[str] = None,
+            model: Optional[str] = None) -> None:
+        """写入图片解答，problem 为识别出的题目文本，model 为给出解答的模型"""
+        if not solution:
+            return
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0.0
+
+        with self._lock:
+            existing = self._keys.get((image_hash, scope))
+            if existing is not None:
+                self._remove(existing)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (image_hash, scope, solution, expires_at, problem, model)
+            self._keys[(image_hash, scope)] = entry_id
+            for table, chunk in zip(self._tables, self._chunks(image_hash.coarse)):
+                table.setdefault(chunk, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, entry_id: int) -> None:
+        value, scope = self._entries.pop(entry_id)[:2]
+        if self._keys.get((value, scope)) == entry_id:
+            del self._keys[(value, scope)]
+        for table, chunk in zip(self._tables, self._chunks(value.coarse)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[chunk]
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（rejected 为64位哈希命中但256位哈希复核未通过的查询数）"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'max_verify_distance': self.max_verify_distance,
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'rejected': self.rejected,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                'avg_lookup_ms': round(self.lookup_time / self.lookups * 1000, 3) if self.lookups else 0.0,
+                'avg_hash_ms': round(self.hash_time / self.hash_count * 1000, 3) if self.hash_count else 0.0
+            }
@@ -0,0 +1,286 @@
+"""
+图片预处理模块
+在调用视觉模型前对上传图片做方向校正、灰度与对比度归一化、文字区域裁剪、
+按模型最优分块尺寸缩放和重新编码，减少请求体积与视觉token消耗
+
+单独运行可对本地图片做基准测试：
+    cd backend
+    python -m services.image_preprocess photo1.jpg photo2.png [--solve]
+"""
+
+import io
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple, Union, BinaryIO
+
+from PIL import Image, ImageOps  # type: ignore[reportMissingImports]
+
+
+STAGES = ('decode', 'orient', 'grayscale', 'contrast', 'crop', 'resize', 'encode')
+
+_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp'
+}
+
+
+def _median(histogram: List[int]) -> int:
+    """由灰度直方图计算亮度中位数"""
+    half = sum(histogram) / 2
+    total = 0
+    for value, count in enumerate(histogram):
+        total += count
+        if total >= half:
+            return value
+    return 255
+
+
+class ImagePreprocessor:
+    """视觉模型调用前的图片预处理流水线"""
+
+    def __init__(self, max_side: int = 2048, short_side: int = 768,
+                 grayscale: bool = True, autocrop: bool = True,
+                 output_format: str = 'JPEG', quality: int = 85):
+        """
+        Args:
+            max_side: 长边上限（像素）
+            short_side: 短边目标（像素），OpenAI高清模式会把短边缩放到768后按512分块计费
+            grayscale: 是否转为灰度图
+            autocrop: 是否裁剪到文字区域
+            output_format: 输出格式（JPEG / WEBP）
+            quality: 输出质量（1-95）
+        """
+        self.max_side = max_side
+        self.short_side = short_side
+        self.grayscale = grayscale
+        self.autocrop = autocrop
+        self.output_format = output_format.upper()
+        self.quality = quality
+
+        if self.output_format not in ('JPEG', 'WEBP'):
+            raise ValueError(f"不支持的输出格式: {output_format}")
+
+        self._lock = threading.Lock()
+        self.count = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_time = {stage: 0.0 for stage in STAGES}
+
+    def _target_size(self, width: int, height: int) -> Tuple[int, int]:
+        """按长边上限和短边目标计算缩放后尺寸（只缩小不放大）"""
+        scale = min(1.0, self.max_side / max(width, height), self.short_side / min(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+    def _text_bbox(self, image: 'Image.Image') -> Optional[Tuple[int, int, int, int]]:
+        """
+        估计文字区域
+
+        在缩略图上找出明显暗于背景（亮度中位数）的像素的外接矩形，并留出边距；
+        文字区域接近整张图片时返回None（不裁剪）
+        """
+        preview = image.convert('L')
+        preview.thumbnail((512, 512))
+        threshold = max(0, _median(preview.histogram()) - 24)
+        ink = preview.point(lambda v: 255 if v < threshold else 0)
+        bbox = ink.getbbox()
+        if bbox is None:
+            return None
+
+        scale_x = image.width / preview.width
+        scale_y = image.height / preview.height
+        margin_x = image.width * 0.02
+        margin_y = image.height * 0.02
+        left = max(0, int(bbox[0] * scale_x - margin_x))
+        top = max(0, int(bbox[1] * scale_y - margin_y))
+        right = min(image.width, int(bbox[2] * scale_x + margin_x))
+        bottom = min(image.height, int(bbox[3] * scale_y + margin_y))
+
+        if (right - left) * (bottom - top) > image.width * image.height * 0.9:
+            return None
+        return left, top, right, bottom
+
+    def process(self, image_data: Union[bytes, BinaryIO]) -> Dict[str, Any]:
+        """
+        预处理图片
+
+        Args:
+            image_data: 原始图片字节或可定位的文件对象
+
+        Returns:
+            {'data': 处理后字节, 'mime_type': MIME类型, 'stats': 各阶段耗时与体积}；
+            图片无法解码或处理后体积反而更大时 data 为None，表示应使用原图
+        """
+        source = io.BytesIO(image_data) if isinstance(image_data, bytes) else image_data
+        size_in = source.seek(0, io.SEEK_END)
+        source.seek(0)
+
+        timings: Dict[str, float] = {}
+        last = time.perf_counter()
+
+        def mark(stage: str) -> None:
+            nonlocal last
+            now = time.perf_counter()
+            timings[stage] = (now - last) * 1000
+            last = now
+
+        try:
+            image = Image.open(source)
+            source_format = image.format or 'JPEG'
+            original_size = image.size
+            # JPEG可在解码时按2的幂缩小，避免完整解码大尺寸照片；
+            # 需要裁剪时多保留一倍分辨率，保证裁剪后的文字区域足够清晰
+            draft_width, draft_height = self._target_size(*image.size)
+            if self.autocrop:
+                draft_width, draft_height = draft_width * 2, draft_height * 2
+            image.draft('RGB', (draft_width, draft_height))
+            image.load()
+            mark('decode')
+
+            image = ImageOps.exif_transpose(image)
+            mark('orient')
+
+            image = image.convert('L' if self.grayscale else 'RGB')
+            mark('grayscale')
+
+            image = ImageOps.autocontrast(image, cutoff=1)
+            mark('contrast')
+
+            if self.autocrop:
+                bbox = self._text_bbox(image)
+                if bbox is not None:
+                    image = image.crop(bbox)
+            mark('crop')
+
+            target = self._target_size(*image.size)
+            if target != image.size:
+                image = image.resize(target, Image.Resampling.LANCZOS)
+            mark('resize')
+
+            output = io.BytesIO()
+            image.save(output, format=self.output_format, quality=self.quality, optimize=True)
+            data = output.getvalue()
+            mime_type = _MIME_TYPES[self.output_format]
+            mark('encode')
+        except (OSError, ValueError) as e:
+            print(f"图片预处理失败，使用原图: {str(e)}")
+            with self._lock:
+                self.failures += 1
+            return {'data': None, 'mime_type': None, 'stats': None}
+
+        size_out = len(data)
+        if size_out >= size_in and source_format in _MIME_TYPES:
+            data = None
+            mime_type = _MIME_TYPES[source_format]
+            size_out = size_in
+
+        stats = {
+            'bytes_in': size_in,
+            'bytes_out': size_out,
+            'bytes_saved': size_in - size_out,
+            'size_in': list(original_size),
+            'size_out': list(image.size),
+            'stage_ms': {stage: round(ms, 2) for stage, ms in timings.items()},
+            'total_ms': round(sum(timings.values()), 2)
+        }
+
+        with self._lock:
+            self.count += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+            for stage, ms in timings.items():
+                self.stage_time[stage] += ms
+
+        return {'data': data, 'mime_type': mime_type, 'stats': stats}
+
+    def stats(self) -> Dict[str, Any]:
+        """获取累计统计"""
+        count = self.count
+        return {
+            'processed': count,
+            'failures': self.failures,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'avg_stage_ms': {
+                stage: round(total / count, 2) if count else 0.0
+                for stage, total in self.stage_time.items()
+            }
+        }
+
+
+def create_image_preprocessor(config: Dict[str, Any]) -> Optional[ImagePreprocessor]:
+    """
+    根据配置创建图片预处理器
+
+    Args:
+        config: 配置映射（如 app.config）
+
+    Returns:
+        预处理器实例，未启用时返回None
+    """
+    if not config['IMAGE_PREPROCESS_ENABLED']:
+        return None
+    return ImagePreprocessor(
+        max_side=config['IMAGE_MAX_SIDE'],
+        short_side=config['IMAGE_SHORT_SIDE'],
+        grayscale=config['IMAGE_GRAYSCALE'],
+        autocrop=config['IMAGE_AUTOCROP'],
+        output_format=config['IMAGE_OUTPUT_FORMAT'],
+        quality=config['IMAGE_OUTPUT_QUALITY']
+    )
+
+
+def _benchmark(paths: List[str], solve: bool) -> None:
+    """对本地图片运行预处理，可选对比预处理前后的端到端解题耗时"""
+    import base64
+    import sys
+    import os
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from config import Config  # type: ignore[reportImplicitRelativeImport]
+
+    config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+    preprocessor = create_image_preprocessor(config)
+    if preprocessor is None:
+        preprocessor = ImagePreprocessor()
+
+    service = None
+    if solve:
+        from .ai_service import AIService
+        service = AIService(
+            api_key=Config.AI_VISION_API_KEY,
+            api_base=Config.AI_VISION_API_BASE,
+            model=Config.AI_VISION_MODEL
+        )
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        result = preprocessor.process(raw)
+        stats = result['stats'] or {}
+        print(f"\n{path}")
+        processed = result['data'] if result['data'] is not None else raw
+        print(f"  体积: {len(raw)} -> {len(processed)} 字节")
+        print(f"  尺寸: {stats.get('size_in')} -> {stats.get('size_out')}")
+        print(f"  各阶段耗时(ms): {stats.get('stage_ms')}")
+
+        if service is not None:
+            for label, data, mime_type in (('原图', raw, 'image/jpeg'),
+                                           ('预处理', processed, result['mime_type'] or 'image/jpeg')):
+                start = time.perf_counter()
+                service.solve_problem_with_image(base64.b64encode(data).decode('utf-8'), mime_type)
+                print(f"  端到端解题耗时（{label}）: {time.perf_counter() - start:.2f}s")
+
+    print(f"\n累计: {preprocessor.stats()}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='图片预处理基准测试')
+    parser.add_argument('images', nargs='+', help='图片路径')
+    parser.add_argument('--solve', action='store_true', help='同时对比预处理前后的端到端解题耗时（消耗API额度）')
+    args = parser.parse_args()
+    _benchmark(args.images, args.solve)
@@ -0,0 +1,230 @@
+"""
+指标模块
+进程内的Prometheus风格指标（计数器、直方图）与按阶段的耗时统计，由 /api/metrics 以文本格式导出
+
+请求路径上只做加锁累加；缓存命中、限流排队等已有统计的数据在抓取时通过采集函数读取，不增加热路径开销
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Callable, Iterator, List, Sequence, Tuple
+
+
+# 延迟直方图分桶（秒），覆盖本地阶段的毫秒级耗时到上游的数十秒
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 采集函数返回的样本：(指标名, 类型, 说明, [(标签, 值)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """分桶直方图"""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数..., 超出最大分桶的计数], 总和, 总数
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0, 0])
+                self._values[label_values] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+            entry[1][1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = [(labels, (list(counts), list(totals))) for labels, (counts, totals) in self._values.items()]
+        for label_values, (counts, (total, count)) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ('le',), label_values + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {_format_value(count)}')
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+        self._collectors: List[Callable[[], List[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[Sample]]) -> None:
+        """注册抓取时调用的采集函数"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """导出Prometheus文本格式"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print(f"指标采集失败: {str(e)}")
+                continue
+            for name, metric_type, documentation, values in samples:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in values:
+                    lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP请求数', ('route', 'method', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP请求处理耗时（流式接口为返回响应头前的耗时）', ('route',))
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'upstream_requests_total', '上游模型调用次数（含重试后的最终结果）', ('model', 'route', 'outcome'))
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'upstream_request_duration_seconds', '上游模型调用耗时（流式调用为读完整个流的耗时）', ('model', 'route', 'stream'))
+UPSTREAM_FIRST_TOKEN = REGISTRY.histogram(
+    'upstream_first_token_seconds', '流式调用首个片段到达耗时', ('model', 'route'))
+UPSTREAM_TOKENS = REGISTRY.counter(
+    'upstream_tokens_total', '上游报告的token用量（response.usage）', ('model', 'type'))
+UPSTREAM_TRUNCATED = REGISTRY.counter(
+    'upstream_truncated_total', '解答因达到 max_tokens 被截断的次数', ('model', 'route'))
+IMAGE_BYTES = REGISTRY.counter(
+    'image_bytes_total', '发送给视觉模型的图片字节数（in为上传原图，out为预处理后实际发送）', ('direction',))
+STAGE_LATENCY = REGISTRY.histogram(
+    'stage_duration_seconds', '请求各阶段耗时（parse/preprocess/encode/upstream/serialize）', ('route', 'stage'))
+CASCADE_DECISIONS = REGISTRY.counter(
+    'cascade_decisions_total', '模型分级决策（accepted 采用小模型答案 / escalated 转交主模型 / direct 直接使用主模型）',
+    ('decision',))
+CASCADE_CONFIDENCE = REGISTRY.histogram(
+    'cascade_confidence', '小模型答案的置信度评分', (), (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+
+_route: contextvars.ContextVar[str] = contextvars.ContextVar('metrics_route', default='other')
+
+
+def set_route(route: str) -> None:
+    """设置当前请求的路由标签，后续阶段耗时记在该路由下"""
+    _route.set(route)
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """记录一个阶段的耗时"""
+    STAGE_LATENCY.observe(seconds, _route.get(), name)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """统计代码块耗时，记为当前请求的一个阶段"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """装饰器：将函数耗时记为当前请求的一个阶段，支持普通函数与协程函数"""
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_request(route: str, method: str, status: int, seconds: float) -> None:
+    """记录一次HTTP请求"""
+    HTTP_REQUESTS.inc(route, method, str(status))
+    HTTP_LATENCY.observe(seconds, route)
+
+
+def render() -> str:
+    """导出全部指标"""
+    return REGISTRY.render()
@@ -0,0 +1,135 @@
+"""
+模型目录模块
+进程内共享的上游模型列表缓存：TTL过期后先返回旧数据并在后台刷新（stale-while-revalidate），
+并发刷新合并为一次上游请求
+"""
+
+import threading
+import time
+from typing import Optional, Dict, Any, List
+
+import httpx
+
+
+class ModelCatalog:
+    """上游模型列表缓存服务"""
+
+    def __init__(self, api_key: str, api_base: str, ttl: float = 600.0,
+                 stale_ttl: float = 86400.0, error_backoff: float = 30.0,
+                 timeout: float = 10.0, http_client: Optional[httpx.Client] = None):
+        """
+        Args:
+            api_key: API密钥
+            api_base: API基础地址
+            ttl: 缓存新鲜期（秒），期内直接返回缓存
+            stale_ttl: 缓存最长可用期（秒），超过新鲜期但未超过此值时返回旧数据并后台刷新
+            error_backoff: 拉取失败后的重试间隔（秒），避免上游故障时每个请求都去重试
+            timeout: 上游请求超时（秒）
+            http_client: 复用连接的HTTP客户端（通常为共享连接池），为空时自动创建
+        """
+        self.api_key = api_key
+        self.api_base = (api_base or 'https://api.openai.com/v1').rstrip('/')
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.error_backoff = error_backoff
+        self.timeout = timeout
+        self.http_client = http_client or httpx.Client()
+
+        self._models: List[str] = []
+        self._fetched_at = 0.0
+        self._retry_at = 0.0
+        self._last_error: Optional[str] = None
+        self._inflight: Optional[threading.Event] = None
+        self._lock = threading.Lock()
+
+        self.upstream_calls = 0
+
+    def get_models(self) -> List[str]:
+        """
+        获取模型列表
+
+        Returns:
+            模型ID列表，从未成功拉取过时返回空列表
+        """
+        now = time.time()
+        with self._lock:
+            models = self._models
+            age = now - self._fetched_at if self._fetched_at else None
+            backing_off = now < self._retry_at
+
+        if age is not None and age < self.ttl:
+            return models
+
+        if age is not None and age < self.stale_ttl:
+            # 旧数据仍可用：立即返回，后台刷新
+            if not backing_off:
+                self._refresh(wait=False)
+            return models
+
+        if not backing_off:
+            self._refresh(wait=True)
+        with self._lock:
+            return self._models
+
+    def _refresh(self, wait: bool) -> None:
+        """触发刷新，已有刷新在进行时复用其结果"""
+        with self._lock:
+            leader = self._inflight is None
+            if leader:
+                self._inflight = threading.Event()
+            event = self._inflight
+
+        if leader:
+            if wait:
+                self._fetch(event)
+            else:
+                threading.Thread(target=self._fetch, args=(event,), name='model-catalog-refresh',
+                                 daemon=True).start()
+        elif wait:
+            event.wait(self.timeout)
+
+    def _fetch(self, event: threading.Event) -> None:
+        """从上游拉取模型列表"""
+        try:
+            self.upstream_calls += 1
+            response = self.http_client.get(
+                f"{self.api_base}/models",
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"状态码: {response.status_code}")
+
+            payload = response.json()
+            items = payload.get('data', []) if isinstance(payload, dict) else payload
+            models = [
+                item['id'] if isinstance(item, dict) else str(item)
+                for item in items
+                if not isinstance(item, dict) or 'id' in item
+            ]
+
+            with self._lock:
+                self._models = models
+                self._fetched_at = time.time()
+                self._last_error = None
+        except Exception as e:
+            print(f"获取模型列表失败: {str(e)}")
+            with self._lock:
+                self._retry_at = time.time() + self.error_backoff
+                self._last_error = str(e)
+        finally:
+            with self._lock:
+                self._inflight = None
+            event.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存状态"""
+        with self._lock:
+            return {
+                'size': len(self._models),
+                'fetched_at': self._fetched_at or None,
+                'age': round(time.time() - self._fetched_at, 1) if self._fetched_at else None,
+                'ttl': self.ttl,
+                'upstream_calls': self.upstream_calls,
+                'last_error': self._last_error
+            }
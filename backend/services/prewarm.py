@@ -0,0 +1,347 @@
+"""
+缓存预热模块
+离线读取题目语料（JSONL），以有界并发、按上游配额限流的方式逐题解答，结果写入与服务相同的
+解答缓存、相似题目索引和解题记录，使高峰期的首个请求也能直接命中缓存
+
+    cd backend
+    python -m services.prewarm 语料.jsonl --concurrency 8 --rpm 300
+    python -m services.prewarm requests.jsonl --field title,body
+
+语料每行一个JSON对象（按 --field 读取题目字段，多个字段以换行拼接）或一个JSON字符串。
+已完成的题目记录在进度文件（默认为 语料路径 + .progress）中，中断后重新运行会跳过这些题目；
+失败的题目不记录，下次运行时重试
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional, Dict, Any, Iterator, List, Set, Tuple
+
+from .ai_service import AIServiceCircuitOpenError, AIServiceRateLimitError
+from .rate_limiter import PRIORITY_BACKGROUND, request_priority
+from .solution_cache import make_cache_key
+from .solver import ProblemSolver
+
+
+def read_corpus(path: str, fields: List[str]) -> Iterator[Tuple[int, str]]:
+    """
+    逐行读取题目语料
+
+    Args:
+        path: JSONL文件路径
+        fields: 题目所在的字段，多个字段的内容以换行拼接
+
+    Yields:
+        (行号, 题目文本)，空行、格式错误或没有题目内容的行会被跳过并提示
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"第 {line_no} 行不是合法的JSON，已跳过: {str(e)}")
+                continue
+            if isinstance(item, str):
+                problem = item
+            elif isinstance(item, dict):
+                problem = '\n'.join(str(item[field]) for field in fields if item.get(field))
+            else:
+                problem = ''
+            if problem.strip():
+                yield line_no, problem.strip()
+            else:
+                print(f"第 {line_no} 行没有题目内容（字段: {','.join(fields)}），已跳过")
+
+
+class PrewarmProgress:
+    """进度文件：每行一个已完成题目的缓存键，追加写入，中断后据此续跑"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def mark(self, key: str) -> None:
+        with self._lock:
+            self.done.add(key)
+            self._file.write(key + '\n')
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Prewarmer:
+    """按语料预热解答缓存"""
+
+    def __init__(self, solver: ProblemSolver, concurrency: int = 8, max_attempts: int = 3,
+                 retry_delay: float = 5.0, progress_interval: float = 5.0):
+        """
+        Args:
+            solver: 解题调度器（与服务使用相同的缓存、模型和提示词版本）
+            concurrency: 同时解题的数量
+            max_attempts: 上游过载或熔断时每道题的最多尝试次数
+            retry_delay: 重试前的等待时间（秒）
+            progress_interval: 输出进度的间隔（秒）
+        """
+        self.solver = solver
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.progress_interval = progress_interval
+        self.counts = {'solved': 0, 'cached': 0, 'failed': 0, 'skipped': 0}
+        self._lock = threading.Lock()
+
+    def _solve(self, problem: str) -> Optional[Dict[str, Any]]:
+        """以后台优先级解一道题，上游过载或熔断时稍后重试"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with request_priority(PRIORITY_BACKGROUND):
+                    return self.solver.solve_text(problem, source='prewarm')
+            except (AIServiceRateLimitError, AIServiceCircuitOpenError):
+                if attempt >= self.max_attempts:
+                    raise
+                time.sleep(self.retry_delay)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _report(self, total: int, started: float, final: bool = False) -> None:
+        with self._lock:
+            counts = dict(self.counts)
+        finished = sum(counts.values())
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        # 速率只按本次实际处理的题目计算，续跑时跳过的题目不计入
+        processed = finished - counts['skipped']
+        rate = processed / elapsed
+        remaining = total - finished
+        eta = f"{remaining / rate / 60:.1f}分钟" if rate > 0 and remaining else '-'
+        print(f"{'完成' if final else '进度'} {finished}/{total} ({finished / total * 100 if total else 100:.1f}%) "
+              f"新解 {counts['solved']} 已缓存 {counts['cached']} 失败 {counts['failed']} "
+              f"跳过 {counts['skipped']} 速率 {rate:.2f}题/秒 耗时 {elapsed:.0f}秒 预计剩余 {eta}")
+
+    def run(self, problems: List[Tuple[int, str]], progress: PrewarmProgress) -> Dict[str, int]:
+        """
+        预热一批题目：已完成的题目直接跳过，其余在有界线程池中解答，同时在途的题目不超过并发数
+
+        Args:
+            problems: (行号, 题目文本) 列表
+            progress: 进度文件
+
+        Returns:
+            各结果的题目数（solved 新解 / cached 已在缓存中 / failed 失败 / skipped 上次已完成）
+        """
+        model, version = self.solver.text_service.model, self.solver.prompt_version
+        pending: List[Tuple[int, str, str]] = []
+        seen: Set[str] = set()
+        for line_no, problem in problems:
+            key = make_cache_key(problem, model, version)
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in progress.done:
+                self._count('skipped')
+            else:
+                pending.append((line_no, problem, key))
+        total = len(seen)
+        print(f"共 {total} 道不重复的题目，{self.counts['skipped']} 道上次已完成，"
+              f"模型 {model}，提示词版本 {version}，并发 {self.concurrency}")
+
+        started = last_report = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='prewarm')
+        in_flight: Dict[Any, Tuple[int, str]] = {}
+        items = iter(pending)
+        try:
+            while True:
+                # 只提交并发数两倍的题目，其余留在语料中，避免大语料一次性堆积在线程池队列
+                while len(in_flight) < self.concurrency * 2:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    line_no, problem, key = item
+                    in_flight[executor.submit(self._solve, problem)] = (line_no, key)
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, timeout=self.progress_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    line_no, key = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"第 {line_no} 行解题失败: {str(e)}")
+                        result = None
+                    if not result:
+                        self._count('failed')
+                        continue
+                    progress.mark(key)
+                    self._count('cached' if result['cached'] else 'solved')
+
+                if time.perf_counter() - last_report >= self.progress_interval:
+                    self._report(total, started)
+                    last_report = time.perf_counter()
+        except KeyboardInterrupt:
+            print("已中断，等待进行中的题目完成；已完成的题目下次运行时会跳过")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self._report(total, started, final=True)
+        return dict(self.counts)
+
+
+def _build_solver(config, concurrency: int, rpm: Optional[int], tpm: Optional[int]):
+    """
+    按服务配置组装解题调度器：模型、提示词版本、多后端路由与模型分级与服务一致，
+    缓存键与服务相同；限流器的排队时间放宽，预热任务在配额内等待而不是被丢弃
+
+    Returns:
+        (解题调度器, 解题记录)
+    """
+    from .ai_service import AIService, CircuitBreaker, RetryPolicy
+    from .cascade import CascadeService
+    from .http_client import HTTPClientFactory
+    from .problem_store import ProblemStore
+    from .prompts import get_prompt_set
+    from .provider_pool import create_provider_pool
+    from .rate_limiter import UpstreamLimiter
+    from .similarity_index import SimilarityIndex
+    from .solution_cache import create_solution_cache
+
+    http_clients = HTTPClientFactory(
+        max_connections=max(concurrency * 2, 10),
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout=config.HTTP_CONNECT_TIMEOUT,
+        http2=config.HTTP2_ENABLED
+    )
+
+    def service(api_key: str, api_base: str, model: str) -> AIService:
+        return AIService(
+            api_key=api_key,
+            api_base=api_base,
+            model=model,
+            timeout=config.UPSTREAM_TIMEOUT,
+            retry_policy=RetryPolicy(
+                max_retries=config.UPSTREAM_MAX_RETRIES,
+                backoff_base=config.UPSTREAM_BACKOFF_BASE,
+                backoff_max=config.UPSTREAM_BACKOFF_MAX,
+                budget_ratio=config.UPSTREAM_RETRY_BUDGET
+            ),
+            circuit_breaker=CircuitBreaker(
+                failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=config.CIRCUIT_RESET_TIMEOUT
+            ),
+            limiter=UpstreamLimiter(
+                rpm=config.UPSTREAM_RPM if rpm is None else rpm,
+                tpm=config.UPSTREAM_TPM if tpm is None else tpm,
+                max_concurrency=concurrency,
+                max_queue=concurrency * 2,
+                max_wait=3600.0
+            ),
+            prompts=get_prompt_set(config.PROMPT_VERSION),
+            max_output_tokens=config.MAX_OUTPUT_TOKENS,
+            token_budget=config.TOKEN_BUDGET_ENABLED,
+            prompt_cache=config.PROMPT_CACHE_HINTS,
+            http_clients=http_clients
+        )
+
+    text_service = create_provider_pool(
+        service(config.AI_API_KEY, config.AI_API_BASE, config.AI_MODEL),
+        config.AI_TEXT_PROVIDERS,
+        strategy=config.ROUTING_STRATEGY,
+        cooldown=config.PROVIDER_COOLDOWN
+    )
+    if config.CASCADE_ENABLED:
+        text_service = CascadeService(
+            service(config.CASCADE_API_KEY, config.CASCADE_API_BASE, config.CASCADE_MODEL),
+            text_service,
+            threshold=config.CASCADE_THRESHOLD,
+            max_problem_chars=config.CASCADE_MAX_PROBLEM_CHARS
+        )
+
+    cache = create_solution_cache(
+        backend=config.CACHE_BACKEND,
+        max_entries=config.CACHE_MAX_ENTRIES,
+        ttl=config.CACHE_TTL,
+        sqlite_path=config.CACHE_SQLITE_PATH
+    )
+    similarity_index = SimilarityIndex(
+        directory=config.SIMILARITY_INDEX_DIR,
+        threshold=config.SIMILARITY_THRESHOLD,
+        max_entries=config.SIMILARITY_MAX_ENTRIES,
+        ttl=config.SIMILARITY_TTL
+    ) if config.SIMILARITY_ENABLED else None
+    store = ProblemStore(config.PROBLEM_STORE_PATH) if config.PROBLEM_STORE_ENABLED else None
+
+    if cache is None or cache.backend != 'sqlite':
+        print(f"提示: 解答缓存后端为 {config.CACHE_BACKEND}，预热结果不会写入服务进程的解答缓存；"
+              "请设置 CACHE_BACKEND=sqlite（结果仍会写入相似题目索引与解题记录）")
+
+    # 预热只解答文字题目，视觉服务不会被调用
+    solver = ProblemSolver(
+        text_service=text_service,
+        vision_service=text_service,
+        cache=cache,
+        similarity_index=similarity_index,
+        prompt_version=config.PROMPT_VERSION,
+        store=store
+    )
+    return solver, store
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='按题目语料预热解答缓存')
+    parser.add_argument('corpus', help='题目语料（JSONL）')
+    parser.add_argument('--field', default='problem', help='题目字段，多个字段以逗号分隔并以换行拼接（默认 problem）')
+    parser.add_argument('--progress-file', default=None, help='进度文件（默认 语料路径 + .progress）')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时解题的数量（默认8）')
+    parser.add_argument('--rpm', type=int, default=None, help='每分钟请求数上限（默认 UPSTREAM_RPM）')
+    parser.add_argument('--tpm', type=int, default=None, help='每分钟token数上限（默认 UPSTREAM_TPM）')
+    parser.add_argument('--max-attempts', type=int, default=3, help='上游过载或熔断时每道题的最多尝试次数')
+    parser.add_argument('--limit', type=int, default=0, help='只预热语料中的前N道题目，0 表示全部')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='输出进度的间隔（秒）')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from config import Config  # type: ignore[reportImplicitRelativeImport]
+
+    problems = list(read_corpus(args.corpus, [field.strip() for field in args.field.split(',') if field.strip()]))
+    if args.limit > 0:
+        problems = problems[:args.limit]
+
+    solver, store = _build_solver(Config, max(1, args.concurrency), args.rpm, args.tpm)
+    if store is not None:
+        store.start()
+    progress = PrewarmProgress(args.progress_file or args.corpus + '.progress')
+    prewarmer = Prewarmer(solver, concurrency=args.concurrency, max_attempts=args.max_attempts,
+                          progress_interval=args.progress_interval)
+    try:
+        counts = prewarmer.run(problems, progress)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        progress.close()
+        if store is not None:
+            store.stop(timeout=30.0)
+    if counts['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
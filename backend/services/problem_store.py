@@ -0,0 +1,278 @@
+"""
+解题记录模块
+在SQLite中持久保存每道新解出的题目（含图片识别出的题目文本）、解答、模型与耗时，
+并通过 FTS5 全文索引按相关度检索历史解答；写入由后台线程批量完成，不占用解题请求的时间
+"""
+
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Optional, Dict, Any, List, Tuple
+
+
+# 中日韩文字没有空格分词，逐字切分后以短语查询实现任意子串匹配
+_CJK_RE = re.compile(r'([぀-ヿ㐀-䶿一-鿿豈-﫿가-힯])')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def segment(text: str) -> str:
+    """
+    生成写入全文索引的分词文本：全角转半角、统一小写，中日韩文字逐字分隔
+
+    Args:
+        text: 原始文本
+
+    Returns:
+        以空格分隔词元的文本
+    """
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return _WHITESPACE_RE.sub(' ', _CJK_RE.sub(r' \1 ', text)).strip()
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    将用户输入转换为 FTS5 查询：按空白拆分为多个关键词，每个关键词作为短语，关键词之间为 AND
+
+    Returns:
+        FTS5 查询表达式，没有有效关键词时返回None
+    """
+    phrases = []
+    for term in (query or '').split():
+        tokens = segment(term)
+        if tokens:
+            phrases.append('"' + tokens.replace('"', '""') + '"')
+    return ' '.join(phrases) if phrases else None
+
+
+def _excerpt(text: str, query: str, width: int = 80) -> str:
+    """截取首个关键词附近的原文片段"""
+    normalized = unicodedata.normalize('NFKC', text or '').lower()
+    position = -1
+    for term in (query or '').split():
+        position = normalized.find(unicodedata.normalize('NFKC', term).lower())
+        if position >= 0:
+            break
+    if position < 0:
+        return text[:width] + ('...' if len(text) > width else '')
+    start = max(0, position - width // 4)
+    end = min(len(text), start + width)
+    return ('...' if start else '') + text[start:end] + ('...' if end < len(text) else '')
+
+
+class ProblemStore:
+    """基于 SQLite FTS5 的解题记录与全文检索"""
+
+    def __init__(self, path: str, max_pending: int = 1000, batch_size: int = 100):
+        """
+        Args:
+            path: SQLite数据库文件路径（多个工作进程可共享同一个文件）
+            max_pending: 等待写入的记录上限，超出时丢弃新记录，不阻塞解题请求
+            batch_size: 后台线程每次事务写入的最多记录数
+
+        Raises:
+            RuntimeError: SQLite 未编译 FTS5 扩展时抛出
+        """
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS problems ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' key TEXT NOT NULL UNIQUE,'
+            ' source TEXT NOT NULL,'
+            ' problem TEXT NOT NULL,'
+            ' solution TEXT NOT NULL,'
+            ' model TEXT NOT NULL,'
+            ' prompt_version TEXT NOT NULL,'
+            ' elapsed_ms REAL,'
+            ' created_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_problems_updated ON problems(updated_at)')
+        try:
+            # 索引表只保存分词后的文本，rowid 与 problems.id 一致
+            self._conn.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS problems_fts USING fts5(problem, solution)'
+            )
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"当前SQLite不支持FTS5全文索引: {str(e)}")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+        self._pending: 'queue.Queue[Optional[Tuple[Any, ...]]]' = queue.Queue(maxsize=max(1, max_pending))
+        self._writer: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.searches = 0
+
+    def start(self) -> None:
+        """启动后台写入线程"""
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._run, name='problem-store', daemon=True)
+            self._writer.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """写完已排队的记录后停止后台线程"""
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            self._pending.put(None)
+            writer.join(timeout)
+
+    def record(self, key: str, problem: str, solution: str, model: str, prompt_version: str,
+               source: str = 'text', elapsed_ms: Optional[float] = None) -> None:
+        """
+        登记一道新解出的题目（只放入写入队列，立即返回）
+
+        Args:
+            key: 题目唯一键（与缓存键一致），相同题目重复解答时覆盖旧记录
+            problem: 题目文本，图片题目为识别出的文字（视觉模型直接解答时为空）
+            solution: 解答文本
+            model: 模型名称
+            prompt_version: 提示词版本
+            source: 题目来源（text / image / prewarm）
+            elapsed_ms: 解题耗时（毫秒）
+        """
+        if not solution:
+            return
+        try:
+            self._pending.put_nowait((key, source, problem or '', solution, model, prompt_version,
+                                      elapsed_ms, time.time()))
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+
+    def _run(self) -> None:
+        """取出队列中已有的记录批量写入；收到停止标记后写完剩余记录再退出"""
+        stopping = False
+        while not (stopping and self._pending.empty()):
+            item = self._pending.get() if not stopping else self._pending.get_nowait()
+            batch = []
+            while True:
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write(batch)
+                except sqlite3.Error as e:
+                    print(f"写入解题记录失败: {str(e)}")
+                    # 回滚未提交的部分写入，避免残留事务持有写锁、并被下一批记录一起提交
+                    with self._lock:
+                        self._conn.rollback()
+
+    def _write(self, batch: List[Tuple[Any, ...]]) -> None:
+        """在一个事务中写入一批记录，同时更新全文索引"""
+        with self._lock:
+            for key, source, problem, solution, model, prompt_version, elapsed_ms, now in batch:
+                row = self._conn.execute('SELECT id FROM problems WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    cursor = self._conn.execute(
+                        'INSERT INTO problems (key, source, problem, solution, model, prompt_version,'
+                        ' elapsed_ms, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (key, source, problem, solution, model, prompt_version, elapsed_ms, now, now)
+                    )
+                    row_id = cursor.lastrowid
+                else:
+                    row_id = row[0]
+                    self._conn.execute(
+                        'UPDATE problems SET source = ?, problem = ?, solution = ?, model = ?, prompt_version = ?,'
+                        ' elapsed_ms = ?, updated_at = ? WHERE id = ?',
+                        (source, problem, solution, model, prompt_version, elapsed_ms, now, row_id)
+                    )
+                    self._conn.execute('DELETE FROM problems_fts WHERE rowid = ?', (row_id,))
+                self._conn.execute(
+                    'INSERT INTO problems_fts (rowid, problem, solution) VALUES (?, ?, ?)',
+                    (row_id, segment(problem), segment(solution))
+                )
+            self._conn.commit()
+        with self._stats_lock:
+            self.recorded += len(batch)
+
+    def search(self, query: str, page: int = 1, page_size: int = 10) -> Dict[str, Any]:
+        """
+        按相关度检索历史解答（题目文本的权重高于解答文本）
+
+        Args:
+            query: 关键词，多个关键词以空白分隔，须全部出现
+            page: 页码，从1开始
+            page_size: 每页条数
+
+        Returns:
+            包含 items / total / page / page_size 的字典
+        """
+        match = build_match_query(query)
+        offset = (page - 1) * page_size
+        if match is None:
+            return {'items': [], 'total': 0, 'page': page, 'page_size': page_size}
+
+        with self._lock:
+            total = self._conn.execute(
+                'SELECT COUNT(*) FROM problems_fts WHERE problems_fts MATCH ?', (match,)
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                'SELECT p.id, p.source, p.problem, p.solution, p.model, p.prompt_version, p.elapsed_ms,'
+                ' p.created_at, p.updated_at, bm25(problems_fts, 4.0, 1.0) AS score'
+                ' FROM problems_fts JOIN problems p ON p.id = problems_fts.rowid'
+                ' WHERE problems_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?',
+                (match, page_size, offset)
+            ).fetchall()
+        with self._stats_lock:
+            self.searches += 1
+
+        items = []
+        for (row_id, source, problem, solution, model, prompt_version, elapsed_ms,
+             created_at, updated_at, score) in rows:
+            items.append({
+                'id': row_id,
+                'source': source,
+                'problem': problem,
+                'solution': solution,
+                'excerpt': _excerpt(solution, query),
+                'model': model,
+                'prompt_version': prompt_version,
+                'elapsed_ms': round(elapsed_ms, 1) if elapsed_ms is not None else None,
+                'created_at': created_at,
+                'updated_at': updated_at,
+                # bm25 越小越相关，取反后越大越相关
+                'score': round(-score, 4)
+            })
+        return {'items': items, 'total': total, 'page': page, 'page_size': page_size}
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM problems').fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """获取记录数与写入统计"""
+        with self._stats_lock:
+            recorded, dropped, searches = self.recorded, self.dropped, self.searches
+        return {
+            'size': self.size(),
+            'pending': self._pending.qsize(),
+            'recorded': recorded,
+            'dropped': dropped,
+            'searches': searches
+        }
+
+    def close(self) -> None:
+        """停止后台线程并关闭数据库连接"""
+        self.stop()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,230 @@
+"""
+提示词模块
+按版本登记系统提示词，在导入时一次性构建，并按题型与题目长度估算输出token预算
+
+提示词版本由 PROMPT_VERSION 选择，同时参与解答缓存键计算，修改提示词时应登记新版本
+"""
+
+import inspect
+import re
+from typing import Optional, Dict
+
+
+# 输出token预算（按题型），实际预算不超过 max_tokens 上限
+TOKEN_BUDGETS = {
+    'arithmetic': 600,
+    'choice': 1200,
+    'general': 1500,
+    'proof': 3000,
+    'image': 2500,
+    'transcribe': 600
+}
+
+# 一般题目与证明题每个题目字符追加的预算：题目越长，解答步骤通常越多
+TOKENS_PER_PROBLEM_CHAR = 2
+
+_PROOF_KEYWORDS = ('证明', '求证', '推导', 'prove')
+_CHOICE_RE = re.compile(r'(?:^|\s|[（(])[A-D][.．、:：)）]')
+_ARITHMETIC_WORDS_RE = re.compile(r'计算|求值|求|等于多少|等于|是多少|结果|[?？:：]')
+_ARITHMETIC_RE = re.compile(r'^[\d\s.+\-*/×÷=()（）^%]+$')
+_FENCE_RE = re.compile(r'^```[\w-]*\s*|\s*```$')
+_TRANSCRIPT_PREFIX_RE = re.compile(r'^(?:\*\*)?(?:题目|原题|识别结果)(?:\*\*)?\s*[:：]\s*')
+
+# 图片中没有题目时转写提示词要求模型输出的内容
+NO_PROBLEM_MARKER = '无题目'
+
+
+class PromptSet:
+    """一个版本的提示词"""
+
+    def __init__(self, version: str, text_system: str, image_system: str,
+                 text_user: str = '题目：{problem}\n\n请详细解答这个问题。',
+                 image_user: str = '请识别并解答这道题目：',
+                 transcribe_system: Optional[str] = None,
+                 transcribe_user: str = '请转写图片中的题目：'):
+        """
+        Args:
+            version: 版本号
+            text_system: 文字解题系统提示词
+            image_system: 图片解题系统提示词
+            text_user: 文字解题用户消息模板，{problem} 替换为题目
+            image_user: 图片解题用户消息中的文字部分
+            transcribe_system: 图片题目转写系统提示词，为None时使用默认提示词
+            transcribe_user: 图片题目转写用户消息中的文字部分
+        """
+        self.version = version
+        self.text_system = text_system
+        self.image_system = image_system
+        self.text_user = text_user
+        self.image_user = image_user
+        self.transcribe_system = transcribe_system or _TRANSCRIBE_SYSTEM_PROMPT
+        self.transcribe_user = transcribe_user
+
+    def text_user_prompt(self, problem: str) -> str:
+        """文字解题的用户消息"""
+        return self.text_user.replace('{problem}', problem)
+
+
+def compact(prompt: str) -> str:
+    """去掉源码缩进带来的行首空白和首尾空行，这些空白同样消耗输入token"""
+    return inspect.cleandoc(prompt)
+
+
+def arithmetic_expression(problem: str) -> Optional[str]:
+    """题目为纯算式（如“计算 12×(3+4)”）时返回去掉文字后的算式，否则返回None"""
+    text = problem.strip()
+    expression = _ARITHMETIC_WORDS_RE.sub('', text).strip()
+    if len(text) <= 60 and expression and _ARITHMETIC_RE.match(expression):
+        return expression
+    return None
+
+
+def classify_problem(problem: str) -> str:
+    """
+    按题目文本粗略判断题型
+
+    Returns:
+        arithmetic（纯算式）/ choice（选择题）/ proof（证明题）/ general
+    """
+    text = problem.strip()
+    lowered = text.lower()
+    if any(keyword in lowered for keyword in _PROOF_KEYWORDS):
+        return 'proof'
+    if len(_CHOICE_RE.findall(text)) >= 2:
+        return 'choice'
+    if arithmetic_expression(text) is not None:
+        return 'arithmetic'
+    return 'general'
+
+
+def clean_transcript(text: Optional[str]) -> Optional[str]:
+    """
+    规范化视觉模型转写的题目文本：去掉代码块标记、“题目：”前缀和多余空行
+
+    Returns:
+        题目文本，转写为空或模型表示图片中没有题目时返回None
+    """
+    if not text:
+        return None
+    text = _FENCE_RE.sub('', text.strip())
+    text = _TRANSCRIPT_PREFIX_RE.sub('', text.strip())
+    lines = [line.strip() for line in text.splitlines()]
+    text = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+    if not text or text.strip('。.！! ') == NO_PROBLEM_MARKER:
+        return None
+    return text
+
+
+def estimate_max_tokens(problem: Optional[str], cap: int) -> int:
+    """
+    估算解答所需的输出token预算
+
+    Args:
+        problem: 题目文本，图片题目为None
+        cap: 预算上限
+
+    Returns:
+        max_tokens 取值
+    """
+    if problem is None:
+        return min(cap, TOKEN_BUDGETS['image'])
+    kind = classify_problem(problem)
+    budget = TOKEN_BUDGETS[kind]
+    if kind in ('general', 'proof'):
+        budget += len(problem) * TOKENS_PER_PROBLEM_CHAR
+    return min(cap, budget)
+
+
+# 文字解题系统提示词
+_TEXT_SYSTEM_PROMPT = """你是一个专业的AI解题助手。请按照以下要求解答问题：
+
+                1. 仔细阅读并理解题目
+                2. 提供详细的解题步骤和思路
+                3. 如果涉及计算，展示完整的计算过程
+                4. 最后给出明确的答案
+                5. 使用清晰、易懂的语言
+                6. 对于数学问题，可以使用LaTeX格式表示公式
+                7. 如果问题不完整或不清楚，请指出并请求澄清
+
+                请按照以下格式回答：
+
+                **问题分析**：
+                [分析题目要求和已知条件]
+
+                **解题思路**：
+                [描述解题的整体思路和方法]
+
+                **详细步骤**：
+                [展示详细的解题步骤]
+
+                **最终答案**：
+                [给出明确的最终答案]
+
+                现在开始解题："""
+
+# 图片解题系统提示词
+_IMAGE_SYSTEM_PROMPT = """你是一个专业的AI解题助手。用户会上传一张题目图片，请你：
+
+                    1. 仔细识别图片中的题目内容
+                    2. 如果图片不清晰或无法识别，请说明
+                    3. 提供详细的解题步骤和思路
+                    4. 如果涉及计算，展示完整的计算过程
+                    5. 最后给出明确的答案
+                    6. 使用清晰、易懂的语言
+                    7. 对于数学问题，可以使用LaTeX格式表示公式
+                    8. 如果问题不完整或不清楚，请指出并请求澄清
+                    9. 如果用户上传的图片中没有题目，请说明
+
+                    请按照以下格式回答：
+                    **问题分析**：
+                    [分析题目要求和已知条件]
+
+                    **解题思路**：
+                    [描述解题的整体思路和方法]
+
+                    **详细步骤**：
+                    [展示详细的解题步骤]
+
+                    **最终答案**：
+                    [给出明确的最终答案]
+
+                    现在开始解题：
+                    """
+
+# 图片题目转写系统提示词：只识别不解答，输出可直接作为文字题目的纯文本
+_TRANSCRIBE_SYSTEM_PROMPT = compact(f"""你是一个题目识别助手。请把用户上传图片中的题目完整、准确地转写为文字：
+
+    1. 只转写题目本身（题干、选项、已知条件），不要解答，不要添加任何说明
+    2. 保持原有的段落与选项顺序，选项按 A. B. C. D. 分行列出
+    3. 数学公式使用LaTeX格式表示
+    4. 图片中有多道题目时，只转写最完整、最清晰的一道
+    5. 无法辨认的文字用 [?] 表示
+    6. 如果图片中没有题目，只输出：{NO_PROBLEM_MARKER}""")
+
+_REGISTRY: Dict[str, PromptSet] = {}
+
+
+def register(prompt_set: PromptSet) -> None:
+    """登记一个版本的提示词"""
+    _REGISTRY[prompt_set.version] = prompt_set
+
+
+def get_prompt_set(version: str) -> PromptSet:
+    """
+    获取指定版本的提示词
+
+    Raises:
+        ValueError: 版本未登记时抛出
+    """
+    if version not in _REGISTRY:
+        raise ValueError(f"未知的提示词版本: {version}（可用版本: {', '.join(sorted(_REGISTRY))}）")
+    return _REGISTRY[version]
+
+
+# v1：原始提示词，保留源码缩进，与已有缓存一致
+register(PromptSet('v1', _TEXT_SYSTEM_PROMPT, _IMAGE_SYSTEM_PROMPT))
+
+# v2：内容与v1相同，去掉缩进空白
+register(PromptSet('v2', compact(_TEXT_SYSTEM_PROMPT), compact(_IMAGE_SYSTEM_PROMPT)))
+
+DEFAULT_PROMPT_VERSION = 'v2'
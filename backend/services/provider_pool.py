@@ -0,0 +1,381 @@
+"""
+多上游路由模块
+每条路由持有多个AI服务后端，按滚动延迟统计选择后端，
+遇到连接失败或调用频率超限时自动切换到下一个后端
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable, Iterator, AsyncIterator, Awaitable, Deque
+
+from .ai_service import AIService, AIServiceError, AIServiceConnectionError, AIServiceRateLimitError
+from .rate_limiter import UpstreamLimiter
+
+
+STRATEGIES = ('ewma', 'least_latency')
+
+
+def _should_failover(error: AIServiceError) -> bool:
+    """连接失败和频率超限说明后端暂时不可用，其余错误（如请求参数错误）换后端也无济于事"""
+    return isinstance(error, (AIServiceConnectionError, AIServiceRateLimitError))
+
+
+class ProviderStats:
+    """单个后端的滚动统计"""
+
+    def __init__(self, window: int = 100, alpha: float = 0.3):
+        """
+        Args:
+            window: 计算分位数与错误率的滚动窗口（最近请求数）
+            alpha: EWMA平滑系数，越大越偏重最近的请求
+        """
+        self.alpha = alpha
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.ewma: Optional[float] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.cooldown_until = 0.0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_success(self, latency: float) -> None:
+        """记录一次成功请求的延迟（秒）"""
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+
+    def record_failure(self, error: AIServiceError, cooldown: float) -> None:
+        """记录一次失败请求，后端暂时不可用时进入冷却期"""
+        with self._lock:
+            self.outcomes.append(False)
+            self.errors += 1
+            self.last_error = str(error)
+            if _should_failover(error):
+                self.cooldown_until = time.time() + cooldown
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """滚动窗口内的延迟分位数（秒），无样本时返回None"""
+        with self._lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def cooling_down(self) -> bool:
+        return time.time() < self.cooldown_until
+
+
+class ProviderPool:
+    """
+    一条路由上的多个AI服务后端
+
+    对外提供与 AIService 相同的解题接口，可直接替换单个 AIService 使用；
+    model 为主后端（第一个）的模型名；实际给出解答的后端通过 note_answer 记录，结果与缓存使用该后端的模型
+    """
+
+    def __init__(self, services: List[AIService], strategy: str = 'ewma',
+                 cooldown: float = 30.0, window: int = 100):
+        """
+        Args:
+            services: 后端列表，第一个为主后端
+            strategy: 路由策略
+                ewma - 按延迟EWMA乘以（进行中请求数+1）选择，兼顾延迟与负载
+                least_latency - 按滚动窗口的延迟中位数选择
+            cooldown: 连接失败或频率超限后的冷却时间（秒），冷却期内的后端排在最后
+            window: 滚动统计窗口（最近请求数）
+        """
+        if not services:
+            raise ValueError("路由池至少需要一个后端")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"不支持的路由策略: {strategy}")
+
+        self.services = services
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self._stats = [ProviderStats(window=window) for _ in services]
+        self.failovers = 0
+
+    @property
+    def model(self) -> str:
+        return self.services[0].model
+
+    @property
+    def models(self) -> List[str]:
+        """各后端的模型（主后端在前），任一后端的解答都可作为本路由的缓存命中"""
+        return list(dict.fromkeys(service.model for service in self.services))
+
+    @property
+    def api_base(self) -> str:
+        return self.services[0].api_base
+
+    def _score(self, stats: ProviderStats) -> float:
+        """路由得分，越小越优先；没有延迟样本的后端得分为0，会被优先尝试以采集延迟"""
+        if self.strategy == 'least_latency':
+            latency = stats.percentile(0.5)
+        else:
+            latency = stats.ewma
+            if latency is not None:
+                latency *= stats.in_flight + 1
+        if latency is None:
+            return 0.0
+        # 按近期成功率放大得分，错误率高的后端即使延迟低也会靠后
+        return latency / max(0.1, 1.0 - stats.error_rate())
+
+    def _ranked(self) -> List[int]:
+        """
+        按路由优先级排列后端序号
+
+        可用的后端按得分排在前面；冷却中的后端按冷却结束时间排在后面，只在其余后端都失败时使用。
+        冷却结束且没有成功样本的后端得分为0，会被优先尝试一次，以便及时恢复
+        """
+        def key(i: int):
+            stats = self._stats[i]
+            if stats.cooling_down():
+                return 1, stats.cooldown_until, i
+            return 0, self._score(stats), i
+        return sorted(range(len(self.services)), key=key)
+
+    def _on_failure(self, index: int, error: AIServiceError) -> bool:
+        """
+        记录失败并判断是否切换到下一个后端
+
+        Returns:
+            是否应切换后端重试
+        """
+        self._stats[index].record_failure(error, self.cooldown)
+        if not _should_failover(error):
+            return False
+        self.failovers += 1
+        print(f"上游后端 {self.services[index].model} ({self.services[index].api_base}) 不可用，切换下一个后端: {str(error)}")
+        return True
+
+    def _call(self, call: Callable[[AIService], Any]) -> Any:
+        """依次尝试各后端，直到成功或遇到不可切换的错误"""
+        last_error: Optional[AIServiceError] = None
+        for index in self._ranked():
+            stats = self._stats[index]
+            stats.acquire()
+            start = time.perf_counter()
+            try:
+                result = call(self.services[index])
+            except AIServiceError as e:
+                if not self._on_failure(index, e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                stats.release()
+            stats.record_success(time.perf_counter() - start)
+            return result
+        raise last_error  # type: ignore[misc]
+
+    async def _acall(self, call: Callable[[AIService], Awaitable[Any]]) -> Any:
+        """_call 的异步版本"""
+        last_error: Optional[AIServiceError] = None
+        for index in self._ranked():
+            stats = self._stats[index]
+            stats.acquire()
+            start = time.perf_counter()
+            try:
+                result = await call(self.services[index])
+            except AIServiceError as e:
+                if not self._on_failure(index, e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                stats.release()
+            stats.record_success(time.perf_counter() - start)
+            return result
+        raise last_error  # type: ignore[misc]
+
+    def _stream(self, call: Callable[[AIService], Iterator[str]]) -> Iterator[str]:
+        """
+        流式调用：只有在尚未产出任何片段时才切换后端，延迟按首个片段到达时间统计
+        """
+        last_error: Optional[AIServiceError] = None
+        for index in self._ranked():
+            stats = self._stats[index]
+            stats.acquire()
+            start = time.perf_counter()
+            first_chunk_at: Optional[float] = None
+            try:
+                for chunk in call(self.services[index]):
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    yield chunk
+            except AIServiceError as e:
+                if first_chunk_at is not None:
+                    # 已向调用方产出片段，不能再切换后端
+                    stats.record_failure(e, self.cooldown)
+                    raise
+                if not self._on_failure(index, e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                stats.release()
+            stats.record_success((first_chunk_at or time.perf_counter()) - start)
+            return
+        raise last_error  # type: ignore[misc]
+
+    async def _astream(self, call: Callable[[AIService], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """_stream 的异步版本"""
+        last_error: Optional[AIServiceError] = None
+        for index in self._ranked():
+            stats = self._stats[index]
+            stats.acquire()
+            start = time.perf_counter()
+            first_chunk_at: Optional[float] = None
+            try:
+                async for chunk in call(self.services[index]):
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    yield chunk
+            except AIServiceError as e:
+                if first_chunk_at is not None:
+                    # 已向调用方产出片段，不能再切换后端
+                    stats.record_failure(e, self.cooldown)
+                    raise
+                if not self._on_failure(index, e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                stats.release()
+            stats.record_success((first_chunk_at or time.perf_counter()) - start)
+            return
+        raise last_error  # type: ignore[misc]
+
+    # ==================== 与 AIService 相同的解题接口 ====================
+
+    def solve_problem(self, problem: str) -> Optional[str]:
+        return self._call(lambda service: service.solve_problem(problem))
+
+    def solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        return self._call(lambda service: service.solve_problem_with_image(image_base64, mime_type))
+
+    def transcribe_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        return self._call(lambda service: service.transcribe_image(image_base64, mime_type))
+
+    def stream_solve_problem(self, problem: str) -> Iterator[str]:
+        return self._stream(lambda service: service.stream_solve_problem(problem))
+
+    def stream_solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Iterator[str]:
+        return self._stream(lambda service: service.stream_solve_problem_with_image(image_base64, mime_type))
+
+    async def asolve_problem(self, problem: str) -> Optional[str]:
+        return await self._acall(lambda service: service.asolve_problem(problem))
+
+    async def asolve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        return await self._acall(lambda service: service.asolve_problem_with_image(image_base64, mime_type))
+
+    async def atranscribe_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> Optional[str]:
+        return await self._acall(lambda service: service.atranscribe_image(image_base64, mime_type))
+
+    def astream_solve_problem(self, problem: str) -> AsyncIterator[str]:
+        return self._astream(lambda service: service.astream_solve_problem(problem))
+
+    def astream_solve_problem_with_image(self, image_base64: str, mime_type: str = 'image/jpeg') -> AsyncIterator[str]:
+        return self._astream(lambda service: service.astream_solve_problem_with_image(image_base64, mime_type))
+
+    def status(self) -> Dict[str, Any]:
+        """获取实时路由状态"""
+        ranked = self._ranked()
+        providers = []
+        for index, service in enumerate(self.services):
+            stats = self._stats[index]
+            p50 = stats.percentile(0.5)
+            p95 = stats.percentile(0.95)
+            providers.append({
+                'model': service.model,
+                'api_base': service.api_base,
+                'rank': ranked.index(index) + 1,
+                'requests': stats.requests,
+                'errors': stats.errors,
+                'error_rate': round(stats.error_rate(), 4),
+                'in_flight': stats.in_flight,
+                'ewma_ms': round(stats.ewma * 1000, 1) if stats.ewma is not None else None,
+                'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+                'cooling_down': stats.cooling_down(),
+                'last_error': stats.last_error,
+                **service.resilience_stats()
+            })
+        return {
+            'strategy': self.strategy,
+            'failovers': self.failovers,
+            'providers': providers
+        }
+
+
+def create_provider_pool(primary: AIService, extra_providers: str = '', strategy: str = 'ewma',
+                         cooldown: float = 30.0) -> ProviderPool:
+    """
+    由主后端和额外后端配置创建路由池
+
+    Args:
+        primary: 主后端
+        extra_providers: 额外后端的JSON数组，元素为 {"api_key", "api_base", "model"}，
+            缺省字段沿用主后端的配置；可选 "rpm"、"tpm"、"max_concurrency" 覆盖该后端的限流配额，
+            "prompt_cache" 覆盖该后端的前缀缓存提示，
+            超时、重试、熔断、提示词及其余限流配置与主后端相同
+        strategy: 路由策略（ewma / least_latency）
+        cooldown: 后端不可用后的冷却时间（秒）
+
+    Returns:
+        路由池实例
+
+    Raises:
+        ValueError: 额外后端配置格式错误时抛出
+    """
+    services = [primary]
+    if extra_providers and extra_providers.strip():
+        try:
+            entries = json.loads(extra_providers)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"后端配置不是合法的JSON: {str(e)}")
+        if not isinstance(entries, list):
+            raise ValueError("后端配置应为JSON数组")
+        for entry in entries:
+            services.append(AIService(
+                api_key=entry.get('api_key', primary.api_key),
+                api_base=entry.get('api_base', primary.api_base),
+                model=entry.get('model', primary.model),
+                timeout=primary.timeout,
+                retry_policy=primary.retry_policy.clone(),
+                circuit_breaker=primary.circuit_breaker.clone(),
+                limiter=UpstreamLimiter(
+                    rpm=entry.get('rpm', primary.limiter.rpm),
+                    tpm=entry.get('tpm', primary.limiter.tpm),
+                    max_concurrency=entry.get('max_concurrency', primary.limiter.max_concurrency),
+                    max_queue=primary.limiter.max_queue,
+                    max_wait=primary.limiter.max_wait
+                ),
+                prompts=primary.prompts,
+                max_output_tokens=primary.max_output_tokens,
+                token_budget=primary.token_budget,
+                prompt_cache=entry.get('prompt_cache', primary.prompt_cache),
+                http_clients=primary.http_clients
+            ))
+    return ProviderPool(services, strategy=strategy, cooldown=cooldown)
@@ -0,0 +1,356 @@
+"""
+上游限流模块
+按上游配额（每分钟请求数 RPM、每分钟token数 TPM）和并发上限为每个后端节流，
+超出额度的请求在优先级队列中等待，无法在截止时间前获得额度的请求提前丢弃
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Callable, Deque, Iterator, List
+
+
+# 请求优先级，数值越小越优先
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar('upstream_priority', default=PRIORITY_INTERACTIVE)
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('upstream_deadline', default=None)
+
+
+@contextmanager
+def request_priority(priority: int, timeout: Optional[float] = None) -> Iterator[None]:
+    """
+    设置当前上下文中上游请求的优先级与排队截止时间
+
+    Args:
+        priority: 优先级，数值越小越优先
+        timeout: 最长排队时间（秒），为None时使用限流器的默认值
+    """
+    priority_token = _priority.set(priority)
+    deadline_token = _deadline.set(time.monotonic() + timeout if timeout is not None else None)
+    try:
+        yield
+    finally:
+        _priority.reset(priority_token)
+        _deadline.reset(deadline_token)
+
+
+class RateLimitShed(Exception):
+    """请求在排队阶段被丢弃（队列已满或无法在截止时间前获得额度）"""
+
+    def __init__(self, message: str = '', retry_after: Optional[float] = None):
+        """
+        Args:
+            message: 丢弃原因
+            retry_after: 预计令牌补足所需的秒数，未知时为None
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _TokenBucket:
+    """按分钟配额匀速补充的令牌桶，配额<=0 表示不限制"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def eta(self, amount: float, now: float) -> float:
+        """攒够 amount 个令牌还需等待的秒数（超过桶容量的请求按满桶计算）"""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        deficit = min(amount, self.capacity) - self.tokens
+        return max(0.0, deficit / self.rate)
+
+    def backlog_eta(self, amount: float, now: float) -> float:
+        """消耗 amount 个令牌（可超过桶容量，如排队中所有请求之和）所需的秒数"""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens -= min(amount, self.capacity)
+
+    def give(self, amount: float) -> None:
+        if self.enabled:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class _Waiter:
+    """队列中等待额度的请求"""
+
+    def __init__(self, priority: int, seq: int, deadline: float, tokens: int):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.state = 'waiting'  # waiting / granted / shed / abandoned
+        self.reason = ''
+        self.notify: Callable[[], None] = lambda: None
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Lease:
+    """一次获批的上游调用额度，调用结束后必须 release"""
+
+    def __init__(self, limiter: 'UpstreamLimiter', tokens: int):
+        self._limiter = limiter
+        self.tokens = tokens
+        self.used: Optional[int] = None
+        self._released = False
+
+    def set_usage(self, tokens: Optional[int]) -> None:
+        """记录实际消耗的token数，释放时退还多预留的部分"""
+        if tokens is not None:
+            self.used = tokens
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._limiter._release(self)
+
+    def __enter__(self) -> 'Lease':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class UpstreamLimiter:
+    """
+    单个上游后端的限流器
+
+    同时满足请求数令牌桶、token数令牌桶和并发上限时才放行；
+    不满足时按优先级排队，预计等待超过截止时间或队列已满时直接丢弃，避免请求集中打到上游后一起失败
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = 0,
+                 max_queue: int = 100, max_wait: float = 10.0):
+        """
+        Args:
+            rpm: 每分钟请求数上限，<=0 表示不限制
+            tpm: 每分钟token数上限，<=0 表示不限制
+            max_concurrency: 并发请求上限，<=0 表示不限制
+            max_queue: 排队请求上限，队列满时丢弃优先级最低的请求
+            max_wait: 默认最长排队时间（秒）
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self._queue: List[_Waiter] = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.granted = 0
+        self.queued = 0
+        self.shed = 0
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+
+    # ==================== 申请额度 ====================
+
+    def acquire(self, tokens: int = 0) -> Lease:
+        """
+        申请一次上游调用额度，必要时阻塞等待
+
+        Args:
+            tokens: 预计消耗的token数
+
+        Returns:
+            调用额度
+
+        Raises:
+            RateLimitShed: 队列已满或无法在截止时间前获得额度时抛出
+        """
+        waiter = self._new_waiter(tokens)
+        event = threading.Event()
+        waiter.notify = event.set
+
+        hint = self._enqueue(waiter)
+        while waiter.state == 'waiting':
+            remaining = waiter.deadline - time.monotonic()
+            event.wait(max(0.0, min(remaining, hint) if hint is not None else remaining))
+            event.clear()
+            hint = self._poll(waiter)
+        return self._finish(waiter)
+
+    async def aacquire(self, tokens: int = 0) -> Lease:
+        """acquire 的异步版本，排队期间不占用线程"""
+        waiter = self._new_waiter(tokens)
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        waiter.notify = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+        try:
+            hint = self._enqueue(waiter)
+            while waiter.state == 'waiting':
+                remaining = waiter.deadline - time.monotonic()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), max(0.0, min(remaining, hint) if hint is not None else remaining))
+                except asyncio.TimeoutError:
+                    pass
+                wakeup.clear()
+                hint = self._poll(waiter)
+        except asyncio.CancelledError:
+            # 客户端断开：放弃排队，已获批的额度立即归还
+            with self._lock:
+                if waiter.state == 'waiting':
+                    waiter.state = 'abandoned'
+                    self._waiting -= 1
+            if waiter.state == 'granted':
+                Lease(self, waiter.tokens).release()
+            raise
+        return self._finish(waiter)
+
+    def _new_waiter(self, tokens: int) -> _Waiter:
+        deadline = _deadline.get()
+        if deadline is None:
+            deadline = time.monotonic() + self.max_wait
+        return _Waiter(_priority.get(), next(self._seq), deadline, tokens)
+
+    def _enqueue(self, waiter: _Waiter) -> Optional[float]:
+        """入队并尝试放行，返回下次重试放行前的建议等待时间"""
+        with self._lock:
+            self._admit_locked(waiter)
+            heapq.heappush(self._queue, waiter)
+            self._waiting += 1
+            return self._dispatch_locked()
+
+    def _poll(self, waiter: _Waiter) -> Optional[float]:
+        """等待被唤醒或超时后：超过截止时间则出队丢弃，否则再次尝试放行"""
+        with self._lock:
+            if waiter.state == 'waiting' and time.monotonic() >= waiter.deadline:
+                self._shed_locked(waiter, '排队超时')
+            return self._dispatch_locked()
+
+    def _finish(self, waiter: _Waiter) -> Lease:
+        if waiter.state != 'granted':
+            raise RateLimitShed(waiter.reason or '上游限流队列已丢弃该请求')
+        return Lease(self, waiter.tokens)
+
+    # ==================== 队列调度（需持有锁） ====================
+
+    def _admit_locked(self, waiter: _Waiter) -> None:
+        """入队前的准入检查：预计等待超过截止时间或队列已满时拒绝"""
+        now = time.monotonic()
+        ahead = [w for w in self._queue if w.state == 'waiting' and w < waiter]
+        eta = max(
+            self._requests.backlog_eta(len(ahead) + 1, now),
+            self._tokens.backlog_eta(sum(w.tokens for w in ahead) + waiter.tokens, now)
+        )
+        if now + eta > waiter.deadline:
+            self.shed += 1
+            raise RateLimitShed(f"上游限流，预计需等待 {eta:.1f} 秒，超过截止时间", retry_after=eta)
+
+        if self.max_queue > 0 and self._waiting >= self.max_queue:
+            worst = max((w for w in self._queue if w.state == 'waiting'), default=None)
+            if worst is None or not waiter < worst:
+                self.shed += 1
+                raise RateLimitShed("上游限流队列已满")
+            self._shed_locked(worst, '上游限流队列已满，被更高优先级的请求挤出')
+
+    def _shed_locked(self, waiter: _Waiter, reason: str) -> None:
+        waiter.state = 'shed'
+        waiter.reason = reason
+        self._waiting -= 1
+        self.shed += 1
+        waiter.notify()
+
+    def _dispatch_locked(self) -> Optional[float]:
+        """
+        按优先级放行队首请求
+
+        Returns:
+            队首因令牌不足无法放行时，令牌补足所需的秒数；因并发已满等待时为None（由释放额度唤醒）
+        """
+        now = time.monotonic()
+        while self._queue:
+            waiter = self._queue[0]
+            if waiter.state != 'waiting':
+                heapq.heappop(self._queue)
+                continue
+            if now >= waiter.deadline:
+                heapq.heappop(self._queue)
+                self._shed_locked(waiter, '排队超时')
+                continue
+            if self.max_concurrency > 0 and self.in_flight >= self.max_concurrency:
+                return None
+            wait = max(self._requests.eta(1, now), self._tokens.eta(waiter.tokens, now))
+            if wait > 0:
+                return wait
+
+            heapq.heappop(self._queue)
+            self._requests.take(1)
+            self._tokens.take(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            self._waiting -= 1
+            waited = now - waiter.enqueued_at
+            if waited > 0.001:
+                self.queued += 1
+            self._wait_times.append(waited)
+            waiter.state = 'granted'
+            waiter.notify()
+        return None
+
+    def _release(self, lease: Lease) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if lease.used is not None and lease.used < lease.tokens:
+                self._tokens.give(lease.tokens - lease.used)
+            self._dispatch_locked()
+            # 唤醒新的队首，令其按最新的令牌余量计算等待时间
+            for waiter in self._queue:
+                if waiter.state == 'waiting':
+                    waiter.notify()
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        """获取限流状态与排队耗时"""
+        with self._lock:
+            waits = sorted(self._wait_times)
+            now = time.monotonic()
+            self._requests._refill(now)
+            self._tokens._refill(now)
+            return {
+                'queue_depth': self._waiting,
+                'in_flight': self.in_flight,
+                'granted': self.granted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'wait_ms': {
+                    'p50': round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    'p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                    'max': round(waits[-1] * 1000, 1) if waits else 0.0
+                },
+                'requests_available': round(self._requests.tokens, 1) if self._requests.enabled else None,
+                'tokens_available': round(self._tokens.tokens) if self._tokens.enabled else None
+            }
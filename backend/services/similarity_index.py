@@ -0,0 +1,363 @@
+"""
+相似题目索引模块
+基于字符 n-gram MinHash + LSH 查找近似重复的已解题目，
+覆盖空白、标点、全半角及少量措辞差异导致的精确缓存未命中
+"""
+
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Collection, List, Set, Tuple, Union
+
+
+INDEX_FORMAT_VERSION = 3
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = 0xFFFFFFFF
+# 属于标点类别但决定题意的运算符与括号（NFKC 已将全角符号转为ASCII）
+_MATH_PUNCTUATION = frozenset('*/-%()[]{}')
+# 数字（含小数）与运算符；正负号前不是数字、字母或右括号时属于数字本身，如 "x+(-5)" 中的 -5
+_MATH_TOKEN_RE = re.compile(r'(?<![0-9A-Za-z)\]}])[-+]?\d+(?:\.\d+)?|\d+(?:\.\d+)?|[-+*/×÷=<>≤≥%^]')
+
+
+def normalize_for_matching(problem: str) -> str:
+    """
+    相似匹配用的规范化：NFKC、小写，并去掉空白和标点
+
+    数学符号（+ = < > 等）属于Sm类别，予以保留；* / - % 和括号虽属标点也予以保留，
+    数字之间的小数点同样保留，避免 "3*4" 与 "3/4"、"35" 与 "3.5" 规范化为相同文本
+    """
+    text = unicodedata.normalize('NFKC', problem or '').lower()
+    return ''.join(
+        ch for i, ch in enumerate(text)
+        if ch in _MATH_PUNCTUATION
+        or (ch == '.' and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit())
+        or not unicodedata.category(ch).startswith(('P', 'Z', 'C'))
+    )
+
+
+def _math_tokens(problem: str) -> List[str]:
+    """从 NFKC 原文（去掉空白）中依次提取带符号的数字与运算符，两道题目须完全一致才可能是同一题目"""
+    text = ''.join(unicodedata.normalize('NFKC', problem or '').split())
+    return _MATH_TOKEN_RE.findall(text)
+
+
+def _shingles(text: str, ngram: int) -> Set[str]:
+    """将文本切分为字符 n-gram 集合"""
+    if len(text) <= ngram:
+        return {text} if text else set()
+    return {text[i:i + ngram] for i in range(len(text) - ngram + 1)}
+
+
+class SimilarityIndex:
+    """MinHash LSH 相似题目索引，支持增量插入、容量上限与过期淘汰，可持久化到SQLite"""
+
+    def __init__(self, directory: str = '', threshold: float = 0.85,
+                 num_perm: int = 64, bands: int = 16, ngram: int = 2, seed: int = 1,
+                 max_entries: int = 10000, ttl: int = 0):
+        """
+        Args:
+            directory: 索引持久化目录，为空时仅保存在内存中（多个工作进程可共享同一目录）
+            threshold: Jaccard相似度阈值，达到阈值才视为同一题目
+            num_perm: MinHash签名长度
+            bands: LSH分段数，须整除num_perm
+            ngram: 字符n-gram长度（中文题目使用二元组效果较好）
+            seed: 哈希函数随机种子，须在重启间保持一致
+            max_entries: 最多保存的题目数，超出时淘汰最早加入的题目，<=0 表示不限制
+            ttl: 题目有效期（秒），<=0 表示永不过期
+        """
+        if num_perm % bands != 0:
+            raise ValueError("num_perm 必须能被 bands 整除")
+
+        self.directory = directory
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.seed = seed
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        rng = random.Random(seed)
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+        # 按加入顺序保存，队首最早加入，容量超限或过期时从队首淘汰
+        self._entries: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+        self._buckets: List[Dict[Tuple[int, ...], List[int]]] = [{} for _ in range(bands)]
+        self._seen: Dict[Tuple[str, str], int] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.lookup_time = 0.0
+
+        if directory:
+            self._load()
+
+    # ==================== 签名计算 ====================
+
+    def _signature(self, text: str) -> array:
+        """计算规范化文本的MinHash签名"""
+        hashes = [zlib.crc32(s.encode('utf-8')) for s in _shingles(text, self.ngram)]
+        signature = array('I')
+        if not hashes:
+            signature.extend([_MAX_HASH] * self.num_perm)
+            return signature
+        for a, b in self._perms:
+            signature.append(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes))
+        return signature
+
+    def _band_keys(self, signature) -> List[Tuple[int, ...]]:
+        rows = self.rows
+        return [tuple(signature[i * rows:(i + 1) * rows]) for i in range(self.bands)]
+
+    def _jaccard(self, a: str, b: str) -> float:
+        sa = _shingles(a, self.ngram)
+        sb = _shingles(b, self.ngram)
+        if not sa or not sb:
+            return 0.0
+        return len(sa & sb) / len(sa | sb)
+
+    def _expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return self.ttl > 0 and entry['created_at'] + self.ttl < now
+
+    # ==================== 查询与插入 ====================
+
+    def lookup(self, problem: str, scope: Union[str, Collection[str]]) -> Optional[Dict[str, Any]]:
+        """
+        查找相似的已解题目
+
+        Args:
+            problem: 题目文本
+            scope: 作用域（模型 + 提示词版本）或作用域集合，只在这些作用域内匹配
+
+        Returns:
+            命中时返回 {'problem', 'solution', 'similarity', 'scope'}，否则返回None
+        """
+        start = time.perf_counter()
+        now = time.time()
+        scopes = {scope} if isinstance(scope, str) else set(scope)
+        text = normalize_for_matching(problem)
+        tokens = _math_tokens(problem)
+        signature = self._signature(text)
+        best: Optional[Dict[str, Any]] = None
+
+        with self._lock:
+            candidates: Set[int] = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates.update(self._buckets[band].get(key, ()))
+
+            best_score = 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry['scope'] not in scopes or self._expired(entry, now):
+                    continue
+                # 数字或运算符不同的题目视为不同题目，避免 "2x+5=13" 命中 "2x+5=15"、"3*4" 命中 "3/4"
+                if entry['tokens'] != tokens:
+                    continue
+                score = self._jaccard(text, entry['text'])
+                if score >= self.threshold and score > best_score:
+                    best_score = score
+                    best = {
+                        'problem': entry['problem'],
+                        'solution': entry['solution'],
+                        'similarity': round(score, 4),
+                        'scope': entry['scope']
+                    }
+
+            self.lookups += 1
+            if best is not None:
+                self.hits += 1
+            self.lookup_time += time.perf_counter() - start
+
+        return best
+
+    def add(self, problem: str, solution: str, scope: str) -> bool:
+        """
+        增量插入已解题目
+
+        Args:
+            problem: 题目文本
+            solution: 解答
+            scope: 作用域（模型 + 提示词版本）
+
+        Returns:
+            是否插入（同一作用域下规范化文本相同的题目只保存一次，过期后可重新插入）
+        """
+        text = normalize_for_matching(problem)
+        if not text or not solution:
+            return False
+
+        signature = self._signature(text)
+        now = time.time()
+        entry = {'problem': problem, 'solution': solution, 'scope': scope, 'created_at': now}
+
+        with self._lock:
+            self._evict_locked(now)
+            if (scope, text) in self._seen:
+                return False
+            self._insert(entry, text, signature)
+            self._evict_locked(now)
+            if self._conn is not None:
+                self._persist(self._conn, entry, text, signature, now)
+        return True
+
+    def _insert(self, entry: Dict[str, Any], text: str, signature) -> None:
+        entry_id = self._next_id
+        self._next_id += 1
+        entry['text'] = text
+        entry['tokens'] = _math_tokens(entry['problem'])
+        entry['bands'] = self._band_keys(signature)
+        self._entries[entry_id] = entry
+        self._seen[(entry['scope'], text)] = entry_id
+        for band, key in enumerate(entry['bands']):
+            self._buckets[band].setdefault(key, []).append(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._seen.pop((entry['scope'], entry['text']), None)
+        for band, key in enumerate(entry['bands']):
+            bucket = self._buckets[band].get(key)
+            if bucket is None:
+                continue
+            bucket.remove(entry_id)
+            if not bucket:
+                del self._buckets[band][key]
+
+    def _evict_locked(self, now: float) -> None:
+        """从队首淘汰过期及超出容量的题目（题目按加入顺序排列，过期的必然在队首）"""
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if not self._expired(entry, now) and (self.max_entries <= 0 or len(self._entries) <= self.max_entries):
+                break
+            self._remove(entry_id)
+            self.evictions += 1
+
+    # ==================== 持久化 ====================
+    #
+    # 目录中的 index.db 保存索引参数（meta 表）与题目记录（entries 表），
+    # 每条记录与其 MinHash 签名在同一行中写入，多个进程同时写入由SQLite加锁保证不会错位；
+    # 索引参数或规范化规则变化时按题目原文重新规范化并计算签名
+
+    def _db_path(self) -> str:
+        return os.path.join(self.directory, 'index.db')
+
+    def _meta(self) -> Dict[str, Any]:
+        return {
+            'version': INDEX_FORMAT_VERSION,
+            'num_perm': self.num_perm,
+            'bands': self.bands,
+            'ngram': self.ngram,
+            'seed': self.seed
+        }
+
+    def _load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self._db_path(), check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' scope TEXT NOT NULL,'
+            ' text TEXT NOT NULL,'
+            ' problem TEXT NOT NULL,'
+            ' solution TEXT NOT NULL,'
+            ' signature BLOB NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' UNIQUE (scope, text))'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_created ON entries(created_at)')
+        conn.commit()
+        self._conn = conn
+
+        meta = json.dumps(self._meta(), sort_keys=True)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None or row[0] != meta:
+            self._resign(conn, meta)
+
+        now = time.time()
+        self._purge(conn, now)
+        rows = conn.execute(
+            'SELECT scope, text, problem, solution, signature, created_at FROM entries ORDER BY id'
+        ).fetchall()
+        for scope, text, problem, solution, blob, created_at in rows:
+            signature = array('I')
+            signature.frombytes(blob)
+            entry = {'problem': problem, 'solution': solution, 'scope': scope, 'created_at': created_at}
+            self._insert(entry, text, signature)
+
+    def _resign(self, conn: sqlite3.Connection, meta: str) -> None:
+        """索引参数或格式版本变化后按题目原文重新规范化并计算全部签名"""
+        rows = conn.execute('SELECT id, problem FROM entries').fetchall()
+        updates = []
+        for entry_id, problem in rows:
+            text = normalize_for_matching(problem)
+            updates.append((text, self._signature(text).tobytes(), entry_id))
+        conn.executemany('UPDATE entries SET text = ?, signature = ? WHERE id = ?', updates)
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (meta,))
+        conn.commit()
+
+    def _purge(self, conn: sqlite3.Connection, now: float) -> None:
+        """删除过期及超出容量的记录（保留最近加入的 max_entries 条）"""
+        if self.ttl > 0:
+            conn.execute('DELETE FROM entries WHERE created_at < ?', (now - self.ttl,))
+        if self.max_entries > 0:
+            conn.execute(
+                'DELETE FROM entries WHERE id <= (SELECT id FROM entries ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                (self.max_entries,)
+            )
+        conn.commit()
+
+    def _persist(self, conn: sqlite3.Connection, entry: Dict[str, Any], text: str, signature, now: float) -> None:
+        """写入一条记录，并按相同规则淘汰磁盘上的旧记录"""
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (scope, text, problem, solution, signature, created_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (entry['scope'], text, entry['problem'], entry['solution'], signature.tobytes(), now)
+            )
+            self._purge(conn, now)
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"写入相似题目索引失败: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取索引统计信息"""
+        with self._lock:
+            size, lookups, hits = len(self._entries), self.lookups, self.hits
+            evictions, lookup_time = self.evictions, self.lookup_time
+        return {
+            'size': size,
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'threshold': self.threshold,
+            'lookups': lookups,
+            'hits': hits,
+            'evictions': evictions,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'avg_lookup_ms': round(lookup_time / lookups * 1000, 3) if lookups else 0.0
+        }
+
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,261 @@
+"""
+请求合并模块（single-flight）
+同一时刻相同题目的多个请求只向上游发起一次调用，其余请求等待并共享结果
+"""
+
+import asyncio
+import contextvars
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+
+class _Call:
+    """一次进行中的阻塞调用"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Broadcast:
+    """一次进行中的流式调用，将上游片段广播给所有订阅者"""
+
+    def __init__(self, context: Optional[Dict[str, Any]] = None):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.context = context if context is not None else {}
+        self.cond = threading.Condition()
+
+    def publish(self, chunk: str) -> None:
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    def subscribe(self) -> Iterator[str]:
+        """从头重放已有片段，并继续接收后续片段"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                finished, error = self.done, self.error
+            yield from pending
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class _AsyncBroadcast:
+    """_Broadcast 的异步版本"""
+
+    def __init__(self, context: Optional[Dict[str, Any]] = None):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.context = context if context is not None else {}
+        self.cond = asyncio.Condition()
+        self.task: Optional['asyncio.Task[None]'] = None
+
+    async def publish(self, chunk: str) -> None:
+        async with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self.cond:
+            self.done = True
+            self.error = error
+            self.cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            async with self.cond:
+                await self.cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                pending = self.chunks[index:]
+                index = len(self.chunks)
+                finished, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            if finished:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """按键合并并发中的相同调用"""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._tasks: Dict[str, 'asyncio.Future[Any]'] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._async_streams: Dict[str, _AsyncBroadcast] = {}
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        执行调用；若相同键的调用正在进行，则等待其结果
+
+        Args:
+            key: 合并键
+            fn: 实际调用
+
+        Returns:
+            调用结果（所有等待者共享同一结果）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        do 的异步版本
+
+        上游调用在独立任务中执行，发起者断开连接不会取消其他等待者共享的调用
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            if task is None:
+                task = asyncio.ensure_future(fn())
+                self._tasks[key] = task
+                task.add_done_callback(lambda t: self._discard_task(key, t))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _discard_task(self, key: str, task: 'asyncio.Future[Any]') -> None:
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stream(self, key: str, fn: Callable[[], Iterator[str]],
+               context: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """
+        流式调用合并：首个请求在后台线程中读取上游并广播片段，所有相同请求（包括发起者）订阅同一输出
+
+        上游读取与发起请求的连接无关，发起者断开连接后其余请求照常接收，完整解答也会照常生成
+
+        Args:
+            key: 合并键
+            fn: 返回上游片段迭代器的调用
+            context: 调用信息（如实际给出解答的模型），由发起调用的请求在 fn 中写入，
+                订阅同一输出的请求每收到一个片段时同步到各自传入的字典
+
+        Yields:
+            文本片段
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            if broadcast is None:
+                broadcast = _Broadcast(context)
+                self._streams[key] = broadcast
+                self.executed += 1
+                # 复制上下文，使上游优先级、指标标签等在后台线程中同样生效
+                threading.Thread(
+                    target=contextvars.copy_context().run, args=(self._pump, key, broadcast, fn),
+                    name='single-flight-stream', daemon=True
+                ).start()
+            else:
+                self.coalesced += 1
+
+        for chunk in broadcast.subscribe():
+            if context is not None:
+                context.update(broadcast.context)
+            yield chunk
+
+    def _pump(self, key: str, broadcast: _Broadcast, fn: Callable[[], Iterator[str]]) -> None:
+        """读取上游片段并广播，结束或失败后通知所有订阅者"""
+        error: Optional[BaseException] = None
+        try:
+            for chunk in fn():
+                broadcast.publish(chunk)
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError("上游流式调用已中断")
+        finally:
+            with self._lock:
+                self._streams.pop(key, None)
+            broadcast.finish(error)
+
+    async def astream(self, key: str, fn: Callable[[], AsyncIterator[str]],
+                      context: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """stream 的异步版本，上游在独立任务中读取，发起者断开连接不会取消其他请求共享的调用"""
+        with self._lock:
+            broadcast = self._async_streams.get(key)
+            if broadcast is None:
+                broadcast = _AsyncBroadcast(context)
+                self._async_streams[key] = broadcast
+                broadcast.task = asyncio.ensure_future(self._apump(key, broadcast, fn))
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        async for chunk in broadcast.subscribe():
+            if context is not None:
+                context.update(broadcast.context)
+            yield chunk
+
+    async def _apump(self, key: str, broadcast: _AsyncBroadcast, fn: Callable[[], AsyncIterator[str]]) -> None:
+        """_pump 的异步版本"""
+        error: Optional[BaseException] = None
+        try:
+            async for chunk in fn():
+                await broadcast.publish(chunk)
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError("上游流式调用已中断")
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            with self._lock:
+                self._async_streams.pop(key, None)
+            await broadcast.finish(error)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        with self._lock:
+            in_flight = len(self._calls) + len(self._tasks) + len(self._streams) + len(self._async_streams)
+        total = self.executed + self.coalesced
+        return {
+            'upstream_calls': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight,
+            'coalesce_rate': round(self.coalesced / total, 4) if total else 0.0
+        }
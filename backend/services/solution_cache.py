@@ -0,0 +1,272 @@
+"""
+解答缓存模块
+按 规范化题目文本 + 模型 + 提示词版本 缓存AI解答，重复题目无需再次调用大模型
+"""
+
+import abc
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_problem(problem: str) -> str:
+    """
+    规范化题目文本
+
+    全角字符转半角（NFKC）、合并连续空白，使仅在排版上不同的同一道题得到相同的缓存键。
+    不统一大小写：数学题中大小写字母可能表示不同的量（如集合 A 与元素 a）。
+
+    Args:
+        problem: 原始题目文本
+
+    Returns:
+        规范化后的题目文本
+    """
+    text = unicodedata.normalize('NFKC', problem or '')
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def make_cache_key(problem: str, model: str, prompt_version: str) -> str:
+    """
+    生成缓存键
+
+    Args:
+        problem: 题目文本
+        model: 模型名称
+        prompt_version: 提示词版本
+
+    Returns:
+        SHA-256 十六进制摘要
+    """
+    raw = '\x00'.join([prompt_version or '', model or '', normalize_problem(problem)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class SolutionCache(abc.ABC):
+    """解答缓存基类，负责命中统计"""
+
+    backend = 'base'
+
+    def __init__(self, max_entries: int, ttl: int):
+        """
+        Args:
+            max_entries: 最大缓存条目数，超出后淘汰最久未使用的条目
+            ttl: 条目有效期（秒），<=0 表示永不过期
+        """
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl if self.ttl > 0 else 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回None"""
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: str, solution: str) -> None:
+        """写入缓存"""
+        if solution:
+            self._set(key, solution)
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        """读取未过期的缓存条目"""
+
+    @abc.abstractmethod
+    def _set(self, key: str, solution: str) -> None:
+        """写入缓存条目，超出容量时淘汰最久未使用的条目"""
+
+    @abc.abstractmethod
+    def size(self) -> int:
+        """当前缓存条目数"""
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """清空缓存"""
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'backend': self.backend,
+            'size': self.size(),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class MemorySolutionCache(SolutionCache):
+    """进程内LRU缓存，支持TTL和容量淘汰"""
+
+    backend = 'memory'
+
+    def __init__(self, max_entries: int = 1000, ttl: int = 86400):
+        super().__init__(max_entries, ttl)
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, solution = entry
+            if expires_at and expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return solution
+
+    def _set(self, key: str, solution: str) -> None:
+        with self._lock:
+            self._entries[key] = (self._expires_at(), solution)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteSolutionCache(SolutionCache):
+    """
+    基于SQLite的磁盘缓存，服务重启后依然有效
+
+    命中时只在内存中记录访问时间，下次写入（或累计到 TOUCH_BATCH 条）时批量更新到数据库，
+    读取路径上不产生磁盘写入与提交
+    """
+
+    backend = 'sqlite'
+    TOUCH_BATCH = 256
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: int = 86400):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS solutions ('
+            ' key TEXT PRIMARY KEY,'
+            ' solution TEXT NOT NULL,'
+            ' expires_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_solutions_accessed ON solutions(accessed_at)'
+        )
+        self._conn.commit()
+        self._touched: Dict[str, float] = {}
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT solution, expires_at FROM solutions WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            solution, expires_at = row
+            if expires_at and expires_at < now:
+                self._conn.execute('DELETE FROM solutions WHERE key = ?', (key,))
+                self._conn.commit()
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.TOUCH_BATCH:
+                self._flush_touched()
+                self._conn.commit()
+            return solution
+
+    def _flush_touched(self) -> None:
+        """将累计的访问时间写入数据库（调用方持有锁并负责提交）"""
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE solutions SET accessed_at = ? WHERE key = ?',
+                [(accessed_at, key) for key, accessed_at in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _set(self, key: str, solution: str) -> None:
+        now = time.time()
+        with self._lock:
+            # 先写入访问时间，使容量淘汰按最近的访问顺序进行
+            self._flush_touched()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO solutions (key, solution, expires_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, solution, self._expires_at(), now)
+            )
+            count = self._conn.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    'DELETE FROM solutions WHERE key IN ('
+                    ' SELECT key FROM solutions ORDER BY accessed_at ASC LIMIT ?)',
+                    (overflow,)
+                )
+                self.evictions += overflow
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched.clear()
+            self._conn.execute('DELETE FROM solutions')
+            self._conn.commit()
+
+
+def create_solution_cache(backend: str, max_entries: int, ttl: int,
+                          sqlite_path: str = '') -> Optional[SolutionCache]:
+    """
+    根据配置创建解答缓存
+
+    Args:
+        backend: 缓存后端（memory / sqlite / none）
+        max_entries: 最大缓存条目数
+        ttl: 条目有效期（秒）
+        sqlite_path: SQLite数据库文件路径
+
+    Returns:
+        缓存实例，backend为none时返回None
+    """
+    backend = (backend or 'memory').lower()
+    if backend == 'none':
+        return None
+    if backend == 'sqlite':
+        return SQLiteSolutionCache(sqlite_path, max_entries=max_entries, ttl=ttl)
+    if backend == 'memory':
+        return MemorySolutionCache(max_entries=max_entries, ttl=ttl)
+    raise ValueError(f"未知的缓存后端: {backend}")
@@ -0,0 +1,742 @@
+"""
+解题调度模块
+在AI服务前组合缓存等加速层，供各个API接口统一调用
+"""
+
+import asyncio
+import base64
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, List, Tuple, Union
+
+from . import metrics
+from .ai_service import AIService, atrack_stream, track_answer, track_stream
+from .cascade import CascadeService
+from .image_cache import ImageHash, ImageHashCache
+from .image_preprocess import ImagePreprocessor
+from .problem_store import ProblemStore
+from .provider_pool import ProviderPool
+from .similarity_index import SimilarityIndex
+from .single_flight import SingleFlight
+from .solution_cache import SolutionCache, make_cache_key
+from .upload import ImageUpload
+
+
+def _as_upload(image: Union[bytes, ImageUpload]) -> ImageUpload:
+    """统一图片参数：直接传入字节时包装为上传图片"""
+    return ImageUpload.from_bytes(image) if isinstance(image, bytes) else image
+
+
+class ProblemSolver:
+    """解题调度器"""
+
+    def __init__(self, text_service: Union[AIService, ProviderPool, CascadeService],
+                 vision_service: Union[AIService, ProviderPool],
+                 cache: Optional[SolutionCache] = None,
+                 similarity_index: Optional[SimilarityIndex] = None,
+                 image_cache: Optional[ImageHashCache] = None,
+                 image_preprocessor: Optional[ImagePreprocessor] = None,
+                 single_flight: Optional[SingleFlight] = None,
+                 prompt_version: str = 'v1',
+                 two_stage_vision: bool = False,
+                 store: Optional[ProblemStore] = None):
+        """
+        Args:
+            text_service: 文字模型AI服务、多后端路由池或模型分级服务
+            vision_service: 视觉模型AI服务或多后端路由池
+            cache: 解答缓存，为None时不缓存
+            similarity_index: 相似题目索引，为None时不做近似匹配
+            image_cache: 图片感知哈希缓存，为None时不缓存图片解答
+            image_preprocessor: 图片预处理器，为None时直接发送原图
+            single_flight: 并发相同请求的合并器，为None时自动创建
+            prompt_version: 提示词版本，参与缓存键计算
+            two_stage_vision: 图片题目是否先由视觉模型转写为文字，再按文字题目解答
+            store: 解题记录，为None时不记录；只登记调用上游新解出的题目
+        """
+        self.text_service = text_service
+        self.vision_service = vision_service
+        self.cache = cache
+        self.similarity_index = similarity_index
+        self.image_cache = image_cache
+        self.image_preprocessor = image_preprocessor
+        self.single_flight = single_flight or SingleFlight()
+        self.prompt_version = prompt_version
+        self.two_stage_vision = two_stage_vision
+        self.store = store
+
+    def solve_text(self, problem: str, source: str = 'text') -> Optional[Dict[str, Any]]:
+        """
+        文字解题，依次尝试精确缓存、相似题目索引，均未命中时调用AI服务
+
+        Args:
+            problem: 题目文本
+            source: 新解出的题目登记到解题记录时的来源（text / prewarm）
+
+        Returns:
+            包含 solution / model / cached / cache_type 的结果字典，无法获取解答时返回None；
+            model 为实际给出解答的模型（多后端路由切换时可能不是主后端的模型）
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        hit = self._lookup_text(problem)
+        if hit:
+            return hit
+
+        # 相同题目的并发请求只调用一次上游并只写入一次缓存，共享实际给出解答的模型
+        started = time.perf_counter()
+        solution, model = self.single_flight.do(
+            self._text_key(problem),
+            lambda: self._solved(
+                lambda: self.text_service.solve_problem(problem), self.text_service,
+                lambda solution, model: self._store_text(problem, solution, model, started, source)
+            )
+        )
+        if not solution:
+            return None
+
+        return {'solution': solution, 'model': model, 'cached': False, 'cache_type': None, **self._tier(model)}
+
+    def stream_text(self, problem: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式文字解题
+
+        meta 事件在首个片段到达后才发出，其中的 model 为实际给出解答的模型
+
+        Args:
+            problem: 题目文本
+
+        Yields:
+            (事件名, 数据) 元组，事件依次为 meta、若干 delta、done；失败时为 error
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        hit = self._lookup_text(problem)
+        if hit:
+            yield from self._replay(hit)
+            return
+
+        origin: Dict[str, Any] = {}
+        parts = []
+        started = time.perf_counter()
+        # 上游在后台读取，完整生成后只写入一次缓存，与发起请求的客户端是否断开无关
+        pieces = self.single_flight.stream(
+            self._text_key(problem),
+            lambda: self._stored(
+                track_stream(self.text_service.stream_solve_problem(problem), origin), origin, self.text_service,
+                lambda solution, model: self._store_text(problem, solution, model, started)
+            ),
+            origin
+        )
+        for piece in pieces:
+            if not parts:
+                yield 'meta', self._meta(origin, self.text_service)
+            parts.append(piece)
+            yield 'delta', {'content': piece}
+
+        solution = ''.join(parts)
+        if not solution.strip():
+            if not parts:
+                yield 'meta', self._meta(origin, self.text_service)
+            yield 'error', {'error': '无法获取解答，请检查API配置'}
+            return
+
+        yield 'done', {'cached': False}
+
+    def solve_image(self, image: Union[bytes, ImageUpload]) -> Optional[Dict[str, Any]]:
+        """
+        图片解题，优先按感知哈希命中同一题目图片的已有解答
+
+        two_stage_vision 开启时视觉模型只转写题目，解答走文字解题流程（精确缓存、相似题目索引、模型分级），
+        结果中的 problem 为识别出的题目文本；图片中没有可识别的题目时退回由视觉模型直接识别并解答
+
+        Args:
+            image: 上传图片或图片原始字节
+
+        Returns:
+            包含 solution / model / cached / cache_type（两段式时另有 problem）的结果字典，无法获取解答时返回None
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        upload = _as_upload(image)
+        hit, image_hash = self._lookup_image(upload)
+        if hit:
+            return hit
+
+        if self.two_stage_vision:
+            problem = self._transcribe(upload, image_hash)
+            if problem:
+                result = self.solve_text(problem)
+                if not result:
+                    return None
+                self._store_image(image_hash, result['solution'], result['model'], problem)
+                return {**result, 'problem': problem}
+
+        started = time.perf_counter()
+        solution, model = self.single_flight.do(
+            self._image_key(image_hash, upload),
+            lambda: self._solved(
+                lambda: self.vision_service.solve_problem_with_image(*self._prepare_image(upload)),
+                self.vision_service,
+                lambda solution, model: self._store_vision(image_hash, upload, solution, model, started)
+            )
+        )
+        if not solution:
+            return None
+
+        return {'solution': solution, 'model': model, 'cached': False, 'cache_type': None}
+
+    def stream_image(self, image: Union[bytes, ImageUpload]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        流式图片解题
+
+        Args:
+            image: 上传图片或图片原始字节
+
+        Yields:
+            (事件名, 数据) 元组，事件依次为 meta、若干 delta、done；失败时为 error
+
+        Raises:
+            AIServiceAPIError: 当API调用失败时抛出
+            AIServiceConnectionError: 当网络连接失败时抛出
+        """
+        upload = _as_upload(image)
+        hit, image_hash = self._lookup_image(upload)
+        if hit:
+            yield from self._replay(hit)
+            return
+
+        if self.two_stage_vision:
+            problem = self._transcribe(upload, image_hash)
+            if problem:
+                state: Dict[str, Any] = {'parts': []}
+                for event, data in self.stream_text(problem):
+                    yield self._transcribed_event(event, data, problem, image_hash, state)
+                return
+
+        origin: Dict[str, Any] = {}
+        started = time.perf_counter()
+        pieces = self.single_flight.stream(
+            self._image_key(image_hash, upload),
+            lambda: self._stored(
+                track_stream(self.vision_service.stream_solve_problem_with_image(*self._prepare_image(upload)), origin),
+                origin, self.vision_service,
+                lambda solution, model: self._store_vision(image_hash, upload, solution, model, started)
+            ),
+            origin
+        )
+        parts = []
+        for piece in pieces:
+            if not parts:
+                yield 'meta', self._meta(origin, self.vision_service)
+            parts.append(piece)
+            yield 'delta', {'content': piece}
+
+        solution = ''.join(parts)
+        if not solution.strip():
+            if not parts:
+                yield 'meta', self._meta(origin, self.vision_service)
+            yield 'error', {'error': '无法获取解答，请检查API配置'}
+            return
+
+        yield 'done', {'cached': False}
+
+    # ==================== 异步版本（ASGI服务模式） ====================
+
+    async def asolve_text(self, problem: str, source: str = 'text') -> Optional[Dict[str, Any]]:
+        """solve_text 的异步版本"""
+        hit = self._lookup_text(problem)
+        if hit:
+            return hit
+
+        started = time.perf_counter()
+        solution, model = await self.single_flight.ado(
+            self._text_key(problem),
+            lambda: self._asolved(
+                lambda: self.text_service.asolve_problem(problem), self.text_service,
+                lambda solution, model: self._store_text(problem, solution, model, started, source)
+            )
+        )
+        if not solution:
+            return None
+
+        return {'solution': solution, 'model': model, 'cached': False, 'cache_type': None, **self._tier(model)}
+
+    async def astream_text(self, problem: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """stream_text 的异步版本"""
+        hit = self._lookup_text(problem)
+        if hit:
+            for item in self._replay(hit):
+                yield item
+            return
+
+        origin: Dict[str, Any] = {}
+        parts = []
+        started = time.perf_counter()
+        pieces = self.single_flight.astream(
+            self._text_key(problem),
+            lambda: self._astored(
+                atrack_stream(self.text_service.astream_solve_problem(problem), origin), origin, self.text_service,
+                lambda solution, model: self._store_text(problem, solution, model, started)
+            ),
+            origin
+        )
+        async for piece in pieces:
+            if not parts:
+                yield 'meta', self._meta(origin, self.text_service)
+            parts.append(piece)
+            yield 'delta', {'content': piece}
+
+        solution = ''.join(parts)
+        if not solution.strip():
+            if not parts:
+                yield 'meta', self._meta(origin, self.text_service)
+            yield 'error', {'error': '无法获取解答，请检查API配置'}
+            return
+
+        yield 'done', {'cached': False}
+
+    async def asolve_image(self, image: Union[bytes, ImageUpload]) -> Optional[Dict[str, Any]]:
+        """solve_image 的异步版本，图片哈希、预处理与编码在线程池中执行，不阻塞事件循环"""
+        upload = _as_upload(image)
+        hit, image_hash = await asyncio.to_thread(self._lookup_image, upload)
+        if hit:
+            return hit
+
+        if self.two_stage_vision:
+            problem = await self._atranscribe(upload, image_hash)
+            if problem:
+                result = await self.asolve_text(problem)
+                if not result:
+                    return None
+                self._store_image(image_hash, result['solution'], result['model'], problem)
+                return {**result, 'problem': problem}
+
+        async def call_upstream():
+            image_base64, mime_type = await asyncio.to_thread(self._prepare_image, upload)
+            return await self.vision_service.asolve_problem_with_image(image_base64, mime_type)
+
+        started = time.perf_counter()
+        solution, model = await self.single_flight.ado(
+            self._image_key(image_hash, upload),
+            lambda: self._asolved(
+                call_upstream, self.vision_service,
+                lambda solution, model: self._store_vision(image_hash, upload, solution, model, started)
+            )
+        )
+        if not solution:
+            return None
+
+        return {'solution': solution, 'model': model, 'cached': False, 'cache_type': None}
+
+    async def astream_image(self, image: Union[bytes, ImageUpload]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """stream_image 的异步版本"""
+        upload = _as_upload(image)
+        hit, image_hash = await asyncio.to_thread(self._lookup_image, upload)
+        if hit:
+            for item in self._replay(hit):
+                yield item
+            return
+
+        if self.two_stage_vision:
+            problem = await self._atranscribe(upload, image_hash)
+            if problem:
+                state: Dict[str, Any] = {'parts': []}
+                async for event, data in self.astream_text(problem):
+                    yield self._transcribed_event(event, data, problem, image_hash, state)
+                return
+
+        async def call_upstream():
+            image_base64, mime_type = await asyncio.to_thread(self._prepare_image, upload)
+            async for chunk in self.vision_service.astream_solve_problem_with_image(image_base64, mime_type):
+                yield chunk
+
+        origin: Dict[str, Any] = {}
+        parts = []
+        started = time.perf_counter()
+        pieces = self.single_flight.astream(
+            self._image_key(image_hash, upload),
+            lambda: self._astored(
+                atrack_stream(call_upstream(), origin), origin, self.vision_service,
+                lambda solution, model: self._store_vision(image_hash, upload, solution, model, started)
+            ),
+            origin
+        )
+        async for piece in pieces:
+            if not parts:
+                yield 'meta', self._meta(origin, self.vision_service)
+            parts.append(piece)
+            yield 'delta', {'content': piece}
+
+        solution = ''.join(parts)
+        if not solution.strip():
+            if not parts:
+                yield 'meta', self._meta(origin, self.vision_service)
+            yield 'error', {'error': '无法获取解答，请检查API配置'}
+            return
+
+        yield 'done', {'cached': False}
+
+    # ==================== 两段式图片解题 ====================
+
+    def _transcribe(self, upload: ImageUpload, image_hash: Optional[ImageHash]) -> Optional[str]:
+        """由视觉模型将图片中的题目转写为文字，相同图片的并发请求只转写一次"""
+        return self.single_flight.do(
+            'transcribe:' + self._image_key(image_hash, upload),
+            lambda: self.vision_service.transcribe_image(*self._prepare_image(upload))
+        )
+
+    async def _atranscribe(self, upload: ImageUpload, image_hash: Optional[ImageHash]) -> Optional[str]:
+        """_transcribe 的异步版本"""
+        async def call_upstream():
+            image_base64, mime_type = await asyncio.to_thread(self._prepare_image, upload)
+            return await self.vision_service.atranscribe_image(image_base64, mime_type)
+
+        return await self.single_flight.ado('transcribe:' + self._image_key(image_hash, upload), call_upstream)
+
+    def _transcribed_event(self, event: str, data: Dict[str, Any], problem: str,
+                           image_hash: Optional[ImageHash], state: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """
+        转换转写后文字解题的流式事件：meta 中附上识别出的题目，
+        收集增量片段与给出解答的模型，并在 done 时写入图片缓存
+        """
+        if event == 'meta':
+            state['model'] = data['model']
+            return event, {**data, 'problem': problem}
+        if event == 'delta':
+            state['parts'].append(data['content'])
+        elif event == 'done':
+            self._store_image(image_hash, ''.join(state['parts']), state.get('model'), problem)
+        return event, data
+
+    # ==================== 批量解题 ====================
+
+    def solve_batch(self, items: List[Union[str, ImageUpload]],
+                    concurrency: int = 16) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+        """
+        批量解题，相同题目只解一次，其余题目在有界线程池中并发执行
+
+        Args:
+            items: 题目文本或上传图片列表
+            concurrency: 最大并发数
+
+        Yields:
+            (题目序号, 结果字典, 错误信息)，按完成顺序产出；单题失败只影响该题（及与其相同的题目）
+        """
+        groups = self._batch_groups(items)
+        if not groups:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(groups))),
+                                      thread_name_prefix='solve-batch')
+        try:
+            # 复制上下文，使指标路由标签与上游优先级在工作线程中同样生效
+            futures = {
+                executor.submit(contextvars.copy_context().run, self._solve_one, item): indices
+                for item, indices in groups
+            }
+            for future in as_completed(futures):
+                result, error = future.result()
+                for index in futures[future]:
+                    yield index, result, error
+        finally:
+            # 客户端中途断开时不再启动排队中的题目
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def asolve_batch(self, items: List[Union[str, ImageUpload]],
+                           concurrency: int = 16) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+        """solve_batch 的异步版本，并发数由信号量限制"""
+        groups = await asyncio.to_thread(self._batch_groups, items)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def solve(item: Union[str, ImageUpload], indices: List[int]):
+            async with semaphore:
+                try:
+                    if isinstance(item, str):
+                        result = await self.asolve_text(item)
+                    else:
+                        result = await self.asolve_image(item)
+                except Exception as e:
+                    return indices, None, str(e)
+            if not result:
+                return indices, None, '无法获取解答，请检查API配置'
+            return indices, result, None
+
+        tasks = [asyncio.ensure_future(solve(item, indices)) for item, indices in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indices, result, error = await next_done
+                for index in indices:
+                    yield index, result, error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _batch_groups(self, items: List[Union[str, ImageUpload]]) -> List[Tuple[Union[str, ImageUpload], List[int]]]:
+        """按题目去重：文字按规范化文本，图片按内容摘要；返回 (题目, 原始序号列表)"""
+        groups: Dict[str, Tuple[Union[str, ImageUpload], List[int]]] = {}
+        for index, item in enumerate(items):
+            key = self._text_key(item) if isinstance(item, str) else 'image:' + item.digest()
+            if key in groups:
+                groups[key][1].append(index)
+            else:
+                groups[key] = (item, [index])
+        return list(groups.values())
+
+    def _solve_one(self, item: Union[str, ImageUpload]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """解一道题，异常转为错误信息"""
+        try:
+            result = self.solve_text(item) if isinstance(item, str) else self.solve_image(item)
+        except Exception as e:
+            return None, str(e)
+        if not result:
+            return None, '无法获取解答，请检查API配置'
+        return result, None
+
+    # ==================== 缓存读写 ====================
+
+    def _scope(self, model: str) -> str:
+        return f"{model}|{self.prompt_version}"
+
+    @staticmethod
+    def _tracked(call: Callable[[], Optional[str]]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """调用上游并返回 (解答, 解答来源)，供合并的并发请求共享实际给出解答的模型"""
+        with track_answer() as origin:
+            solution = call()
+        return solution, dict(origin)
+
+    @staticmethod
+    async def _atracked(call: Callable[[], Awaitable[Optional[str]]]) -> Tuple[Optional[str], Dict[str, Any]]:
+        """_tracked 的异步版本"""
+        with track_answer() as origin:
+            solution = await call()
+        return solution, dict(origin)
+
+    def _solved(self, call: Callable[[], Optional[str]], service: Union[AIService, ProviderPool, CascadeService],
+                store: Callable[[str, str], None]) -> Tuple[Optional[str], str]:
+        """
+        调用上游并写入缓存，返回 (解答, 给出解答的模型)
+
+        在 single_flight 合并的闭包内执行，并发的相同请求只写入一次缓存和解题记录
+        """
+        solution, origin = self._tracked(call)
+        model = self._answered_by(origin, service)
+        if solution:
+            store(solution, model)
+        return solution, model
+
+    async def _asolved(self, call: Callable[[], Awaitable[Optional[str]]],
+                       service: Union[AIService, ProviderPool, CascadeService],
+                       store: Callable[[str, str], None]) -> Tuple[Optional[str], str]:
+        """_solved 的异步版本"""
+        solution, origin = await self._atracked(call)
+        model = self._answered_by(origin, service)
+        if solution:
+            store(solution, model)
+        return solution, model
+
+    def _stored(self, chunks: Iterator[str], origin: Dict[str, Any],
+                service: Union[AIService, ProviderPool, CascadeService],
+                store: Callable[[str, str], None]) -> Iterator[str]:
+        """转发上游片段，完整生成后写入缓存（上游中途失败时不写入）"""
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        solution = ''.join(parts)
+        if solution.strip():
+            store(solution, self._answered_by(origin, service))
+
+    async def _astored(self, chunks: AsyncIterator[str], origin: Dict[str, Any],
+                       service: Union[AIService, ProviderPool, CascadeService],
+                       store: Callable[[str, str], None]) -> AsyncIterator[str]:
+        """_stored 的异步版本"""
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        solution = ''.join(parts)
+        if solution.strip():
+            store(solution, self._answered_by(origin, service))
+
+    @staticmethod
+    def _answered_by(origin: Dict[str, Any], service: Union[AIService, ProviderPool, CascadeService]) -> str:
+        """实际给出解答的模型，来源未知时为服务的主模型"""
+        return origin.get('model') or service.model
+
+    def _meta(self, origin: Dict[str, Any], service: Union[AIService, ProviderPool, CascadeService]) -> Dict[str, Any]:
+        """调用上游时流式响应的 meta 事件"""
+        model = self._answered_by(origin, service)
+        meta = {'model': model, 'cached': False, 'cache_type': None}
+        if service is self.text_service:
+            meta.update(self._tier(model))
+        return meta
+
+    def _tier(self, model: str) -> Dict[str, Any]:
+        """开启模型分级时，文字解答结果中附带给出解答的级别（tier: fast / strong）"""
+        if isinstance(self.text_service, CascadeService):
+            return {'tier': self.text_service.tier_of(model)}
+        return {}
+
+    def _prepare_image(self, upload: ImageUpload) -> Tuple[str, str]:
+        """
+        预处理并编码待发送给视觉模型的图片（仅在缓存未命中时执行）
+
+        Returns:
+            (Base64编码, MIME类型)
+        """
+        data = None
+        mime_type = upload.mime_type
+        if self.image_preprocessor is not None:
+            with metrics.stage('preprocess'):
+                result = self.image_preprocessor.process(upload.open())
+            if result['data'] is not None:
+                data, mime_type = result['data'], result['mime_type']
+
+        with metrics.stage('encode'):
+            image_base64 = base64.b64encode(data).decode('utf-8') if data is not None else upload.to_base64()
+        metrics.IMAGE_BYTES.inc('in', amount=upload.size)
+        metrics.IMAGE_BYTES.inc('out', amount=len(data) if data is not None else upload.size)
+        return image_base64, mime_type
+
+    def _text_key(self, problem: str) -> str:
+        """文字题目的合并键（与缓存键一致，基于规范化文本）"""
+        return 'text:' + make_cache_key(problem, self.text_service.model, self.prompt_version)
+
+    def _image_key(self, image_hash: Optional[ImageHash], upload: ImageUpload) -> str:
+        """图片题目的合并键，优先使用感知哈希，无法计算时退化为内容摘要"""
+        if image_hash is not None:
+            return f"image:{self.vision_service.model}:{image_hash.coarse:016x}"
+        return f"image:{self.vision_service.model}:" + upload.digest()
+
+    def _lookup_text(self, problem: str) -> Optional[Dict[str, Any]]:
+        """
+        依次查询精确缓存和相似题目索引
+
+        解答按实际给出解答的模型缓存，文字服务可能使用的每个模型（如多后端路由中的各后端）的解答都可命中
+        """
+        models = self.text_service.models
+
+        if self.cache is not None:
+            for model in models:
+                solution = self.cache.get(make_cache_key(problem, model, self.prompt_version))
+                if solution:
+                    return {'solution': solution, 'model': model, 'cached': True, 'cache_type': 'exact',
+                            **self._tier(model)}
+
+        if self.similarity_index is not None:
+            scopes = {self._scope(model): model for model in models}
+            match = self.similarity_index.lookup(problem, scopes.keys())
+            if match:
+                model = scopes[match['scope']]
+                if self.cache is not None:
+                    self.cache.set(make_cache_key(problem, model, self.prompt_version), match['solution'])
+                return {
+                    'solution': match['solution'],
+                    'model': model,
+                    'cached': True,
+                    'cache_type': 'similar',
+                    'similarity': match['similarity'],
+                    **self._tier(model)
+                }
+        return None
+
+    def _store_text(self, problem: str, solution: str, model: str, started: Optional[float] = None,
+                    source: str = 'text') -> None:
+        """
+        按给出解答的模型写入精确缓存和相似题目索引，并登记解题记录（started 为开始调用上游的时刻）
+        """
+        key = make_cache_key(problem, model, self.prompt_version)
+        if self.cache is not None:
+            self.cache.set(key, solution)
+        if self.similarity_index is not None:
+            self.similarity_index.add(problem, solution, self._scope(model))
+        self._record(key, problem, solution, model, source, started)
+
+    def _record(self, key: str, problem: str, solution: str, model: str, source: str,
+                started: Optional[float] = None) -> None:
+        """登记解题记录（只放入写入队列）"""
+        if self.store is not None:
+            elapsed_ms = (time.perf_counter() - started) * 1000 if started is not None else None
+            self.store.record(key, problem, solution, model, self.prompt_version, source, elapsed_ms)
+
+    def _lookup_image(self, upload: ImageUpload) -> Tuple[Optional[Dict[str, Any]], Optional[ImageHash]]:
+        """
+        查询图片缓存
+
+        Returns:
+            (命中结果, 图片哈希)，未启用图片缓存或图片无法解码时哈希为None
+        """
+        if self.image_cache is None:
+            return None, None
+
+        image_hash = self.image_cache.compute_hash(upload.open())
+        if image_hash is None:
+            return None, None
+
+        match = self.image_cache.lookup(image_hash, self._image_scope())
+        if not match:
+            return None, image_hash
+
+        # 两段式解题的解答来自文字服务；解答模型已不在当前服务可用的模型中时视为未命中
+        service = self.text_service if match['problem'] else self.vision_service
+        if match['model'] is not None and match['model'] not in service.models:
+            return None, image_hash
+
+        hit = {
+            'solution': match['solution'],
+            'model': match['model'] or service.model,
+            'cached': True,
+            'cache_type': 'image',
+            'distance': match['distance']
+        }
+        if match['problem']:
+            hit['problem'] = match['problem']
+            hit.update(self._tier(hit['model']))
+        return hit, image_hash
+
+    def _store_image(self, image_hash: Optional[ImageHash], solution: str, model: Optional[str],
+                     problem: Optional[str] = None) -> None:
+        """写入图片缓存，model 为给出解答的模型，problem 为两段式解题时识别出的题目文本"""
+        if self.image_cache is not None and image_hash is not None:
+            self.image_cache.add(image_hash, solution, self._image_scope(), problem, model)
+
+    def _store_vision(self, image_hash: Optional[ImageHash], upload: ImageUpload, solution: str, model: str,
+                      started: Optional[float] = None) -> None:
+        """写入视觉模型直接给出的解答并登记解题记录"""
+        self._store_image(image_hash, solution, model)
+        self._record(self._image_key(image_hash, upload), '', solution, model, 'image', started)
+
+    def _image_scope(self) -> str:
+        """图片缓存的作用域：两段式解题的解答来自文字模型，与视觉模型直接解答的结果分开缓存"""
+        if self.two_stage_vision:
+            return f"{self.vision_service.model}>{self.text_service.model}|{self.prompt_version}"
+        return self._scope(self.vision_service.model)
+
+    def _replay(self, hit: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """将缓存命中结果转换为流式事件"""
+        meta = {'model': hit['model'], 'cached': True, 'cache_type': hit['cache_type']}
+        if 'tier' in hit:
+            meta['tier'] = hit['tier']
+        if hit.get('problem'):
+            meta['problem'] = hit['problem']
+        yield 'meta', meta
+        yield 'delta', {'content': hit['solution']}
+        yield 'done', {'cached': True}
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        return {
+            'solution_cache': self.cache.stats() if self.cache is not None else None,
+            'similarity_index': self.similarity_index.stats() if self.similarity_index is not None else None,
+            'image_cache': self.image_cache.stats() if self.image_cache is not None else None,
+            'single_flight': self.single_flight.stats(),
+            'image_preprocess': self.image_preprocessor.stats() if self.image_preprocessor is not None else None,
+            'problem_store': self.store.stats() if self.store is not None else None
+        }
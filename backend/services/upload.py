@@ -0,0 +1,127 @@
+"""
+上传图片处理模块
+上传文件按块接收：超过阈值的部分写入临时文件，格式只根据首块的魔数判断，
+Base64按块增量编码，避免同一张图片在内存中同时保留原始字节、Base64字节和字符串多份完整副本
+"""
+
+import base64
+import hashlib
+import io
+import tempfile
+from typing import Optional, BinaryIO, Callable, Iterator, List
+
+
+# 分块大小，取3的倍数使各块的Base64编码可以直接拼接
+CHUNK_SIZE = 3 * 64 * 1024
+
+# 魔数长度，足以区分支持的图片格式
+SNIFF_SIZE = 16
+
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png')
+)
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """
+    根据文件头魔数判断图片格式
+
+    Args:
+        head: 文件开头的若干字节
+
+    Returns:
+        MIME类型，不是支持的图片格式时返回None
+    """
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    return None
+
+
+def make_stream_factory(max_memory: int) -> Callable[..., BinaryIO]:
+    """
+    创建表单文件的存储工厂（兼容 werkzeug 的 stream_factory 签名）
+
+    Args:
+        max_memory: 内存中最多保留的字节数，超出后转存到临时文件
+
+    Returns:
+        存储工厂函数
+    """
+    def stream_factory(total_content_length=None, content_type=None, filename=None,
+                       content_length=None) -> BinaryIO:
+        return tempfile.SpooledTemporaryFile(max_size=max_memory, mode='rb+')  # type: ignore[return-value]
+    return stream_factory
+
+
+class ImageUpload:
+    """已接收的上传图片，内容保存在可回读的文件对象中，按需分块读取"""
+
+    def __init__(self, stream: BinaryIO, mime_type: str, size: int):
+        """
+        Args:
+            stream: 可定位的二进制文件对象
+            mime_type: 图片MIME类型
+            size: 图片字节数
+        """
+        self.stream = stream
+        self.mime_type = mime_type
+        self.size = size
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO) -> Optional['ImageUpload']:
+        """
+        包装已接收的上传文件，只读取文件头做格式校验
+
+        Returns:
+            上传图片，不是支持的图片格式时返回None
+        """
+        stream.seek(0)
+        mime_type = sniff_image_type(stream.read(SNIFF_SIZE))
+        if mime_type is None:
+            return None
+        size = stream.seek(0, io.SEEK_END)
+        stream.seek(0)
+        return cls(stream, mime_type, size)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ImageUpload':
+        """包装内存中的图片字节，无法识别格式时按JPEG处理"""
+        return cls(io.BytesIO(data), sniff_image_type(data[:SNIFF_SIZE]) or 'image/jpeg', len(data))
+
+    def open(self) -> BinaryIO:
+        """返回定位到开头的文件对象"""
+        self.stream.seek(0)
+        return self.stream
+
+    def chunks(self, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """从头按块读取图片内容"""
+        stream = self.open()
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def read(self) -> bytes:
+        """读取完整图片字节"""
+        return self.open().read()
+
+    def digest(self) -> str:
+        """图片内容的SHA-256摘要（分块计算，结果缓存）"""
+        if self._digest is None:
+            sha = hashlib.sha256()
+            for chunk in self.chunks():
+                sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    def to_base64(self) -> str:
+        """分块增量编码为Base64字符串，不在内存中保留完整的原始字节"""
+        parts: List[str] = [base64.b64encode(chunk).decode('ascii') for chunk in self.chunks()]
+        return ''.join(parts)
+
+    def close(self) -> None:
+        self.stream.close()
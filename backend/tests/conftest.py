@@ -0,0 +1,13 @@
+"""
+单元测试公共配置
+测试直接导入 backend 下的服务模块，不启动HTTP服务、不调用上游接口
+
+运行方式：
+    cd backend
+    python -m pytest -q
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,116 @@
+"""模型分级：按实际给出解答的级别返回模型并分开缓存"""
+
+from services.ai_service import note_answer
+from services.cascade import CascadeService, score_solution
+from services.solution_cache import MemorySolutionCache, make_cache_key
+from services.solver import ProblemSolver
+
+
+class FakeService:
+    def __init__(self, model, solution):
+        self.model = model
+        self.api_base = f'http://{model}.invalid/v1'
+        self.solution = solution
+        self.calls = 0
+
+    @property
+    def models(self):
+        return [self.model]
+
+    def solve_problem(self, problem):
+        self.calls += 1
+        note_answer(model=self.model)
+        return self.solution
+
+    def stream_solve_problem(self, problem):
+        yield self.solve_problem(problem)
+
+
+CONFIDENT = '**问题分析**：直接计算即可得到结果。\n**最终答案**：7'
+HEDGING = '**问题分析**：题目信息不足，无法判断。\n**最终答案**：无法确定'
+
+
+def _cascade(fast_solution):
+    fast = FakeService('fast-model', fast_solution)
+    strong = FakeService('strong-model', '**问题分析**：按公式计算面积。\n**最终答案**：12平方厘米')
+    return CascadeService(fast, strong, threshold=0.6), fast, strong
+
+
+def test_score_solution():
+    assert score_solution('3 + 4', CONFIDENT) == 1.0
+    assert score_solution('3 + 4', CONFIDENT.replace('7', '8')) < 0.6
+    assert score_solution('求三角形面积', HEDGING) < 0.6
+    assert score_solution('求三角形面积', '没有最终答案') == 0.0
+
+
+def test_score_requires_concrete_answer():
+    analysis = '**问题分析**：列出所有等可能的结果，再数出满足条件的情况。\n'
+    # 概率题中的“可能性”不是不确定措辞
+    assert score_solution('掷骰子得到3的倍数的概率', analysis + '**最终答案**：得到3的倍数的可能性为1/3') == 1.0
+    assert score_solution('下列说法正确的是', analysis + '**最终答案**：B') == 1.0
+    assert score_solution('求三角形面积', analysis + '**最终答案**：见上文分析') < 0.6
+
+
+def test_unconvincing_fast_answers_escalate():
+    for fast_solution in ('**问题分析**：按公式计算即可，过程略。\n**最终答案**：如上所述',
+                          '三角形面积为底乘高除以二，等于12平方厘米。',
+                          '**问题分析**：直接计算即可得到结果。\n**最终答案**：8'):
+        cascade, fast, strong = _cascade(fast_solution)
+        assert cascade.solve_problem('3 + 4') == strong.solution
+        assert fast.calls == 1 and strong.calls == 1
+        assert cascade.status()['decisions'] == {'accepted': 0, 'escalated': 1, 'direct': 0}
+
+
+def test_fast_failure_escalates():
+    cascade, fast, strong = _cascade(CONFIDENT)
+
+    def failing(problem):
+        fast.calls += 1
+        raise RuntimeError('小模型不可用')
+
+    fast.solve_problem = failing
+    assert ''.join(cascade.stream_solve_problem('3 + 4')) == strong.solution
+    assert fast.calls == 1 and strong.calls == 1
+    assert cascade.status()['decisions']['escalated'] == 1
+
+
+def test_fast_answer_reports_and_caches_fast_tier():
+    cascade, fast, strong = _cascade(CONFIDENT)
+    cache = MemorySolutionCache(100, 0)
+    solver = ProblemSolver(cascade, strong, cache=cache)
+
+    result = solver.solve_text('3 + 4')
+    assert result['model'] == 'fast-model'
+    assert result['tier'] == 'fast'
+    assert strong.calls == 0
+    assert cache.get(make_cache_key('3 + 4', 'fast-model', 'v1')) == CONFIDENT
+    assert cache.get(make_cache_key('3 + 4', 'strong-model', 'v1')) is None
+
+    hit = solver.solve_text('3 + 4')
+    assert hit['cached'] is True
+    assert hit['model'] == 'fast-model' and hit['tier'] == 'fast'
+
+    # 未开启分级、只使用主模型的配置共用同一缓存时不会命中小模型的答案
+    strong_only = ProblemSolver(strong, strong, cache=cache)
+    result = strong_only.solve_text('3 + 4')
+    assert result['cached'] is False
+    assert result['model'] == 'strong-model'
+    assert 'tier' not in result
+
+
+def test_escalated_answer_reports_strong_tier():
+    cascade, fast, strong = _cascade(HEDGING)
+    solver = ProblemSolver(cascade, strong, cache=MemorySolutionCache(100, 0))
+    result = solver.solve_text('求三角形面积')
+    assert fast.calls == 1 and strong.calls == 1
+    assert result['model'] == 'strong-model'
+    assert result['tier'] == 'strong'
+    assert cascade.status()['decisions']['escalated'] == 1
+
+
+def test_stream_meta_reports_fast_tier():
+    cascade, _, strong = _cascade(CONFIDENT)
+    solver = ProblemSolver(cascade, strong)
+    events = list(solver.stream_text('3 + 4'))
+    assert events[0] == ('meta', {'model': 'fast-model', 'cached': False, 'cache_type': None, 'tier': 'fast'})
+    assert events[-1] == ('done', {'cached': False})
@@ -0,0 +1,73 @@
+"""上游健康探测：只请求 /models，熔断中不发起请求"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services.ai_service import AIService, CircuitBreaker
+from services.health import HealthProbe
+
+
+class _Upstream(BaseHTTPRequestHandler):
+    paths = []
+    status = 200
+
+    def do_GET(self):
+        type(self).paths.append(self.path)
+        body = json.dumps({'object': 'list', 'data': [{'id': 'test-model', 'object': 'model'}]}).encode()
+        self.send_response(type(self).status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    _Upstream.paths, _Upstream.status = [], 200
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Upstream)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+    server.server_close()
+
+
+def test_probe_only_lists_models(upstream):
+    service = AIService('key', upstream, 'test-model')
+    probe = HealthProbe({'text': service}, interval=0)
+    probe.probe_all()
+
+    result = probe.status()['text']
+    assert result['status'] == 'ok'
+    assert result['model'] == 'test-model'
+    assert _Upstream.paths == ['/v1/models']
+
+
+def test_missing_models_endpoint_counts_as_reachable(upstream):
+    _Upstream.status = 404
+    assert AIService('key', upstream, 'test-model').probe()['status'] == 'ok'
+
+
+def test_auth_failure_is_reported(upstream):
+    _Upstream.status = 401
+    result = AIService('key', upstream, 'test-model').probe()
+    assert result['status'] == 'error'
+    assert result['error']
+
+
+def test_open_circuit_skips_request(upstream):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    service = AIService('key', upstream, 'test-model', circuit_breaker=breaker)
+    result = service.probe()
+    assert result['status'] == 'circuit_open'
+    assert 0 < result['retry_after'] <= 60
+    assert _Upstream.paths == []
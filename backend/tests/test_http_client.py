@@ -0,0 +1,75 @@
+"""共享HTTP连接池：连接复用与进行中请求计数"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services.http_client import HTTPClientFactory
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_reuse_connection(url):
+    factory = HTTPClientFactory()
+    for _ in range(3):
+        assert factory.client.get(url).text == 'ok'
+
+    stats = factory.stats()
+    assert stats['requests'] == 3
+    assert stats['connections_opened'] == 1
+    assert stats['in_flight'] == 0
+    assert stats['peak_in_flight'] == 1
+    assert stats['sync_pool']['connections'] == 1
+    assert stats['async_pool'] is None
+    factory.close()
+
+
+def test_in_flight_counts_open_streams(url):
+    factory = HTTPClientFactory()
+    with factory.client.stream('GET', url):
+        assert factory.stats()['in_flight'] == 1
+    assert factory.stats()['in_flight'] == 0
+    factory.close()
+
+
+def test_connect_error_is_counted():
+    factory = HTTPClientFactory(connect_timeout=1.0)
+    with pytest.raises(Exception):
+        factory.client.get('http://127.0.0.1:9/')
+    stats = factory.stats()
+    assert stats['connect_errors'] == 1
+    assert stats['in_flight'] == 0
+    factory.close()
+
+
+def test_pool_stats_tolerates_unexpected_internals():
+    class Transport:
+        _pool = object()
+
+    class Client:
+        _transport = Transport()
+
+    assert HTTPClientFactory._pool_stats(Client()) is None
@@ -0,0 +1,94 @@
+"""图片感知哈希缓存：EXIF方向、近似命中与复核、作用域与统计"""
+
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+from services.image_cache import ImageHash, ImageHashCache, dhash, image_hash
+
+
+SCOPE = 'vision-model|v1'
+
+
+def _page(seed):
+    """模拟一页题目：白底上若干行随机长度的文字块"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (600, 800), 'white')
+    draw = ImageDraw.Draw(image)
+    for row in range(10):
+        x = 40
+        while x < 560:
+            width = rng.randint(10, 60)
+            draw.rectangle((x, 60 + row * 70, x + width, 90 + row * 70), fill='black')
+            x += width + rng.randint(8, 30)
+    return image
+
+
+def _jpeg(image, quality=85, exif=None):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, **({'exif': exif} if exif is not None else {}))
+    return buffer.getvalue()
+
+
+def test_exif_orientation_is_applied():
+    page = _page(1)
+    # 以传感器方向保存、EXIF记录需顺时针旋转90度（Orientation=6）的照片
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    rotated = _jpeg(page.transpose(Image.Transpose.ROTATE_90), exif=exif.tobytes())
+    assert (dhash(rotated) ^ dhash(_jpeg(page))).bit_count() <= 4
+
+
+def test_recompressed_photo_hits():
+    cache = ImageHashCache()
+    page = _page(2)
+    cache.add(cache.compute_hash(_jpeg(page)), '解答', SCOPE, model='vision-model')
+
+    smaller = page.resize((300, 400))
+    match = cache.lookup(cache.compute_hash(_jpeg(smaller, quality=50)), SCOPE)
+    assert match is not None
+    assert match['solution'] == '解答' and match['model'] == 'vision-model'
+    assert cache.lookup(cache.compute_hash(_jpeg(page)), 'other-model|v1') is None
+
+
+def test_verify_hash_rejects_coarse_collision():
+    cache = ImageHashCache(max_distance=4, max_verify_distance=16)
+    cache.add(ImageHash(0b1011, (1 << 256) - 1), '第一页的解答', SCOPE)
+
+    # 64位哈希只差1位，但256位哈希完全不同：视为不同图片
+    assert cache.lookup(ImageHash(0b1010, 0), SCOPE) is None
+    assert cache.lookup(ImageHash(0b1010, (1 << 256) - 1), SCOPE)['distance'] == 1
+
+    stats = cache.stats()
+    assert stats['lookups'] == 2
+    assert stats['hits'] == 1
+    assert stats['rejected'] == 1
+
+
+def test_different_pages_miss():
+    cache = ImageHashCache()
+    for seed in range(10):
+        cache.add(image_hash(_jpeg(_page(seed))), f'解答{seed}', SCOPE)
+    for seed in range(10, 20):
+        assert cache.lookup(image_hash(_jpeg(_page(seed))), SCOPE) is None
+
+
+def test_lru_eviction():
+    cache = ImageHashCache(max_entries=2)
+    hashes = [ImageHash(value, value) for value in (0, 0x5555555555555555, (1 << 64) - 1)]
+    for value in hashes:
+        cache.add(value, '解答', SCOPE)
+    assert cache.lookup(hashes[0], SCOPE) is None
+    assert cache.lookup(hashes[2], SCOPE) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_repeated_add_replaces_entry():
+    cache = ImageHashCache()
+    value = ImageHash(0b1010, 0b1010)
+    cache.add(value, '旧解答', SCOPE)
+    cache.add(value, '新解答', SCOPE, problem='题目')
+    cache.add(value, '另一作用域', 'other|v1')
+    assert cache.stats()['size'] == 2
+    assert cache.lookup(value, SCOPE)['solution'] == '新解答'
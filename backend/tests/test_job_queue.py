@@ -0,0 +1,192 @@
+"""异步解题任务：任务生命周期、过载重试、SQLite领取与回调地址校验"""
+
+import http.server
+import threading
+import time
+
+from services.ai_service import AIServiceRateLimitError
+from services.job_queue import (
+    FAILED, QUEUED, SUCCEEDED, JobQueue, JobQueueFullError, SQLiteJobStore, Job, is_valid_webhook
+)
+
+
+class FakeSolver:
+    """按预设结果依次返回的解题调度器"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def solve_text(self, problem):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _answer(solution='x = 2'):
+    return {'solution': solution, 'model': 'test-model', 'cached': False, 'cache_type': None}
+
+
+def _wait(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job is not None and job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'任务 {job_id} 未在 {timeout} 秒内结束')
+
+
+def test_job_lifecycle_succeeds():
+    queue = JobQueue(FakeSolver(_answer()), workers=1)
+    job = queue.submit_text('2x = 4')
+    assert job.status == QUEUED
+    queue.start()
+    try:
+        job = _wait(queue, job.id)
+    finally:
+        queue.stop(1.0)
+    assert job.status == SUCCEEDED
+    assert job.result['solution'] == 'x = 2'
+    assert job.result['model'] == 'test-model'
+    assert job.attempts == 1
+    assert queue.stats()['succeeded'] == 1
+
+
+def test_job_retries_after_rate_limit():
+    solver = FakeSolver(AIServiceRateLimitError('busy'), _answer())
+    queue = JobQueue(solver, workers=1, retry_delay=0.01)
+    queue.start()
+    try:
+        job = _wait(queue, queue.submit_text('2x = 4').id)
+    finally:
+        queue.stop(1.0)
+    assert job.status == SUCCEEDED
+    assert job.attempts == 2
+    assert solver.calls == 2
+
+
+def test_job_fails_after_max_attempts():
+    solver = FakeSolver(*[AIServiceRateLimitError('busy')] * 3)
+    queue = JobQueue(solver, workers=1, retry_delay=0.01, max_attempts=2)
+    queue.start()
+    try:
+        job = _wait(queue, queue.submit_text('2x = 4').id)
+    finally:
+        queue.stop(1.0)
+    assert job.status == FAILED
+    assert job.attempts == 2
+    assert 'busy' in job.error
+
+
+def test_stop_requeues_job_waiting_for_retry(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    solver = FakeSolver(AIServiceRateLimitError('busy'))
+    queue = JobQueue(solver, store=SQLiteJobStore(path), workers=1, retry_delay=30)
+    job = queue.submit_text('2x = 4')
+    queue.start()
+    deadline = time.monotonic() + 5
+    while solver.calls == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.stop(1.0)
+
+    # 停止时正在等待重试的任务不标记为失败，重启后继续执行
+    assert queue.get(job.id).status == QUEUED
+    assert queue.stats()['failed'] == 0
+    restarted = JobQueue(FakeSolver(_answer()), store=SQLiteJobStore(path), workers=1)
+    restarted.start()
+    try:
+        assert _wait(restarted, job.id).status == SUCCEEDED
+    finally:
+        restarted.stop(1.0)
+
+
+def test_submit_rejects_when_queue_full():
+    queue = JobQueue(FakeSolver(), workers=1, max_queue=1)
+    queue.submit_text('a')
+    try:
+        queue.submit_text('b')
+    except JobQueueFullError:
+        pass
+    else:
+        raise AssertionError('排队任务超过上限时应拒绝提交')
+
+
+def test_sqlite_claim_is_exclusive(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    first, second = SQLiteJobStore(path), SQLiteJobStore(path)
+    try:
+        first.add(Job('job-1', 'text', problem='1 + 1'))
+        assert first.claim('job-1') is not None
+        assert second.claim('job-1') is None
+        assert second.requeue_running() == 1
+        assert second.get('job-1').status == QUEUED
+    finally:
+        first.close()
+        second.close()
+
+
+def test_webhook_rejects_internal_addresses():
+    for url in ('http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://10.0.0.8/hook',
+                'http://192.168.1.1/hook', 'http://169.254.169.254/latest/meta-data',
+                'http://[::1]/hook', 'http://[::ffff:127.0.0.1]/hook', 'http://0.0.0.0/hook'):
+        assert not is_valid_webhook(url), url
+    for url in ('ftp://8.8.8.8/hook', 'file:///etc/passwd', 'http:///hook', ''):
+        assert not is_valid_webhook(url), url
+    assert is_valid_webhook('https://8.8.8.8/hook')
+
+
+def test_webhook_allowlist():
+    assert is_valid_webhook('http://localhost:8000/hook', ['localhost'])
+    assert is_valid_webhook('http://LocalHost./hook', ['localhost'])
+    assert not is_valid_webhook('https://8.8.8.8/hook', ['localhost'])
+
+
+def _serve(handler):
+    server = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_webhook_does_not_follow_redirects():
+    hits = []
+
+    class Target(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    target = _serve(Target)
+
+    class Redirect(Target):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.send_response(307)
+            self.send_header('Location', f'http://127.0.0.1:{target.server_port}/internal')
+            self.end_headers()
+
+    redirect = _serve(Redirect)
+    try:
+        queue = JobQueue(FakeSolver(), webhook_allowed_hosts=['127.0.0.1'])
+        job = Job('job-1', 'text', problem='1 + 1', webhook=f'http://127.0.0.1:{redirect.server_port}/hook')
+        job.status = SUCCEEDED
+        queue._stop.set()  # 重试不等待
+        queue._notify(job)
+        assert hits == []
+        assert queue.webhook_failures == 1
+    finally:
+        target.shutdown()
+        redirect.shutdown()
+
+
+def test_webhook_rechecked_at_send_time():
+    queue = JobQueue(FakeSolver())
+    job = Job('job-1', 'text', problem='1 + 1', webhook='http://127.0.0.1:9/hook')
+    queue._notify(job)
+    assert queue.webhook_failures == 1
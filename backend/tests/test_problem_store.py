@@ -0,0 +1,80 @@
+"""解题记录：写入与全文检索、查询转义、来源登记、写入失败回滚"""
+
+import sqlite3
+
+import pytest
+
+from services.problem_store import ProblemStore, build_match_query, segment
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ProblemStore(str(tmp_path / 'problems.db'))
+    store.start()
+    yield store
+    store.close()
+
+
+def _flush(store):
+    store.stop()
+    store.start()
+
+
+def test_segment_splits_cjk_and_normalizes_width():
+    assert segment('解方程ＡＢ 2x') == '解 方 程 ab 2x'
+
+
+@pytest.mark.parametrize('query', [
+    '"', 'a"b', 'AND', 'OR NOT', 'NEAR(a b)', 'x*', '(1+2)', 'problem:面积', '^x', '-', '{problem}: x'
+])
+def test_match_query_escapes_fts_syntax(store, query):
+    store.record('k', '已知三角形的底为6厘米', '面积为12平方厘米', 'm', 'v1')
+    _flush(store)
+    # 用户输入中的 FTS5 运算符、引号和列过滤均按字面匹配，不会导致语法错误
+    result = store.search(query)
+    assert result['total'] == 0
+
+
+def test_match_query_quotes_each_term():
+    assert build_match_query('三角形 "面积"') == '"三 角 形" """ 面 积 """'
+    assert build_match_query('   ') is None
+
+
+def test_record_and_search(store):
+    store.record('k1', '已知三角形的底为6厘米，高为4厘米，求面积', '面积为12平方厘米', 'm', 'v1', 'text', 812.5)
+    store.record('k2', '解方程 2x + 5 = 13', 'x = 4', 'm', 'v1', 'prewarm')
+    store.record('k1', '已知三角形的底为6厘米，高为4厘米，求面积', '面积为 12 平方厘米', 'm', 'v1', 'text')
+    _flush(store)
+
+    result = store.search('三角形 面积')
+    assert result['total'] == 1
+    item = result['items'][0]
+    assert item['solution'] == '面积为 12 平方厘米'
+    assert item['source'] == 'text'
+    assert store.search('2x')['items'][0]['source'] == 'prewarm'
+    assert store.size() == 2
+
+    assert store.search('三角形', page=2, page_size=1)['items'] == []
+
+
+def test_failed_batch_is_rolled_back(store, monkeypatch):
+    original = store._write
+
+    def failing_write(batch):
+        with store._lock:
+            store._conn.execute(
+                "INSERT INTO problems (key, source, problem, solution, model, prompt_version, created_at, updated_at)"
+                " VALUES ('partial', 'text', '', '', 'm', 'v1', 0, 0)"
+            )
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(store, '_write', failing_write)
+    store.record('k1', '第一题', '解答', 'm', 'v1')
+    _flush(store)
+    assert not store._conn.in_transaction
+
+    monkeypatch.setattr(store, '_write', original)
+    store.record('k2', '第二题', '解答', 'm', 'v1')
+    _flush(store)
+    keys = [row[0] for row in store._conn.execute('SELECT key FROM problems')]
+    assert keys == ['k2']
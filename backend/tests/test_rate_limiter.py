@@ -0,0 +1,125 @@
+"""上游限流：并发上限排队、队列满丢弃、优先级挤出、截止时间预估与 Retry-After"""
+
+import asyncio
+import threading
+import time
+
+from services.ai_service import AIServiceOverloadedError, AIService
+from services.rate_limiter import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RateLimitShed, UpstreamLimiter, request_priority
+)
+
+
+def _acquire_in_thread(limiter, results, priority=PRIORITY_INTERACTIVE, timeout=None):
+    def run():
+        try:
+            with request_priority(priority, timeout):
+                lease = limiter.acquire()
+            results.append(('granted', priority))
+            lease.release()
+        except RateLimitShed as e:
+            results.append(('shed', priority, str(e)))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待条件超时')
+        time.sleep(0.005)
+
+
+def test_concurrency_limit_queues_until_release():
+    limiter = UpstreamLimiter(max_concurrency=1, max_queue=10, max_wait=5)
+    lease = limiter.acquire()
+    results = []
+    thread = _acquire_in_thread(limiter, results)
+    _wait_for(lambda: limiter.stats()['queue_depth'] == 1)
+    assert results == []
+    lease.release()
+    thread.join(2)
+    assert results == [('granted', PRIORITY_INTERACTIVE)]
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_queue_full_sheds_new_request():
+    limiter = UpstreamLimiter(max_concurrency=1, max_queue=1, max_wait=5)
+    lease = limiter.acquire()
+    results = []
+    waiting = _acquire_in_thread(limiter, results)
+    _wait_for(lambda: limiter.stats()['queue_depth'] == 1)
+    try:
+        limiter.acquire()
+    except RateLimitShed as e:
+        assert '队列已满' in str(e)
+    else:
+        raise AssertionError('队列已满时应丢弃同优先级的新请求')
+    lease.release()
+    waiting.join(2)
+    assert limiter.stats()['shed'] == 1
+
+
+def test_interactive_request_displaces_background():
+    limiter = UpstreamLimiter(max_concurrency=1, max_queue=1, max_wait=5)
+    lease = limiter.acquire()
+    results = []
+    background = _acquire_in_thread(limiter, results, PRIORITY_BACKGROUND)
+    _wait_for(lambda: limiter.stats()['queue_depth'] == 1)
+    interactive = _acquire_in_thread(limiter, results, PRIORITY_INTERACTIVE)
+    background.join(2)
+    assert results[0][:2] == ('shed', PRIORITY_BACKGROUND)
+    lease.release()
+    interactive.join(2)
+    assert results[1] == ('granted', PRIORITY_INTERACTIVE)
+
+
+def test_queue_timeout_sheds_waiting_request():
+    limiter = UpstreamLimiter(max_concurrency=1, max_queue=10, max_wait=5)
+    lease = limiter.acquire()
+    results = []
+    _acquire_in_thread(limiter, results, timeout=0.05).join(2)
+    lease.release()
+    assert results[0][:2] == ('shed', PRIORITY_INTERACTIVE)
+    assert '排队超时' in results[0][2]
+
+
+def test_rpm_shed_reports_retry_after():
+    limiter = UpstreamLimiter(rpm=1, max_wait=1)
+    limiter.acquire().release()
+    try:
+        limiter.acquire()
+    except RateLimitShed as e:
+        # 每分钟1个请求，令牌约60秒后补足
+        assert e.retry_after is not None and 50 < e.retry_after <= 60
+    else:
+        raise AssertionError('预计等待超过截止时间时应立即丢弃')
+
+
+def test_async_acquire_cancel_releases_slot():
+    async def run():
+        limiter = UpstreamLimiter(max_concurrency=1, max_queue=10, max_wait=5)
+        lease = limiter.acquire()
+        task = asyncio.ensure_future(limiter.aacquire())
+        await asyncio.sleep(0.02)
+        assert limiter.stats()['queue_depth'] == 1
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert limiter.stats()['queue_depth'] == 0
+        lease.release()
+        (await limiter.aacquire()).release()
+        assert limiter.stats()['in_flight'] == 0
+
+    asyncio.run(run())
+
+
+def test_shed_converts_to_overloaded_error_with_retry_after():
+    error = AIService._convert_error(object.__new__(AIService), RateLimitShed('上游限流队列已满', retry_after=3.5))
+    assert isinstance(error, AIServiceOverloadedError)
+    assert error.retry_after == 3.5
@@ -0,0 +1,130 @@
+"""上游重试与熔断：熔断器状态转换、退避与 Retry-After、重试预算、不可重试错误"""
+
+import time
+
+import httpx
+import openai
+import pytest
+
+from services.ai_service import AIService, AIServiceCircuitOpenError, CircuitBreaker, RetryPolicy
+
+
+def _status_error(status, headers=None):
+    request = httpx.Request('POST', 'http://upstream.invalid/v1/chat/completions')
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    if status == 429:
+        return openai.RateLimitError('rate limited', response=response, body=None)
+    if status == 400:
+        return openai.BadRequestError('bad request', response=response, body=None)
+    return openai.InternalServerError('server error', response=response, body=None)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED  # 成功后连续失败次数清零
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 29 < breaker.retry_after() <= 30
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_half_open_allows_single_trial(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 31)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # 试探请求进行中，其余请求仍被拒绝
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    monkeypatch.setattr(time, 'time', lambda: now + 62)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_disabled_breaker_never_opens():
+    breaker = CircuitBreaker(failure_threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_retry_delay_backoff_and_retry_after():
+    policy = RetryPolicy(max_retries=2, backoff_base=0.5, backoff_max=8.0)
+    assert 0 <= policy.next_delay(0, _status_error(500)) <= 0.5
+    assert 0 <= policy.next_delay(1, _status_error(500)) <= 1.0
+    assert policy.next_delay(2, _status_error(500)) is None
+
+    assert policy.next_delay(0, _status_error(429, {'retry-after': '3'})) == 3.0
+    # 上游要求等待的时间超过单次等待上限时不再重试
+    assert policy.next_delay(0, _status_error(429, {'retry-after': '60'})) is None
+
+
+def test_retry_budget_limits_retries():
+    policy = RetryPolicy(max_retries=5, backoff_base=0, budget_ratio=0.5, budget_cap=2)
+    assert policy.next_delay(0, _status_error(500)) == 0
+    assert policy.next_delay(0, _status_error(500)) == 0
+    assert policy.next_delay(0, _status_error(500)) is None
+    assert policy.stats()['budget_exhausted'] == 1
+
+    policy.on_request()
+    policy.on_request()
+    assert policy.next_delay(0, _status_error(500)) == 0
+
+
+def _service(failures, error, threshold=5):
+    service = AIService('key', 'http://upstream.invalid/v1', 'test-model',
+                        retry_policy=RetryPolicy(max_retries=2, backoff_base=0),
+                        circuit_breaker=CircuitBreaker(failure_threshold=threshold, reset_timeout=30))
+    calls = []
+
+    def call():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return 'ok'
+
+    return service, call, calls
+
+
+def test_transient_errors_are_retried():
+    service, call, calls = _service(2, _status_error(503))
+    assert service._call_with_retry(call) == 'ok'
+    assert len(calls) == 3
+    assert service.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_client_errors_are_not_retried_or_counted():
+    service, call, calls = _service(1, _status_error(400), threshold=1)
+    with pytest.raises(openai.BadRequestError):
+        service._call_with_retry(call)
+    assert len(calls) == 1
+    assert service.circuit_breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_circuit_fails_fast():
+    service, call, calls = _service(10, _status_error(500), threshold=2)
+    # 第二次失败触发熔断，随后的重试不再发往上游
+    with pytest.raises(AIServiceCircuitOpenError):
+        service._call_with_retry(call)
+    assert len(calls) == 2
+
+    with pytest.raises(AIServiceCircuitOpenError) as excinfo:
+        service._call_with_retry(call)
+    assert len(calls) == 2
+    assert excinfo.value.retry_after > 0
@@ -0,0 +1,127 @@
+"""相似题目索引：近似匹配与阈值、作用域与数字校验、容量与过期淘汰、持久化"""
+
+import json
+import sqlite3
+import time
+
+from services.similarity_index import SimilarityIndex, normalize_for_matching
+
+
+SCOPE = 'test-model:v2'
+
+
+def test_normalize_ignores_whitespace_punctuation_and_width():
+    assert normalize_for_matching('解方程： 2x + 5 = 13。') == normalize_for_matching('解方程:2x+5=13')
+    assert normalize_for_matching('ＡＢＣ') == 'abc'
+
+
+def test_match_above_threshold():
+    index = SimilarityIndex(threshold=0.85)
+    index.add('已知三角形的底为6厘米，高为4厘米，求三角形的面积。', '12平方厘米', SCOPE)
+    match = index.lookup('已知三角形的底为 6 厘米，高为 4 厘米，求三角形面积', SCOPE)
+    assert match is not None
+    assert match['solution'] == '12平方厘米'
+    assert match['similarity'] >= 0.85
+
+
+def test_below_threshold_misses():
+    problem = '已知三角形的底为6厘米，高为4厘米，求三角形的面积。'
+    variant = '已知三角形的底为6厘米，高为4厘米，求这个三角形的面积'  # Jaccard 约 0.81
+    strict, loose = SimilarityIndex(threshold=0.85), SimilarityIndex(threshold=0.8)
+    for index in (strict, loose):
+        index.add(problem, '12平方厘米', SCOPE)
+    assert strict.lookup(variant, SCOPE) is None
+    assert loose.lookup(variant, SCOPE) is not None
+
+    index = strict
+    assert index.lookup('已知长方形的长为6厘米，宽为4厘米，求长方形的周长。', SCOPE) is None
+    assert SimilarityIndex(threshold=0.1).lookup('任意题目', SCOPE) is None
+
+
+def test_different_numbers_or_scope_miss():
+    index = SimilarityIndex(threshold=0.5)
+    index.add('解方程 2x+5=13', 'x=4', SCOPE)
+    assert index.lookup('解方程 2x+5=15', SCOPE) is None
+    assert index.lookup('解方程 2x+5=13', 'other-model:v2') is None
+    assert index.lookup('解方程：2x + 5 = 13', SCOPE)['solution'] == 'x=4'
+
+
+def test_operators_decimals_and_signs_are_distinguished():
+    pairs = [
+        ('计算 3*4 的值', '计算 3/4 的值'),
+        ('求 35 + 12 的值', '求 3.5 + 1.2 的值'),
+        ('x+(-5)=3', 'x+5=3'),
+    ]
+    for solved, other in pairs:
+        assert normalize_for_matching(solved) != normalize_for_matching(other)
+        index = SimilarityIndex(threshold=0.1)
+        index.add(solved, '答案', SCOPE)
+        assert index.lookup(other, SCOPE) is None, other
+        assert index.lookup(solved.replace(' ', ''), SCOPE)['solution'] == '答案'
+
+
+def test_duplicate_add_is_ignored():
+    index = SimilarityIndex()
+    assert index.add('解方程 2x+5=13', 'x=4', SCOPE)
+    assert not index.add('解方程：2x + 5 = 13', 'x=4', SCOPE)
+    assert not index.add('', 'x=4', SCOPE)
+    assert index.stats()['size'] == 1
+
+
+def test_max_entries_evicts_oldest():
+    index = SimilarityIndex(max_entries=2)
+    for i in range(3):
+        index.add(f'计算第{i}题：{i}+{i}等于多少', str(i * 2), SCOPE)
+    assert index.lookup('计算第0题：0+0等于多少', SCOPE) is None
+    assert index.lookup('计算第2题：2+2等于多少', SCOPE)['solution'] == '4'
+    stats = index.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+
+
+def test_expired_entries_are_not_served():
+    index = SimilarityIndex(ttl=60)
+    index.add('解方程 2x+5=13', 'x=4', SCOPE)
+    for entry in index._entries.values():
+        entry['created_at'] = time.time() - 120
+    assert index.lookup('解方程 2x+5=13', SCOPE) is None
+    # 过期题目可重新加入
+    assert index.add('解方程 2x+5=13', 'x=4', SCOPE)
+    assert index.stats()['size'] == 1
+
+
+def test_persistence_keeps_entry_and_signature_together(tmp_path):
+    first = SimilarityIndex(directory=str(tmp_path), max_entries=2)
+    second = SimilarityIndex(directory=str(tmp_path), max_entries=2)
+    # 两个进程交替写入同一目录
+    first.add('解方程 2x+5=13', 'x=4', SCOPE)
+    second.add('解方程 3x+1=10', 'x=3', SCOPE)
+    first.add('解方程 4x-4=12', 'x=4', SCOPE)
+    first.close()
+    second.close()
+
+    reloaded = SimilarityIndex(directory=str(tmp_path), max_entries=2)
+    try:
+        assert reloaded.stats()['size'] == 2
+        assert reloaded.lookup('解方程 2x+5=13', SCOPE) is None
+        assert reloaded.lookup('解方程 3x+1=10', SCOPE)['solution'] == 'x=3'
+        assert reloaded.lookup('解方程 4x-4=12', SCOPE)['solution'] == 'x=4'
+    finally:
+        reloaded.close()
+
+
+def test_parameter_change_recomputes_signatures(tmp_path):
+    index = SimilarityIndex(directory=str(tmp_path), ngram=2)
+    index.add('已知三角形的底为6厘米，高为4厘米，求三角形的面积。', '12平方厘米', SCOPE)
+    index.close()
+
+    reloaded = SimilarityIndex(directory=str(tmp_path), ngram=3, threshold=0.6)
+    try:
+        assert reloaded.lookup('已知三角形的底为6厘米，高为4厘米，求三角形面积', SCOPE) is not None
+    finally:
+        reloaded.close()
+    conn = sqlite3.connect(str(tmp_path / 'index.db'))
+    params = json.loads(conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()[0])
+    conn.close()
+    assert params['ngram'] == 3
+
@@ -0,0 +1,173 @@
+"""请求合并：并发相同调用只执行一次，结果、错误与流式片段由所有等待者共享"""
+
+import asyncio
+import threading
+import time
+
+from services.single_flight import SingleFlight
+
+
+def _run_concurrently(target, count):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return '解答'
+
+    results, errors = _run_concurrently(lambda: flight.do('k', slow), 4)
+    assert results == ['解答'] * 4 and errors == [None] * 4
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert stats['upstream_calls'] == 1 and stats['coalesced'] == 3 and stats['in_flight'] == 0
+
+    # 调用结束后不再合并
+    assert flight.do('k', lambda: '新解答') == '新解答'
+
+
+def test_error_is_shared_and_not_cached():
+    flight = SingleFlight()
+
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError('上游失败')
+
+    results, errors = _run_concurrently(lambda: flight.do('k', failing), 3)
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    assert flight.do('k', lambda: '恢复') == '恢复'
+
+
+def test_stream_followers_replay_and_share_context():
+    flight = SingleFlight()
+    calls = []
+
+    def upstream(context):
+        calls.append(1)
+        context['model'] = 'backup-model'
+        for chunk in ('一', '二', '三'):
+            time.sleep(0.05)
+            yield chunk
+
+    def consume():
+        context = {}
+        chunks = list(flight.stream('k', lambda: upstream(context), context))
+        return chunks, context
+
+    results, errors = _run_concurrently(consume, 3)
+    assert errors == [None] * 3
+    assert len(calls) == 1
+    for chunks, context in results:
+        assert chunks == ['一', '二', '三']
+        assert context == {'model': 'backup-model'}
+
+
+def test_stream_leader_disconnect_keeps_followers_receiving():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def upstream():
+        calls.append(1)
+        yield '一'
+        release.wait(1)
+        yield '二'
+        yield '三'
+
+    leader = flight.stream('k', upstream)
+    assert next(leader) == '一'
+    follower = flight.stream('k', upstream)
+    assert next(follower) == '一'
+
+    # 发起者断开连接不会中断共享的上游调用
+    leader.close()
+    release.set()
+    assert list(follower) == ['二', '三']
+    assert len(calls) == 1
+    time.sleep(0.05)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_async_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return '解答'
+
+    async def main():
+        return await asyncio.gather(*(flight.ado('k', slow) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['解答'] * 5
+    assert len(calls) == 1
+
+
+def test_async_stream_followers_share_output():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        for chunk in ('一', '二'):
+            await asyncio.sleep(0.02)
+            yield chunk
+
+    async def consume():
+        return [chunk async for chunk in flight.astream('k', upstream)]
+
+    async def main():
+        return await asyncio.gather(*(consume() for _ in range(3)))
+
+    assert asyncio.run(main()) == [['一', '二']] * 3
+    assert len(calls) == 1
+
+
+def test_async_stream_leader_disconnect_keeps_followers_receiving():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        for chunk in ('一', '二', '三'):
+            await asyncio.sleep(0.02)
+            yield chunk
+
+    async def main():
+        leader = flight.astream('k', upstream)
+        assert await leader.__anext__() == '一'
+        follower = flight.astream('k', upstream)
+        await leader.aclose()
+        return [chunk async for chunk in follower]
+
+    # 跟随者在发起者断开后订阅，仍能从共享缓冲区收到完整输出
+    assert asyncio.run(main()) == ['一', '二', '三']
+    assert len(calls) == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    results, _ = _run_concurrently(lambda: flight.do(str(threading.get_ident()), lambda: time.sleep(0.05) or 1), 3)
+    assert results == [1, 1, 1]
+    assert flight.stats()['coalesced'] == 0
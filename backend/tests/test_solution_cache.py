@@ -0,0 +1,83 @@
+"""解答缓存：缓存键规范化、命中与未命中、容量淘汰与过期、SQLite持久化"""
+
+import time
+
+import pytest
+
+from services.solution_cache import (
+    MemorySolutionCache, SQLiteSolutionCache, create_solution_cache, make_cache_key
+)
+
+
+def test_key_ignores_layout_but_not_model_or_prompt_version():
+    key = make_cache_key('解方程：2x + 5 = 13', 'model-a', 'v1')
+    assert make_cache_key('解方程:2x + 5 = 13', 'model-a', 'v1') == key    # 全角冒号规范化为半角
+    assert make_cache_key('  解方程：2x +  5 = 13 ', 'model-a', 'v1') == key  # 连续空白
+    assert make_cache_key('解方程：2X + 5 = 13', 'model-a', 'v1') != key    # 大小写字母可能表示不同的量
+    assert make_cache_key('解方程：2x + 5 = 13', 'model-b', 'v1') != key
+    assert make_cache_key('解方程：2x + 5 = 13', 'model-a', 'v2') != key
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySolutionCache(max_entries=2, ttl=0)
+    return SQLiteSolutionCache(str(tmp_path / 'cache.db'), max_entries=2, ttl=0)
+
+
+def test_hit_and_miss(cache):
+    assert cache.get('a') is None
+    cache.set('a', '解答A')
+    assert cache.get('a') == '解答A'
+    cache.set('empty', '')
+    assert cache.get('empty') is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 2
+    assert stats['hit_rate'] == 0.3333
+    assert stats['size'] == 1
+
+
+def test_evicts_least_recently_used(cache):
+    cache.set('a', '解答A')
+    time.sleep(0.01)
+    cache.set('b', '解答B')
+    time.sleep(0.01)
+    assert cache.get('a') == '解答A'
+    time.sleep(0.01)
+    cache.set('c', '解答C')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == '解答A'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expired_entry_misses(monkeypatch):
+    cache = MemorySolutionCache(ttl=10)
+    cache.set('a', '解答A')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('a') is None
+    assert cache.size() == 0
+
+
+def test_sqlite_hit_does_not_write(tmp_path):
+    cache = SQLiteSolutionCache(str(tmp_path / 'cache.db'))
+    cache.set('a', '解答A')
+    changes = cache._conn.total_changes
+    assert cache.get('a') == '解答A'
+    assert cache._conn.total_changes == changes
+
+
+def test_sqlite_survives_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    SQLiteSolutionCache(path).set('a', '解答A')
+    assert SQLiteSolutionCache(path).get('a') == '解答A'
+
+
+def test_factory():
+    assert create_solution_cache('none', 10, 0) is None
+    assert isinstance(create_solution_cache('Memory', 10, 0), MemorySolutionCache)
+    with pytest.raises(ValueError):
+        create_solution_cache('redis', 10, 0)
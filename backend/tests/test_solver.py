@@ -0,0 +1,162 @@
+"""解题调度：多后端路由切换时按实际给出解答的模型返回、缓存与登记"""
+
+import asyncio
+import threading
+import time
+
+from services.ai_service import AIServiceConnectionError, note_answer
+from services.provider_pool import ProviderPool
+from services.similarity_index import SimilarityIndex
+from services.solution_cache import MemorySolutionCache, make_cache_key
+from services.solver import ProblemSolver
+
+
+PROBLEM = '已知三角形的底为6厘米，高为4厘米，求三角形的面积。'
+
+
+class FakeService:
+    """按 AIService 接口返回固定解答的上游，down 为 True 时模拟连接失败"""
+
+    def __init__(self, model, solution='**最终答案**: 12平方厘米', down=False, delay=0.0):
+        self.model = model
+        self.api_base = f'http://{model}.invalid/v1'
+        self.solution = solution
+        self.down = down
+        self.delay = delay
+        self.calls = 0
+
+    @property
+    def models(self):
+        return [self.model]
+
+    def _answer(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.down:
+            raise AIServiceConnectionError(f'{self.model} 不可用')
+        note_answer(model=self.model)
+        return self.solution
+
+    def solve_problem(self, problem):
+        return self._answer()
+
+    async def asolve_problem(self, problem):
+        return self._answer()
+
+    def stream_solve_problem(self, problem):
+        solution = self._answer()
+        yield solution[:4]
+        yield solution[4:]
+
+    async def astream_solve_problem(self, problem):
+        solution = self._answer()
+        yield solution[:4]
+        yield solution[4:]
+
+
+class FakeStore:
+    def __init__(self):
+        self.records = []
+
+    def record(self, key, problem, solution, model, prompt_version, source, elapsed_ms=None):
+        self.records.append({'key': key, 'model': model, 'source': source})
+
+
+def _solver(primary_down=True, similarity_index=None):
+    primary, backup = FakeService('primary-model', down=primary_down), FakeService('backup-model')
+    pool = ProviderPool([primary, backup])
+    solver = ProblemSolver(pool, primary, cache=MemorySolutionCache(100, 0),
+                           similarity_index=similarity_index, store=FakeStore())
+    return solver, primary, backup
+
+
+def test_failover_reports_and_caches_backup_model():
+    solver, primary, backup = _solver()
+    result = solver.solve_text(PROBLEM)
+    assert result['model'] == 'backup-model'
+    assert result['cached'] is False
+    assert solver.store.records == [{
+        'key': make_cache_key(PROBLEM, 'backup-model', 'v1'), 'model': 'backup-model', 'source': 'text'
+    }]
+    assert solver.cache.get(make_cache_key(PROBLEM, 'backup-model', 'v1'))
+    assert solver.cache.get(make_cache_key(PROBLEM, 'primary-model', 'v1')) is None
+
+    hit = solver.solve_text(PROBLEM)
+    assert hit['cached'] is True and hit['cache_type'] == 'exact'
+    assert hit['model'] == 'backup-model'
+    assert backup.calls == 1
+
+
+def test_primary_answer_keeps_primary_model():
+    solver, primary, backup = _solver(primary_down=False)
+    assert solver.solve_text(PROBLEM)['model'] == 'primary-model'
+    assert backup.calls == 0
+
+
+def test_similar_hit_reports_answering_model():
+    solver, _, _ = _solver(similarity_index=SimilarityIndex(threshold=0.85))
+    solver.solve_text(PROBLEM)
+    hit = solver.solve_text('已知三角形的底为 6 厘米，高为 4 厘米，求三角形面积')
+    assert hit['cache_type'] == 'similar'
+    assert hit['model'] == 'backup-model'
+
+
+def test_stream_meta_reports_backup_model():
+    solver, _, _ = _solver()
+    events = list(solver.stream_text(PROBLEM))
+    assert [event for event, _ in events] == ['meta', 'delta', 'delta', 'done']
+    assert events[0][1]['model'] == 'backup-model'
+    assert solver.store.records[0]['model'] == 'backup-model'
+
+    replay = list(solver.stream_text(PROBLEM))
+    assert replay[0][1] == {'model': 'backup-model', 'cached': True, 'cache_type': 'exact'}
+
+
+def test_async_paths_report_backup_model():
+    solver, _, _ = _solver()
+    result = asyncio.run(solver.asolve_text(PROBLEM))
+    assert result['model'] == 'backup-model'
+
+    async def collect():
+        return [item async for item in solver.astream_text('求 1+2 的值')]
+
+    events = asyncio.run(collect())
+    assert events[0] == ('meta', {'model': 'backup-model', 'cached': False, 'cache_type': None})
+    assert [record['model'] for record in solver.store.records] == ['backup-model', 'backup-model']
+
+
+def test_source_is_recorded():
+    solver, _, _ = _solver(primary_down=False)
+    solver.solve_text(PROBLEM, source='prewarm')
+    assert solver.store.records[0]['source'] == 'prewarm'
+
+
+def test_coalesced_requests_store_once():
+    solver, primary, backup = _solver(primary_down=False)
+    primary.delay = backup.delay = 0.1
+
+    def run(target):
+        threads = [threading.Thread(target=target) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+    run(lambda: solver.solve_text(PROBLEM))
+    run(lambda: list(solver.stream_text('求 1+2 的值')))
+    assert primary.calls + backup.calls == 2
+    assert solver.cache.stats()['size'] == 2
+    assert [record['source'] for record in solver.store.records] == ['text', 'text']
+
+
+def test_stream_is_stored_after_leader_disconnects():
+    solver, primary, backup = _solver(primary_down=False)
+    events = solver.stream_text(PROBLEM)
+    assert next(events)[0] == 'meta'
+    events.close()
+
+    time.sleep(0.05)
+    assert len(solver.store.records) == 1
+    assert solver.solve_text(PROBLEM)['cached'] is True
+    assert primary.calls + backup.calls == 1
@@ -0,0 +1,85 @@
+"""上游用量统计：流式调用请求 include_usage，最后一个片段中的用量与缓存命中token数计入指标"""
+
+import asyncio
+from types import SimpleNamespace
+
+from services import metrics
+from services.ai_service import AIService
+
+
+def _chunk(content=None, usage=None):
+    choices = [] if content is None else [SimpleNamespace(delta=SimpleNamespace(content=content), finish_reason=None)]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+USAGE = SimpleNamespace(prompt_tokens=900, completion_tokens=20, total_tokens=920,
+                        prompt_tokens_details=SimpleNamespace(cached_tokens=768))
+CHUNKS = [_chunk('12'), _chunk('平方厘米'), _chunk(usage=USAGE)]
+
+
+class _Stream:
+    def __init__(self):
+        self.chunks = iter(CHUNKS)
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        pass
+
+
+class _AsyncStream(_Stream):
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def close(self):
+        pass
+
+
+def _tokens(model, kind):
+    return metrics.UPSTREAM_TOKENS._values.get((model, kind), 0)
+
+
+def test_completion_params_request_stream_usage():
+    service = AIService('key', 'http://upstream.invalid/v1', 'test-model')
+    messages = [{'role': 'user', 'content': '求 1+2 的值'}]
+    assert service._completion_params(messages, stream=True)['stream_options'] == {'include_usage': True}
+    assert 'stream_options' not in service._completion_params(messages)
+
+
+def test_stream_usage_chunk_is_counted(monkeypatch):
+    service = AIService('key', 'http://upstream.invalid/v1', 'usage-model')
+    requests = []
+
+    def create(**params):
+        requests.append(params)
+        return _Stream()
+
+    monkeypatch.setattr(service.client.chat.completions, 'create', create)
+    messages = [{'role': 'user', 'content': '求三角形的面积'}]
+    assert ''.join(service._stream_completion(messages)) == '12平方厘米'
+    assert requests[0]['stream_options'] == {'include_usage': True}
+    assert _tokens('usage-model', 'prompt') == 900
+    assert _tokens('usage-model', 'completion') == 20
+    assert _tokens('usage-model', 'cached') == 768
+
+
+def test_async_stream_usage_chunk_is_counted(monkeypatch):
+    service = AIService('key', 'http://upstream.invalid/v1', 'async-usage-model')
+
+    async def create(**params):
+        return _AsyncStream()
+
+    monkeypatch.setattr(service.async_client.chat.completions, 'create', create)
+
+    async def collect():
+        return [chunk async for chunk in service._astream_completion([{'role': 'user', 'content': '求面积'}])]
+
+    assert ''.join(asyncio.run(collect())) == '12平方厘米'
+    assert _tokens('async-usage-model', 'cached') == 768
@@ -4,12 +4,13 @@
  */
 
 $(document).ready(function() {
-<<<<<<< HEAD
     // API配置
-=======
-    // 配置
->>>>>>> dfd5478b2891ec89ac876277be135da52ebb8d54
     const API_BASE_URL = 'http://localhost:5000/api';
+
+    // 是否支持流式接收解答（fetch + ReadableStream）
+    const supportsStreaming = typeof window.fetch === 'function' &&
+        typeof window.ReadableStream === 'function' &&
+        typeof window.TextDecoder === 'function';
     
     // 全局变量
     let selectedImage = null;
@@ -185,12 +186,21 @@ $(document).ready(function() {
             return;
         }
         
-        // 显示加载动画
-        showLoading();
-        
         // 准备表单数据
         const formData = new FormData();
         formData.append('image', selectedImage);
+
+        // 优先使用流式接口，边生成边显示
+        if (supportsStreaming) {
+            streamSolve(`${API_BASE_URL}/solve-image/stream`, {
+                method: 'POST',
+                body: formData
+            }, { type: 'image', problem: '图片题目' });
+            return;
+        }
+        
+        // 显示加载动画
+        showLoading();
         
         // 调用API
         $.ajax({
@@ -205,7 +215,7 @@ $(document).ready(function() {
                     // 添加到搜题记录
                     addSearchHistory({
                         type: 'image',
-                        problem: '图片题目',
+                        problem: response.data.problem || '图片题目',
                         solution: response.data.solution,
                         timestamp: new Date().getTime()
                     });
@@ -230,6 +240,16 @@ $(document).ready(function() {
             return;
         }
         
+        // 优先使用流式接口，边生成边显示
+        if (supportsStreaming) {
+            streamSolve(`${API_BASE_URL}/solve/stream`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ problem })
+            }, { type: 'text', problem: problem });
+            return;
+        }
+        
         // 显示加载动画
         showLoading();
         
@@ -261,6 +281,184 @@ $(document).ready(function() {
         });
     }
 
+    // 流式解题：逐段接收SSE事件并增量渲染解答
+    function streamSolve(url, options, record) {
+        showLoading();
+
+        let solution = '';
+        let started = false;
+        let finished = false;
+        let renderPending = false;
+
+        // 合并同一帧内的多次增量，避免频繁重新渲染
+        function scheduleRender() {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(() => {
+                renderPending = false;
+                if (!finished) {
+                    renderSolution(solution);
+                }
+            });
+        }
+
+        function fail(message) {
+            finished = true;
+            hideLoading();
+            $('#solutionText').removeClass('streaming');
+            showToast(message || '获取解答失败');
+        }
+
+        function handleEvent(event, data) {
+            if (event === 'meta') {
+                started = true;
+                hideLoading();
+                // 图片题目以识别出的题目文本记录
+                record.problem = data.problem || record.problem;
+                showStreamingResult(data.problem);
+            } else if (event === 'delta') {
+                solution += data.content;
+                scheduleRender();
+            } else if (event === 'done') {
+                finished = true;
+                $('#solutionText').removeClass('streaming');
+                renderSolution(solution);
+                // 添加到搜题记录
+                addSearchHistory({
+                    type: record.type,
+                    problem: record.problem,
+                    solution: solution,
+                    timestamp: new Date().getTime()
+                });
+            } else if (event === 'error') {
+                fail(data.error);
+            }
+        }
+
+        fetch(url, options).then((response) => {
+            const contentType = response.headers.get('Content-Type') || '';
+
+            // 参数错误等情况后端直接返回JSON
+            if (!response.ok || contentType.indexOf('text/event-stream') === -1) {
+                return response.json().catch(() => ({})).then((body) => {
+                    hideLoading();
+                    if (body && body.error) {
+                        showToast(body.error);
+                    } else {
+                        handleAPIError({ status: response.status });
+                    }
+                });
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder('utf-8');
+            let buffer = '';
+
+            function read() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        if (!finished) {
+                            fail(started ? '连接中断，解答可能不完整' : '获取解答失败');
+                        }
+                        return;
+                    }
+
+                    buffer += decoder.decode(value, { stream: true });
+
+                    // SSE消息以空行分隔
+                    let boundary;
+                    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                        const message = parseSSEMessage(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        if (message) {
+                            handleEvent(message.event, message.data);
+                        }
+                    }
+
+                    return read();
+                });
+            }
+
+            return read();
+        }).catch(() => {
+            if (started) {
+                fail('连接中断，解答可能不完整');
+            } else {
+                hideLoading();
+                handleAPIError({ status: 0 });
+            }
+        });
+    }
+
+    // 解析一条SSE消息
+    function parseSSEMessage(raw) {
+        let event = 'message';
+        const dataLines = [];
+
+        raw.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+
+        if (dataLines.length === 0) return null;
+
+        try {
+            return { event, data: JSON.parse(dataLines.join('\n')) };
+        } catch (e) {
+            return null;
+        }
+    }
+
+    // 显示流式结果区域（解答内容随后增量填充）
+    function showStreamingResult(problem) {
+        $('#inputSection').fadeOut(300);
+        $('#globalBackBtn').fadeIn(300);
+
+        $('#problemText').text(problem);
+        $('#solutionText').empty().addClass('streaming');
+
+        setTimeout(() => {
+            $('#resultSection').fadeIn(300);
+        }, 300);
+    }
+
+    // 渲染解答内容（Markdown、最终答案高亮、代码高亮）
+    function renderSolution(solution) {
+        if (typeof marked !== 'undefined') {
+            marked.setOptions({
+                breaks: true,
+                gfm: true,
+                highlight: (code, lang) => {
+                    if (typeof hljs !== 'undefined' && lang && hljs.getLanguage(lang)) {
+                        try {
+                            return hljs.highlight(code, { language: lang }).value;
+                        } catch (err) {}
+                    }
+                    return code;
+                }
+            });
+
+            let renderedHtml = marked.parse(solution);
+            
+            // 高亮最终答案
+            renderedHtml = highlightFinalAnswer(renderedHtml);
+            
+            $('#solutionText').html(renderedHtml);
+
+            // 应用代码高亮
+            if (typeof hljs !== 'undefined') {
+                $('#solutionText pre code').each((i, block) => {
+                    hljs.highlightElement(block);
+                });
+            }
+        } else {
+            $('#solutionText').text(solution);
+        }
+    }
+
     // 显示结果
     function showResult(data) {
         // 隐藏输入区域
@@ -273,37 +471,8 @@ $(document).ready(function() {
             // 填充题目
             $('#problemText').text(data.problem);
 
-            // 渲染Markdown
-            if (typeof marked !== 'undefined') {
-                marked.setOptions({
-                    breaks: true,
-                    gfm: true,
-                    highlight: (code, lang) => {
-                        if (typeof hljs !== 'undefined' && lang && hljs.getLanguage(lang)) {
-                            try {
-                                return hljs.highlight(code, { language: lang }).value;
-                            } catch (err) {}
-                        }
-                        return code;
-                    }
-                });
-
-                let renderedHtml = marked.parse(data.solution);
-                
-                // 高亮最终答案
-                renderedHtml = highlightFinalAnswer(renderedHtml);
-                
-                $('#solutionText').html(renderedHtml);
-
-                // 应用代码高亮
-                if (typeof hljs !== 'undefined') {
-                    $('#solutionText pre code').each((i, block) => {
-                        hljs.highlightElement(block);
-                    });
-                }
-            } else {
-                $('#solutionText').text(data.solution);
-            }
+            // 渲染解答
+            renderSolution(data.solution);
 
             // 显示结果区域
             $('#resultSection').fadeIn(300);
@@ -580,32 +749,7 @@ $(document).ready(function() {
 
         setTimeout(() => {
             // 填充解答内容
-            if (typeof marked !== 'undefined') {
-                marked.setOptions({
-                    breaks: true,
-                    gfm: true,
-                    highlight: (code, lang) => {
-                        if (typeof hljs !== 'undefined' && lang && hljs.getLanguage(lang)) {
-                            try {
-                                return hljs.highlight(code, { language: lang }).value;
-                            } catch (err) {}
-                        }
-                        return code;
-                    }
-                });
-
-                let renderedHtml = marked.parse(item.solution);
-                renderedHtml = highlightFinalAnswer(renderedHtml);
-                $('#solutionText').html(renderedHtml);
-
-                if (typeof hljs !== 'undefined') {
-                    $('#solutionText pre code').each((i, block) => {
-                        hljs.highlightElement(block);
-                    });
-                }
-            } else {
-                $('#solutionText').text(item.solution);
-            }
+            renderSolution(item.solution);
 
             $('#resultSection').fadeIn(300);
         }, 300);